@@ -7,6 +7,7 @@ from .models import Backend, Job, Task, Step, Parameter, Result, Validator
 from .models import Submission, BackendUser, Message, Environment, QueueType
 from .models import Batch, Configuration
 from .forms import *
+from .tasks import cancel_submission
 
 
 class ConfigurationInline(admin.TabularInline):
@@ -61,9 +62,12 @@ class BackendAdmin(admin.ModelAdmin):
         # ('Configuration', {'fields': ['server_type', 'ip', 'port']}),
         ('Configuration', {'fields': ['queue_type']}),
         ('Path', {'fields': ['root_path']}),
+        ('Load', {'fields': ['running', 'free_disk']}),
     ]
+    # kept by the workers and reconciled by reap_stuck_submissions
+    readonly_fields = ('running', 'free_disk')
     # list_display = ('name', 'server_type', 'ip', 'port', 'root_path')
-    list_display = ('name', 'queue_type', 'root_path')
+    list_display = ('name', 'queue_type', 'root_path', 'running')
     inlines = [BackendUserInline]
 
 
@@ -88,7 +92,8 @@ class TaskAdmin(admin.ModelAdmin):
 
     fieldsets = [
         (None,               {'fields': ['name']}),
-        ('Details', {'fields': ['backend', 'description', 'in_glob',
+        ('Details', {'fields': ['backend', 'backends', 'description',
+                                'in_glob',
                                 'out_glob', 'stdout_glob', 'executable']}),
         ('Job termination behaviour', {'fields': ['incomplete_outputs_behaviour',
                                                   'custom_exit_status',
@@ -136,8 +141,29 @@ class JobAdmin(admin.ModelAdmin):
         return task_list
 
 
+def cancel_submissions(modeladmin, request, queryset):
+    cancelled = 0
+    for s in queryset.select_related('batch'):
+        if cancel_submission(s, "Cancelled by an administrator"):
+            cancelled += 1
+    modeladmin.message_user(request, "Cancelled %d submissions" % cancelled)
+
+
+cancel_submissions.short_description = "Cancel selected submissions"
+
+
+def cancel_batches(modeladmin, request, queryset):
+    submissions = Submission.objects.filter(batch__in=queryset,
+                                            status__lte=Submission.RUNNING)
+    cancel_submissions(modeladmin, request, submissions)
+
+
+cancel_batches.short_description = "Cancel selected batches"
+
+
 class SubmissionAdmin(admin.ModelAdmin):
     inlines = [ResultInline, MessageInline]
+    actions = [cancel_submissions]
     # list_display = ('pk', 'link_to_Job', 'link_to_Batch', 'submission_name',
     #                 'priority', 'email', 'UUID', 'ip', 'status', 'claimed',
     #                 'hostname',
@@ -204,6 +230,7 @@ class ResultAdmin(admin.ModelAdmin):
 
 class BatchAdmin(admin.ModelAdmin):
     list_display = ('pk', 'UUID', 'status')
+    actions = [cancel_batches]
 
 
 # Register your models here.
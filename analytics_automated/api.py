@@ -1,8 +1,10 @@
+import os
+import re
 import ast
 import uuid
+import itertools
 from ipware.ip import get_client_ip
 from collections import defaultdict
-import pprint
 import logging
 import string
 import keyword
@@ -13,13 +15,16 @@ import scipy.stats as stats
 from celery import chain
 
 from django import forms
+from django.core.files.base import ContentFile
 from django.utils.datastructures import MultiValueDictKeyError
 from django.conf import settings
-from django.db.models import F, Func
+from django.db import transaction
+from django.db.models import F, Func, Avg, Count
 
 from rest_framework import viewsets
 from rest_framework import mixins
 from rest_framework import generics
+from rest_framework import views
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework import request
@@ -28,8 +33,15 @@ from rest_framework.parsers import FormParser
 
 from .serializers import SubmissionInputSerializer, SubmissionOutputSerializer
 from .serializers import JobSerializer, BatchSerializer, JobDetailSerializer
-from .models import Job, Submission, Backend, Batch
-from .forms import SubmissionForm
+from .models import Job, Submission, Backend, Batch, Validator
+from .models import InputBlob, ActiveSubmissionCount, StepTiming
+from .models import HeldSubmission
+from .forms import SubmissionForm, input_view
+from .plans import get_plan, dispatch_chains
+from .routing import Placement
+from .fairshare import client_weight, release_held
+from .uploads import upload_rejected
+from .metrics import count_submissions
 from .tasks import *
 from .validators import *
 from .r_keywords import *
@@ -37,6 +49,9 @@ from .cmdline import *
 
 logger = logging.getLogger(__name__)
 
+INVALID_PARAM_CHARS = frozenset(set(string.punctuation+string.whitespace) -
+                                set('.'))
+
 
 class BatchDetails(mixins.RetrieveModelMixin,
                    generics.GenericAPIView):
@@ -65,99 +80,41 @@ class SubmissionDetails(mixins.RetrieveModelMixin,
     lookup_field = 'UUID'
     parser_classes = (MultiPartParser, FormParser,)
 
-    def __build_params(self, task, request_data):
-        params = []
-        param_values = {}
-        parameters = task.parameters.all().order_by("id")
-        for param in parameters:
-            if "VALUE" in param.flag:
-                continue
-            if param.bool_valued is True:
-                # omit flag if user set false if not fail over to including it
-                if param.rest_alias in request_data and \
-                 (request_data[param.rest_alias] == 'FALSE' or
-                  request_data[param.rest_alias] == 'False' or
-                  request_data[param.rest_alias] == 'False'):
-                    params.append('')
-                else:
-                    params.append(param.flag)
-            else:
-                params.append(param.flag)
-                if param.rest_alias in request_data:
-                    param_values[param.flag] = {}
-                    param_values[param.flag]['value'] = request_data[param.rest_alias]
-                    param_values[param.flag]['switchless'] = param.switchless
-                    param_values[param.flag]['spacing'] = param.spacing
-                else:
-                    param_values[param.flag] = {}
-                    param_values[param.flag]['value'] = param.default
-                    param_values[param.flag]['switchless'] = param.switchless
-                    param_values[param.flag]['spacing'] = param.spacing
-
-        return(params, param_values)
-
-    def __return_value(self, task, request_data):
-        options = {}
-        params = task.parameters.all().filter(bool_valued=False)
-        for param in params:
-            if "VALUE" in param.flag:
-                if param.rest_alias in request_data:
-                    return request_data[param.rest_alias]
-                else:
-                    return param.default
-        return ''
-
-    def __build_environment(self, task):
-        environment = {}
-        envs = task.environment.all()
-        for env in envs:
-            environment[env.env] = env.value
-        return(environment)
-    def __test_params(self, steps, request_data):
+    def __test_params(self, schema, request_data):
         """
             Check that the list of additional params the tasks take
             has been provided by the user
         """
-        param_members = self.__assess_param_membership(steps, request_data)
+        param_members = self.__assess_param_membership(schema, request_data)
         if not param_members[0]:
             return(param_members)
 
-        param_sanity = self.__assess_param_value_sanity(steps, request_data)
+        param_sanity = self.__assess_param_value_sanity(request_data)
         if not param_sanity[0]:
             return(param_sanity)
         return([True, ""])
 
-    def __assess_param_value_sanity(self, steps, request_data):
-        pythkw = list(keyword.kwlist)
-        pythkw.remove('in')
-        invalid = set(string.punctuation+string.whitespace)
-        invalid.remove('.')
+    def __assess_param_value_sanity(self, request_data):
+        forbidden = forbidden_token_index()
         for field in request_data:
-            # print(field)
-            if any(char in invalid for char in str(request_data[field])):
-                return([False, "Incoming data can not contain punctuation: "+kw])  # don't allow punctuation chars
-            for kw in pythkw:
-                if kw == str(request_data[field]):
-                    return([False, "Incoming data can not contain python keyords: "+kw])  # don't allow python keywords
-            for kw in rkwlist:
-                if kw == str(request_data[field]):
-                    return([False, "Incoming data can not contain R keywords: "+kw])  # don't allow R keywords
-            local_cmds = return_local_commands()
-            for kw in local_cmds:
-                if kw == str(request_data[field]):
-                    return([False, "Incoming data can not contain unix commands: "+kw])  # don't allow unix commd
+            value = str(request_data[field])
+            for char in value:
+                if char in INVALID_PARAM_CHARS:
+                    return([False, "Incoming data can not contain "
+                                   "punctuation: "+char])
+            if value in forbidden:
+                # don't allow python or R keywords or unix commands
+                return([False, "Incoming data can not contain " +
+                               forbidden[value]+": "+value])
         return([True, ""])
 
-    def __assess_param_membership(self, steps, request_data):
-        aliases = []
-        for step in steps:
-            params = Parameter.objects.filter(task=step.task)
-            for param in params:
-                aliases.append(param.rest_alias)
-        if all(name in request_data for name in aliases):
+    def __assess_param_membership(self, schema, request_data):
+        if schema.has_all_aliases(request_data):
             return([True, ""])
         else:
-            return([False, "You are missing a required parameter in your web form submission"])
+            return([False, "You are missing a required parameter in your web "
+                           "form submission: " +
+                           ", ".join(schema.missing_aliases(request_data))])
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -182,6 +139,8 @@ class SubmissionDetails(mixins.RetrieveModelMixin,
             data['submission_name'] = request_contents.pop('submission_name')
             data['email'] = request_contents.pop('email')
             data['job'] = request_contents.pop('job')
+            data['split_fasta'] = request_contents.pop('split_fasta', '') \
+                in ('TRUE', 'True', 'true')
             data['ip'] = get_client_ip(request)[0]
             # data['UUID'] = str(uuid.uuid1())
         except MultiValueDictKeyError:
@@ -190,196 +149,405 @@ class SubmissionDetails(mixins.RetrieveModelMixin,
             raise KeyError
         return(data, request_contents)
 
-    def __construct_chain_string(self, steps, request_contents, UUID,
-                                 job_priority):
-        """
-            Function takes all the step and task information for a given job
-            and returns a valid celery string
-        """
-        total_steps = len(steps)
-        chord_end = False
-        current_step = 0
-        step_counter = 1
-        prev_step = None
-        queue_name = 'celery'
-        flags = {}
-        options = {}
-        value = ''
-
-        if total_steps > 1:
-            if steps[total_steps-1].ordering == steps[total_steps-2].ordering:
-                total_steps += 1
-                chord_end = True
-
-        task_strings = {}
-        # loop over steps and build the subtask string for each
-        # track which have the same step priority
-        # build group() for any which have equivalent priority
-        # where priority list > 1
-        # insert subtask or group in to chain()()
-
-        for step in steps:
-            (params, param_values) = self.__build_params(step.task, request_contents)
-            value = self.__return_value(step.task, request_contents)
-            environment = self.__build_environment(step.task)
-
-            queue_name = str(step.task.backend.queue_type)
-            if job_priority is Submission.LOW:
-                queue_name = "low_"+queue_name
-            if job_priority is Submission.HIGH:
-                queue_name = "high_"+queue_name
-
-            if step.ordering != prev_step:
-                current_step += 1
-
-            # tchain += "task_runner.si('%s',%i,%i,%i,'%s') | " \
-            task_string = "task_runner.subtask(('%s', %i, %i, %i, %i, '%s', " \
-                          "%s, %s, '%s', %i, %s), " \
-                          "immutable=True, queue='%s')" \
-                          % (UUID,
-                             step.ordering,
-                             current_step,
-                             step_counter,
-                             total_steps,
-                             step.task.name,
-                             params,
-                             pprint.pformat(param_values).replace('\n',''),
-                             value,
-                             step.task.backend.queue_type.execution_behaviour,
-                             environment,
-                             queue_name)
-
-            if step.ordering in task_strings:
-                task_strings[step.ordering].append(task_string)
-            else:
-                task_strings[step.ordering] = [task_string]
-            prev_step = step.ordering
-            step_counter += 1
-
-        tchain = "chain("
-        for key in sorted(task_strings):
-            if len(task_strings[key]) > 1:
-                tchain += "group("
-            for task_string in task_strings[key]:
-                tchain += task_string+", "
-            if len(task_strings[key]) > 1:
-                tchain = tchain[:-2]
-                tchain += "), "
-        tchain = tchain[:-2]
-
-        # This hack means that a job which ends in a chord won't complete
-        # during the chord
-        if chord_end is True:
-            tchain += ", chord_end.subtask(('%s', %i, %i), " \
-                      "immutable=True, queue='%s')" \
-                      % (UUID, current_step, total_steps, queue_name)
-        tchain += ',).apply_async()'
-
-        # print(tchain)
-
-        logger.debug("TASK COMMAND: "+tchain)
-        return(tchain)
-
     def __get_job(self, job_name):
-        job_ids = []
-        for name in job_name.split(","):
-            if Job.objects.filter(name=name).exists():
-                job_ids.append(Job.objects.get(name=name).pk)
-            else:
+        names = job_name.split(",")
+        found = {}
+        for job in Job.objects.filter(name__in=names):
+            found[job.name] = job
+        jobs = []
+        for name in names:
+            if name not in found:
                 raise ValueError
-        return job_ids
+            jobs.append(found[name])
+        return jobs
 
     def __get_job_priority(self, logged_in, ip_address):
-        subs = Submission.objects.filter(ip=ip_address, status__lte=1)
+        active = ActiveSubmissionCount.lookup(ip_address)
         # logged in users get the priority given i settings or bumped down
         # by one if they have exceeded the soft limit
         priority = settings.DEFAULT_JOB_PRIORITY
         if logged_in:
             priority = settings.LOGGED_IN_JOB_PRIORITY
 
+        # fair share queues heavy users' jobs behind everyone else's
+        # rather than bouncing them
+        if settings.FAIR_SHARE:
+            return priority, active
+
         if settings.QUEUE_HOG_SIZE is None and \
            settings.QUEUE_HARD_LIMIT is None:
-            return priority, len(subs)
+            return priority, active
 
         if settings.QUEUE_HOG_SIZE is None and \
            settings.QUEUE_HARD_LIMIT >= 0:
-            if len(subs) >= settings.QUEUE_HARD_LIMIT:
-                return None, len(subs)
+            if active >= settings.QUEUE_HARD_LIMIT:
+                return None, active
             else:
-                return priority, len(subs)
+                return priority, active
 
         if settings.QUEUE_HOG_SIZE >= 0 and \
            settings.QUEUE_HARD_LIMIT is None:
-            if len(subs) >= settings.QUEUE_HOG_SIZE:
-                return priority-1, len(subs)
+            if active >= settings.QUEUE_HOG_SIZE:
+                return priority-1, active
             else:
-                return priority, len(subs)
+                return priority, active
 
         # anyone who excees the hardlimt gets bounced
-        if len(subs) >= settings.QUEUE_HARD_LIMIT:
-            return None, len(subs)
+        if active >= settings.QUEUE_HARD_LIMIT:
+            return None, active
 
-        if len(subs) >= settings.QUEUE_HOG_SIZE and \
-           len(subs) < settings.QUEUE_HARD_LIMIT:
+        if active >= settings.QUEUE_HOG_SIZE and \
+           active < settings.QUEUE_HARD_LIMIT:
             if priority > 0:
-                return priority-1, len(subs)
+                return priority-1, active
             else:
-                return None, len(subs)
+                return None, active
 
-        return priority, len(subs)
+        return priority, active
 
-    def __submit_job(self, data, request_contents, job_priority, request,
-                     masterUUID, batch):
-        try:
-            request.FILES.get("input_data").seek(0)
-        except Exception as E:
-            pass
-
-        submission_form = SubmissionForm(data, request.FILES)
-        if submission_form.is_valid():
-            s = submission_form.save()
-            s.priority = job_priority
-            s.batch = batch
-            s.save()
-            # Send to the Job Queue and set queued message if that is a success
-            job = Job.objects.get(name=s.job)
-            steps = job.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-            # 1. Look up tasks in a job
-            # 2. Order tasks by their step id
-
-            # Check we have the params we want and then build the list of
-            # params we'll pass to the task runner.
-            # 3. Build Celery chain
-            tchain = self.__construct_chain_string(steps, request_contents,
-                                                   s.UUID, job_priority)
-            # 4. Call delay on the Celery chain
-            try:
-                logger.info('Sending this chain: '+tchain)
-                exec(tchain)
-            except SyntaxError:
-                logger.error('SyntaxError: Invalid string exec on: ' + tchain)
-                content = {'error': 'SyntaxError. Invalid string exec on ' +
-                           tchain}
+    def __get_batch_validators(self, jobs):
+        """
+            The union of the validators of every job in the batch. The upload
+            must pass all of them so they are run once rather than per job
+        """
+        validators = []
+        seen = set()
+        for validator in Validator.objects.filter(job__in=jobs) \
+                                          .select_related('validation_type'):
+            if validator.validation_type_id not in seen:
+                seen.add(validator.validation_type_id)
+                validators.append(validator)
+        return validators
+
+    def __get_leaders(self, fingerprints):
+        """
+            The queued or running submission, if any, each fingerprint should
+            follow instead of being run again
+        """
+        leaders = {}
+        if not settings.COALESCE_SUBMISSIONS:
+            return leaders
+        for s in Submission.objects.filter(fingerprint__in=fingerprints,
+                                           leader__isnull=True,
+                                           status__lte=Submission.RUNNING) \
+                                   .order_by('-pk'):
+            leaders[s.fingerprint] = s
+        return leaders
+
+    def __check_jobs(self, jobs, request_contents):
+        """
+            Returns an error response if any job can not be run with the
+            request's parameters, otherwise None
+        """
+        for job in jobs:
+            if job.runnable is False:
+                content = {'error': str(job)+" is present but currently "
+                                             "disabled."}
                 print(content)
                 return {'content': content,
-                        'httpCode': status.HTTP_500_INTERNAL_SERVER_ERROR}
-            except Exception as e:
-                logger.error('500 Error: Invalid string exec on: ' + tchain)
-                logger.error('500 Error' + str(e))
-                content = {'error': 'Invalid string exec on ' + tchain}
+                        'httpCode': status.HTTP_403_FORBIDDEN}
+            plan = get_plan(job)
+            if len(plan) == 0:
+                content = {'error': "Job Requested: "+str(job)+" appears to "
+                                    "have no Steps"}
                 print(content)
                 return {'content': content,
-                        'httpCode': status.HTTP_500_INTERNAL_SERVER_ERROR}
-            return {'content': {'UUID': s.UUID,
-                                'submission_name': s.submission_name},
-                    'httpCode': status.HTTP_201_CREATED}
-        else:
+                        'httpCode': status.HTTP_400_BAD_REQUEST}
+            param_test = self.__test_params(plan.schema, request_contents)
+            if not param_test[0]:
+                content = {'error': "Required Parameter for "+str(job) +
+                                    " Missing."+ param_test[1]+
+                                    ". GET /analytics_automated/endpoints to "
+                                    "discover all required options"}
+                print(content)
+                return {'content': content,
+                        'httpCode': status.HTTP_400_BAD_REQUEST}
+        return None
+
+    def __accept_batch(self, data, request_contents, job_priority, files,
+                       weight=1):
+        """
+            Asynchronous submission: store the upload and the raw request on
+            a new Batch and leave validation and publishing to the
+            dispatch_batch task
+        """
+        upload = files.get('input_data')
+        if upload is None:
+            content = {'error': "Input does not contain all required fields"}
+            print(content)
+            return {'content': content,
+                    'httpCode': status.HTTP_400_BAD_REQUEST}
+        if settings.MAX_UPLOAD_SIZE and upload.size > settings.MAX_UPLOAD_SIZE:
+            content = {'error': "Input data is larger than the " +
+                                str(settings.MAX_UPLOAD_SIZE) +
+                                " byte limit"}
+            print(content)
+            return {'content': content,
+                    'httpCode': status.HTTP_400_BAD_REQUEST}
+        # the pending batch holds one reference until it is dispatched
+        blob = InputBlob.store(upload)
+        masterUUID = str(uuid.uuid1())
+        Batch.objects.create(UUID=masterUUID,
+                             pending_request={
+                                'data': data,
+                                'request_contents': request_contents,
+                                'job_priority': job_priority,
+                                'weight': weight,
+                                'blob': blob.pk})
+        try:
+            dispatch_batch.delay(masterUUID)
+        except Exception as e:
+            # the batch stays pending for dispatch_pending_batches
+            logger.error('Unable to send dispatch task for ' + masterUUID +
+                         ': ' + str(e))
+        return {'content': {'UUID': masterUUID,
+                            'submission_name': data['submission_name']},
+                'httpCode': status.HTTP_202_ACCEPTED}
+
+    def dispatch_pending(self, batch_uuid):
+        """
+            Second half of an asynchronous submission, run by the
+            dispatch_batch task. Validates the request the API accepted and
+            publishes its chains, recording any failure on the Batch
+        """
+        with transaction.atomic():
+            try:
+                b = Batch.objects.select_for_update() \
+                                 .get(UUID=batch_uuid,
+                                      pending_request__isnull=False)
+            except Batch.DoesNotExist:
+                return None  # already dispatched
+            pending = b.pending_request
+            blob = InputBlob.objects.get(pk=pending['blob'])
+            try:
+                with transaction.atomic():
+                    jobs = self.__get_job(pending['data']['job'])
+                    responseContent = self.__check_jobs(
+                                      jobs, pending['request_contents'])
+                    if responseContent is None:
+                        responseContent = self.__submit_batch(
+                                          dict(pending['data']),
+                                          pending['request_contents'],
+                                          pending['job_priority'],
+                                          {'input_data': blob.data}, jobs,
+                                          blob=blob, b=b,
+                                          weight=pending.get('weight', 1),
+                                          defer=True)
+            except ValueError:
+                responseContent = {
+                    'content': {'error': 'Job name supplied does not exist'},
+                    'httpCode': status.HTTP_400_BAD_REQUEST}
+            except Exception as e:
+                responseContent = {'content': {'error': str(e)},
+                                   'httpCode':
+                                   status.HTTP_507_INSUFFICIENT_STORAGE}
+            b.pending_request = None
+            if responseContent['httpCode'] >= 400:
+                logger.error('Unable to dispatch batch ' + batch_uuid + ': ' +
+                             str(responseContent['content']['error']))
+                b.status = Batch.ERROR
+                b.last_message = str(responseContent['content']['error'])
+            # the batch's counters have moved on since it was loaded
+            b.save(update_fields=['pending_request', 'status',
+                                  'last_message'])
+        blob.data.close()
+        InputBlob.release(blob.pk)
+        publish = responseContent.pop('publish', None)
+        if publish is not None:
+            try:
+                publish()
+            except Exception as e:
+                logger.error('Unable to send chains for batch ' +
+                             batch_uuid+': '+str(e))
+                content = {'error': 'Unable to send job to queue: ' + str(e)}
+                Batch.objects.filter(pk=b.pk).update(
+                    status=Batch.ERROR, last_message=content['error'])
+                responseContent = {'content': content,
+                                   'httpCode':
+                                   status.HTTP_500_INTERNAL_SERVER_ERROR}
+        return responseContent
+
+    def __split_fasta(self, upload, validators):
+        """
+            Splits a multi-FASTA upload in to one file per record. Every
+            record must pass the seq validator and the jobs' own validators.
+            Returns the records and an error message, one of which is None
+        """
+        names = ['seq'] + [v.validation_type.name for v in validators
+                           if v.validation_type.name != 'seq']
+        for name in names:
+            if name not in REGISTRY:
+                return None, "Unknown validator: "+name
+        extension = os.path.splitext(upload.name)[1] or ".fasta"
+        records = []
+        failed = []
+        error = None
+        with input_view(upload) as view:
+            matches = re.finditer(rb"^>", view, re.MULTILINE)
+            first = next(matches, None)
+            if first is None:
+                error = "Input data contains no FASTA records"
+            elif bytes(view[:first.start()]).strip():
+                error = "Input data has text before its first FASTA record"
+            else:
+                # stop as soon as there are too many records rather than
+                # splitting the whole upload first
+                start = first.start()
+                ends = itertools.chain((m.start() for m in matches),
+                                       [len(view)])
+                for number, end in enumerate(ends, start=1):
+                    if settings.MAX_FASTA_RECORDS and \
+                       number > settings.MAX_FASTA_RECORDS:
+                        error = "Input data has more than " + \
+                                str(settings.MAX_FASTA_RECORDS) + \
+                                " FASTA records"
+                        break
+                    record = bytes(view[start:end])
+                    if not all(REGISTRY[name](record) for name in names):
+                        failed.append(str(number))
+                    records.append(ContentFile(record, name="record" +
+                                               str(number)+extension))
+                    start = end
+                ends = None
+            # the matches hold the view's buffer until they are released
+            first = matches = None
+        if error is not None:
+            return None, error
+        if failed:
+            return None, "FASTA records could not be validated: " + \
+                         ", ".join(failed)
+        return records, None
+
+    def __submit_batch(self, data, request_contents, job_priority, files,
+                       jobs, blob=None, b=None, weight=1, defer=False):
+        """
+            Validate the upload once, store it as a shared blob and create one
+            Submission per job with a single bulk insert. Then publish every
+            job's chain over one broker connection. Jobs whose request
+            matches one still in flight follow it rather than running again.
+            If split_fasta was requested each record of the upload gets its
+            own blob and Submissions, all in the one Batch.
+            With FAIR_SHARE on the Submissions are held in the client's
+            queue, with the given weight, instead of being published.
+            Asynchronous submissions pass in the blob and Batch they were
+            accepted with. With defer the chains are not published; instead
+            the returned dict carries a 'publish' callable for the caller to
+            run once the Submissions are committed and visible to workers
+        """
+        data['UUID'] = str(uuid.uuid1())
+        data['job'] = jobs[0].pk
+        split_fasta = data.get('split_fasta', False)
+        validators = self.__get_batch_validators(jobs)
+        # split uploads are validated record by record instead
+        submission_form = SubmissionForm(
+                          data, files,
+                          validators=[] if split_fasta else validators)
+        if not submission_form.is_valid():
             content = {'error': submission_form.errors}
             print(content)
             return {'content': content,
                     'httpCode': status.HTTP_400_BAD_REQUEST}
 
+        cleaned = submission_form.cleaned_data
+        if split_fasta:
+            records, error = self.__split_fasta(cleaned['input_data'],
+                                                validators)
+            if error is not None:
+                content = {'error': error}
+                print(content)
+                return {'content': content,
+                        'httpCode': status.HTTP_400_BAD_REQUEST}
+            blobs = [InputBlob.store(record, references=len(jobs))
+                     for record in records]
+        elif blob is None:
+            # identical uploads share one stored blob
+            blobs = [InputBlob.store(cleaned['input_data'],
+                                     references=len(jobs))]
+        else:
+            InputBlob.retain(blob.pk, len(jobs))
+            blobs = [blob]
+        inputs = [(input_blob, job) for input_blob in blobs for job in jobs]
+        plans = {job.pk: get_plan(job) for job in jobs}
+        fingerprints = [plans[job.pk].fingerprint(input_blob.digest,
+                                                  request_contents)
+                        for input_blob, job in inputs]
+        leaders = self.__get_leaders(fingerprints)
+        if b is None:
+            b = Batch.objects.create(UUID=str(uuid.uuid1()))
+        masterUUID = b.UUID
+        subs = []
+        for (input_blob, job), fingerprint in zip(inputs, fingerprints):
+            # In the future we'll set batch jobs to the lowest priority
+            subs.append(Submission(job=job,
+                                   submission_name=cleaned['submission_name'],
+                                   UUID=str(uuid.uuid1()),
+                                   email=cleaned['email'],
+                                   ip=cleaned['ip'],
+                                   input_data=input_blob.data.name,
+                                   blob=input_blob,
+                                   priority=job_priority,
+                                   batch=b,
+                                   fingerprint=fingerprint,
+                                   leader=leaders.get(fingerprint),
+                                   request_contents=request_contents
+                                   if fingerprint in leaders else None))
+        # bulk_create skips Submission.save() so count the batch here
+        with transaction.atomic():
+            Submission.objects.bulk_create(subs)
+            ActiveSubmissionCount.adjust(cleaned['ip'], len(subs))
+            Batch.objects.filter(pk=b.pk) \
+                         .update(pending=F('pending')+len(subs))
+        for job in jobs:
+            count_submissions(job, Submission.SUBMITTED, len(blobs))
+        # a leader which finished while we were inserting has already fanned
+        # out its results so hand them on here
+        for leader in Submission.objects.filter(
+                pk__in=[l.pk for l in leaders.values()],
+                status__gt=Submission.RUNNING):
+            fan_out_results(leader)
+
+        if settings.FAIR_SHARE:
+            # not every database gives bulk created rows their keys
+            held = Submission.objects.filter(
+                UUID__in=[s.UUID for s in subs if s.leader is None]) \
+                .order_by('pk').values_list('pk', flat=True)
+            HeldSubmission.hold(held, cleaned['ip'], request_contents,
+                                job_priority, weight)
+            publish = release_held
+        else:
+            # Send to the Job Queue
+            # 1. Look up the compiled plan for each job
+            # 2. Build the Celery chain for each submission which is not
+            #    following an identical one already in flight
+            # 3. Publish all the chains in one go
+            placement = Placement()
+            chains = [plans[s.job.pk].signature(s.UUID, request_contents,
+                                                job_priority, placement)
+                      for s in subs if s.leader is None]
+
+            def publish():
+                logger.info('Sending '+str(len(chains)) +
+                            ' chains for batch '+masterUUID)
+                if chains:
+                    dispatch_chains(chains)
+        accepted = {'content': {'UUID': masterUUID,
+                                'submission_name': data['submission_name']},
+                    'httpCode': status.HTTP_201_CREATED}
+        if defer:
+            # the caller publishes once its transaction has committed
+            accepted['publish'] = publish
+            return accepted
+        try:
+            publish()
+        except Exception as e:
+            logger.error('500 Error: Unable to send chains for ' + masterUUID)
+            logger.error('500 Error' + str(e))
+            content = {'error': 'Unable to send job to queue: ' + str(e)}
+            print(content)
+            return {'content': content,
+                    'httpCode': status.HTTP_500_INTERNAL_SERVER_ERROR}
+        return accepted
+
     def post(self, request, *args, **kwargs):
 
         """
@@ -391,6 +559,14 @@ class SubmissionDetails(mixins.RetrieveModelMixin,
             seems insane when the forms functionality is already in place
         """
         # data['input_data'] = request.data['input_data']
+        # reading request.data runs the upload handlers, which give up on
+        # oversized uploads part way through the body
+        request.data
+        if upload_rejected(request._request) is not None:
+            content = {'error': upload_rejected(request._request)}
+            print(content)
+            return Response(content,
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         try:
             data, request_contents = self.__prepare_data(request)
         except MultiValueDictKeyError:
@@ -419,47 +595,62 @@ class SubmissionDetails(mixins.RetrieveModelMixin,
                                 str(submission_number) +
                                 ", concurrent jobs running"}
             return Response(content, status=status.HTTP_429_TOO_MANY_REQUESTS)
-        for job in jobs:
-            job = Job.objects.get(pk=job)
-            steps = job.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-            if job.runnable is False:
-                content = {'error': str(job)+" is present but currently "
-                                             "disabled."}
-                print(content)
-                return Response(content, status=status.HTTP_403_FORBIDDEN)
-            if len(steps) == 0:
-                content = {'error': "Job Requested: "+str(job)+" appears to "
-                                    "have no Steps"}
-                print(content)
-                return Response(content, status.HTTP_400_BAD_REQUEST)
-            param_test = self.__test_params(steps, request_contents)
-            if not param_test[0]:
-                content = {'error': "Required Parameter for "+str(job) +
-                                    " Missing."+ param_test[1]+
-                                    ". GET /analytics_automated/endpoints to "
-                                    "discover all required options"}
-                print(content)
-                return Response(content, status.HTTP_400_BAD_REQUEST)
-        masterUUID = str(uuid.uuid1())
-        b = Batch.objects.create(UUID=masterUUID)
-        content = {'UUID': masterUUID, 'submission_name': data['submission_name']}
-        for job in jobs:
-            data['UUID'] = str(uuid.uuid1())
-            data['job'] = job
-            # In the future we'll set batch jobs to the lowest priority
+        weight = client_weight(request.user.is_authenticated)
+        if settings.ASYNC_SUBMISSIONS:
             try:
-                responseContent = self.__submit_job(data, request_contents,
-                                                    job_priority, request,
-                                                    masterUUID, b)
+                responseContent = self.__accept_batch(data, request_contents,
+                                                      job_priority,
+                                                      request.FILES, weight)
             except Exception as e:
                 content = {'error': str(e)}
                 print(content)
-                return Response(content, status=status.HTTP_507_INSUFFICIENT_STORAGE)
-            # print(responseContent)
-            if 'error' in responseContent['content']:
-                return Response(responseContent['content'], status=responseContent['httpCode'])
-        return Response(content, status=status.HTTP_201_CREATED)
+                return Response(content,
+                                status=status.HTTP_507_INSUFFICIENT_STORAGE)
+            return Response(responseContent['content'],
+                            status=responseContent['httpCode'])
+        responseContent = self.__check_jobs(jobs, request_contents)
+        if responseContent is not None:
+            return Response(responseContent['content'],
+                            status=responseContent['httpCode'])
+        try:
+            responseContent = self.__submit_batch(data, request_contents,
+                                                  job_priority, request.FILES,
+                                                  jobs, weight=weight)
+        except Exception as e:
+            content = {'error': str(e)}
+            print(content)
+            return Response(content, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        return Response(responseContent['content'],
+                        status=responseContent['httpCode'])
+
+
+class CancelSubmission(views.APIView):
+    """
+        Cancels a batch, or a single submission, which has not finished.
+        Its queued tasks are revoked and its running commands are stopped
+    """
+
+    def post(self, request, *args, **kwargs):
+        uuid = kwargs['UUID']
+        submissions = Submission.objects.filter(
+            batch__UUID=uuid, status__lte=Submission.RUNNING)
+        if not Batch.objects.filter(UUID=uuid).exists():
+            submissions = Submission.objects.filter(UUID=uuid)
+            if not submissions.exists():
+                content = {'error': "No submission or batch with UUID " +
+                           uuid}
+                print(content)
+                return Response(content, status=status.HTTP_404_NOT_FOUND)
+        cancelled = []
+        for s in submissions.select_related('batch'):
+            if cancel_submission(s, "Cancelled by request"):
+                cancelled.append(s.UUID)
+        if not cancelled:
+            content = {'error': "Submission "+uuid+" has already finished"}
+            print(content)
+            return Response(content, status=status.HTTP_409_CONFLICT)
+        return Response({'UUID': uuid, 'cancelled': cancelled},
+                        status=status.HTTP_202_ACCEPTED)
 
 
 class Endpoints(generics.GenericAPIView):
@@ -473,11 +664,8 @@ class Endpoints(generics.GenericAPIView):
             uri_string = "/submission/&job="+str(job) + \
                          "&submission_name=[STRING]&email=[EMAIL_STRING]" + \
                          "&input_data=[FILE]"
-            steps = job.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-            for step in steps:
-                params = Parameter.objects.filter(task=step.task)
-                for param in params:
+            for step_plan in get_plan(job).step_plans():
+                for param in step_plan.schema.parameters:
                     if param.bool_valued is True:
                         uri_string += "&"+param.rest_alias+"=[TRUE/FALSE]"
                     else:
@@ -581,6 +769,30 @@ class JobTimes(generics.GenericAPIView):
         return Response(results)
 
 
+class StepTimes(generics.GenericAPIView):
+    """
+        Returns, for each job and each of its tasks, how many executions
+        have been timed and the mean seconds spent in each phase of them.
+        ?job=[STRING] limits the results to a single job
+    """
+
+    def get(self, request, *args, **kwargs):
+        timings = StepTiming.objects.filter(submission__job__isnull=False)
+        if 'job' in request.query_params:
+            timings = timings.filter(
+                submission__job__name=request.query_params['job'])
+        averages = {phase: Avg(phase) for phase in StepTiming.PHASES}
+        rows = timings.values('submission__job__name', 'task__name') \
+                      .annotate(count=Count('id'), **averages) \
+                      .order_by('submission__job__name', 'task__name')
+        results = defaultdict(dict)
+        for row in rows:
+            results[row['submission__job__name']][row['task__name']] = \
+                {'count': row['count'],
+                 **{phase: row[phase] for phase in StepTiming.PHASES}}
+        return Response(results)
+
+
 class JobList(mixins.ListModelMixin, generics.GenericAPIView):
     """
         API endpoint list the available job types on this service.
@@ -1,7 +1,7 @@
-import inspect
 from django.apps import AppConfig
 
 import analytics_automated.validators
+import analytics_automated.cmdline
 
 
 class startup(AppConfig):
@@ -13,11 +13,13 @@ class startup(AppConfig):
         if self.ready_run:
             return
         self.ready_run = True
+        # connect the signals which keep the compiled job plans up to date
+        import analytics_automated.plans
+        # build the forbidden parameter token index once at start up
+        analytics_automated.cmdline.forbidden_token_index()
 
         try:
-            functionList = inspect.getmembers(analytics_automated.validators,
-                                              inspect.isfunction)
-            validatorList = [seq[0] for seq in functionList]
+            validatorList = sorted(analytics_automated.validators.REGISTRY)
             validator_types = AppConfig.get_model(self, "ValidatorTypes")
             existing_entries = validator_types.objects.all().values_list('name')
 
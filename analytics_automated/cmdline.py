@@ -1,13 +1,78 @@
+import os
+import time
+import keyword
+import threading
 from os import listdir
-from os.path import isfile, join
+from os.path import isfile, isdir, join
+from types import MappingProxyType
 
+from django.conf import settings
 
-def return_local_commands():
-    cmd_paths = ['/bin', '/usr/bin', '/sbin', '/usr/sbin', '/usr/local/bin',
-                 '/usr/local/sbin', '/opt']
+from .r_keywords import rkwlist
+
+CMD_PATHS = ['/bin', '/usr/bin', '/sbin', '/usr/sbin', '/usr/local/bin',
+             '/usr/local/sbin', '/opt']
+
+_token_index = None
+_token_index_stamp = None
+_token_index_checked = None
+_token_index_lock = threading.Lock()
 
+
+def return_local_commands():
     unix_commands = []
-    for path in cmd_paths:
+    for path in CMD_PATHS:
+        if not isdir(path):
+            continue
         unix_commands = unix_commands + [f for f in listdir(path)
                                          if isfile(join(path, f))]
     return(unix_commands)
+
+
+def __command_paths_stamp():
+    stamp = []
+    for path in CMD_PATHS:
+        try:
+            stamp.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return(tuple(stamp))
+
+
+def __build_token_index():
+    """
+        Maps every forbidden token to the reason it is forbidden. Later
+        entries win so python keywords are reported ahead of R keywords
+        ahead of unix commands, as the old linear checks did
+    """
+    index = {}
+    for cmd in return_local_commands():
+        index[cmd] = "unix commands"
+    for kw in rkwlist:
+        index[kw] = "R keywords"
+    for kw in keyword.kwlist:
+        if kw != 'in':
+            index[kw] = "python keyords"
+    return(MappingProxyType(index))
+
+
+def forbidden_token_index(refresh=False):
+    """
+        Returns the read only token index. The index is built once per
+        process. At most every TOKEN_INDEX_REFRESH seconds, or at once with
+        refresh=True, the command directories are checked and the index is
+        rebuilt if one of them has been modified since it was built
+    """
+    global _token_index, _token_index_stamp, _token_index_checked
+    now = time.monotonic()
+    if _token_index is not None and not refresh:
+        interval = settings.TOKEN_INDEX_REFRESH
+        if interval is None or now - _token_index_checked < interval:
+            return(_token_index)
+    stamp = __command_paths_stamp()
+    with _token_index_lock:
+        if _token_index is None or stamp != _token_index_stamp:
+            _token_index = __build_token_index()
+            _token_index_stamp = stamp
+        _token_index_checked = now
+        return(_token_index)
@@ -0,0 +1,96 @@
+import logging
+import threading
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+'''
+    Worker side cache of resolved Tasks. A descriptor holds a Task with its
+    Backend and QueueType already loaded along with its parsed globs and exit
+    statuses and the backends it may run on with their users. Each worker
+    process keeps its own descriptors and checks them against the Task's
+    version, which is renewed whenever an admin edits the task, its
+    backends, their users or its queue type, so a task run costs one small
+    query rather than loading and parsing the task every time.
+'''
+
+_descriptors = {}
+_descriptors_lock = threading.Lock()
+
+
+class TaskDescriptor(object):
+    """
+        Everything about a Task that task_runner needs before it runs
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.version = task.version
+        self.in_globs, self.out_globs, self.iglob, self.oglob = \
+            build_file_globs(task)
+        self.stdoglob = ".stdout"
+        if task.stdout_glob is not None and len(task.stdout_glob) > 0:
+            self.stdoglob = "."+task.stdout_glob.lstrip(".")
+        # a bad exit status list is reported when the task runs, not here
+        self.exit_status_error = None
+        try:
+            self.valid_exit_status, self.custom_exit_statuses = \
+                parse_exit_statuses(task)
+        except Exception as e:
+            self.exit_status_error = str(e)
+            self.valid_exit_status, self.custom_exit_statuses = [0, ], []
+        # the backends it may run on and their users
+        self.backends = task.pool()
+        self.users = {}
+        for backend in self.backends:
+            self.users[backend.pk] = list(backend.users.all())
+
+
+def build_file_globs(t):
+    in_globs = "".join(t.in_glob.split()).split(",")
+    out_globs = "".join(t.out_glob.split()).split(",")
+
+    iglob = in_globs[0].lstrip(".")
+    oglob = out_globs[0].lstrip(".")
+    return(in_globs, out_globs, iglob, oglob)
+
+
+def parse_exit_statuses(t):
+    valid_exit_status = [0, ]
+    custom_exit_statuses = []
+    if t.custom_exit_status is not None:
+        statuses = t.custom_exit_status.replace(" ", "")
+        if len(statuses) > 0:
+            custom_exit_statuses = list(map(int, statuses.split(",")))
+        if t.custom_exit_behaviour == Task.CONTINUE or \
+           t.custom_exit_behaviour == Task.TERMINATE:
+            valid_exit_status += custom_exit_statuses
+    return(valid_exit_status, custom_exit_statuses)
+
+
+def get_task_descriptor(task_name):
+    """
+        Return the descriptor for the named task, reloading it if the task
+        has been edited since it was cached. Raises Task.DoesNotExist as
+        Task.objects.get() would
+    """
+    version = Task.objects.filter(name=task_name) \
+                          .values_list('version', flat=True).get()
+    with _descriptors_lock:
+        descriptor = _descriptors.get(task_name)
+    if descriptor is None or descriptor.version != version:
+        logger.debug("Loading task descriptor for "+task_name)
+        descriptor = TaskDescriptor(Task.objects
+                                    .select_related('backend__queue_type')
+                                    .prefetch_related('backend__users',
+                                                      'backends__users')
+                                    .get(name=task_name))
+        with _descriptors_lock:
+            _descriptors[task_name] = descriptor
+    return descriptor
+
+
+def clear_task_descriptors():
+    with _descriptors_lock:
+        _descriptors.clear()
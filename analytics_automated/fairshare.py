@@ -0,0 +1,150 @@
+import heapq
+import logging
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from .models import Submission, HeldSubmission
+from .plans import get_plan, dispatch_chains
+from .routing import Placement
+
+logger = logging.getLogger(__name__)
+
+'''
+    Fair share dispatch. With FAIR_SHARE on, submissions are not sent to
+    celery when they are made but held in a virtual queue per client. Only
+    FAIR_SHARE_SLOTS submissions are in the celery queues at once and free
+    slots go to the held submissions in weighted round robin, so one client
+    filling the queues delays others by at most a slot rather than by all
+    the work queued ahead of them.
+
+    A client's turn comes round in proportion to its weight and in inverse
+    proportion to how many submissions it has had released recently. Logged
+    in clients are weighted by FAIR_SHARE_LOGGED_IN_WEIGHT.
+'''
+
+
+def client_weight(logged_in):
+    if logged_in:
+        return settings.FAIR_SHARE_LOGGED_IN_WEIGHT
+    return 1
+
+
+def in_flight():
+    """
+        Submissions released to celery which have not finished. Followers of
+        an identical submission never reach the queues so are not counted
+    """
+    return Submission.objects.filter(status__in=[Submission.SUBMITTED,
+                                                 Submission.RUNNING],
+                                     held__isnull=True,
+                                     leader__isnull=True).count()
+
+
+def recent_usage(clients):
+    """
+        How many submissions each client has had released to celery in the
+        last FAIR_SHARE_WINDOW seconds. Time spent held is not charged
+    """
+    since = timezone.now() - \
+        datetime.timedelta(seconds=settings.FAIR_SHARE_WINDOW)
+    rows = Submission.objects.filter(ip__in=clients, released__gte=since) \
+                             .values('ip').annotate(count=Count('id'))
+    return {row['ip']: row['count'] for row in rows}
+
+
+def pick_held(free):
+    """
+        Chooses up to free held submissions, taking each client's oldest
+        first, and returns their pks. Each pick goes to the client with the
+        lowest virtual time, its recent usage over its weight, which then
+        moves on by one over its weight. Only a summary row per client is
+        read to take the turns
+    """
+    clients = HeldSubmission.objects.values('client') \
+                                    .annotate(oldest=Min('pk'),
+                                              waiting=Count('pk'),
+                                              weight=Max('weight'))
+    usage = recent_usage([row['client'] for row in clients])
+    turns = []
+    for row in clients:
+        weight = max(row['weight'], 0.001)
+        heapq.heappush(turns, (usage.get(row['client'], 0)/weight,
+                               row['oldest'], row['client'], weight,
+                               row['waiting']))
+    picks = {}
+    while turns and sum(picks.values()) < free:
+        virtual_time, oldest, client, weight, waiting = heapq.heappop(turns)
+        picks[client] = picks.get(client, 0) + 1
+        if waiting > 1:
+            heapq.heappush(turns, (virtual_time+1/weight, oldest, client,
+                                   weight, waiting-1))
+    picked = []
+    for client, count in picks.items():
+        picked.extend(HeldSubmission.objects.filter(client=client)
+                                            .order_by('pk')
+                                            .values_list('pk', flat=True)
+                                            [:count])
+    return picked
+
+
+def release_held():
+    """
+        Sends as many held submissions to celery as there are free slots.
+        Safe to run from several processes at once. Releasers take turns on
+        the oldest held submission so each counts the slots filled by the
+        one before it, and held submissions are claimed by deleting them,
+        skipping any another process has locked, so each is only ever sent
+        once. Returns the number sent
+    """
+    with transaction.atomic():
+        if not HeldSubmission.objects.select_for_update() \
+                                     .order_by('pk')[:1]:
+            return 0
+        free = settings.FAIR_SHARE_SLOTS - in_flight()
+        if free <= 0:
+            return 0
+        claimed = list(HeldSubmission.objects
+                                     .select_for_update(skip_locked=True)
+                                     .filter(pk__in=pick_held(free))
+                                     .order_by('pk'))
+        HeldSubmission.objects.filter(pk__in=[held.pk for held in claimed]) \
+                              .delete()
+        Submission.objects.filter(pk__in=[held.submission_id
+                                          for held in claimed]) \
+                          .update(released=timezone.now())
+    if len(claimed) == 0:
+        return 0
+    subs = Submission.objects.select_related('job') \
+                             .in_bulk([held.submission_id
+                                       for held in claimed])
+    plans = {}
+    chains = []
+    placement = Placement()
+    for held in claimed:
+        if held.submission_id not in subs:
+            continue
+        s = subs[held.submission_id]
+        if s.job_id not in plans:
+            plans[s.job_id] = get_plan(s.job)
+        chains.append(plans[s.job_id].signature(s.UUID,
+                                                held.request_contents,
+                                                held.job_priority,
+                                                placement))
+    try:
+        dispatch_chains(chains)
+    except Exception as e:
+        # put them back for the next release
+        logger.error('Unable to release held submissions: '+str(e))
+        for held in claimed:
+            held.pk = None
+        HeldSubmission.objects.bulk_create(claimed)
+        Submission.objects.filter(pk__in=[held.submission_id
+                                          for held in claimed]) \
+                          .update(released=None)
+        return 0
+    logger.info('Released '+str(len(chains))+' held submissions')
+    return len(chains)
@@ -1,5 +1,10 @@
+import io
 import re
+import mmap
+from contextlib import contextmanager
+
 from django import forms
+from django.conf import settings
 from django.forms.models import BaseInlineFormSet
 from django.core.exceptions import ValidationError
 
@@ -7,22 +12,67 @@ from .models import Submission, Job, Validator, Task
 from .validators import *
 
 
+@contextmanager
+def input_view(file_data):
+    """
+        Yields a read only, bytes-like view of an upload without copying it
+        in to memory. Files spooled to disk are memory mapped and in memory
+        uploads are viewed through their buffer
+    """
+    handle = getattr(file_data, 'file', file_data)
+    if hasattr(handle, 'getbuffer'):
+        view = handle.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+    try:
+        fileno = handle.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+    if fileno is not None and file_data.size > 0:
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as view:
+            yield view
+        return
+    file_data.seek(0)
+    yield file_data.read()
+
+
 class SubmissionForm(forms.ModelForm):
 
+    def __init__(self, *args, **kwargs):
+        # batch submissions pass the validators of all their jobs
+        self.validators = kwargs.pop('validators', None)
+        super(SubmissionForm, self).__init__(*args, **kwargs)
+
     def __validate_input(self, validators, file_data):
-        input_file_contents = file_data.read()
+        checks = []
         for validator in validators:
-            if not eval(validator.validation_type.name+"(input_file_contents)"):
-                return(False)
+            name = validator.validation_type.name
+            if name not in REGISTRY:
+                raise forms.ValidationError("Unknown validator: "+name)
+            checks.append(REGISTRY[name])
+        with input_view(file_data) as input_file_contents:
+            for check in checks:
+                if not check(input_file_contents):
+                    return(False)
         return(True)
 
     def clean_input_data(self):
         input_data = self.cleaned_data.get("input_data")
         job = self.cleaned_data.get("job")
-        validators = job.validators.all()
+        # reject oversized uploads before any validator reads them
+        if input_data is not None and settings.MAX_UPLOAD_SIZE and \
+           input_data.size > settings.MAX_UPLOAD_SIZE:
+            raise forms.ValidationError("Input data is larger than the " +
+                                        str(settings.MAX_UPLOAD_SIZE) +
+                                        " byte limit")
+        validators = self.validators
+        if validators is None:
+            validators = job.validators.all()
         if len(validators) == 0:  # Nothing to do here
             return(input_data)
-        match_state = False
         if not self.__validate_input(validators, input_data):
             raise forms.ValidationError("Input data could not be validated")
         return(input_data)
@@ -46,9 +96,22 @@ class TaskForm(forms.ModelForm):
 
     class Meta:
         model = Task
-        fields = ('backend', 'name', 'description', 'in_glob', 'out_glob',
-                  'stdout_glob', 'executable', 'incomplete_outputs_behaviour',
-                  'custom_exit_status', 'custom_exit_behaviour', )
+        fields = ('backend', 'backends', 'name', 'description', 'in_glob',
+                  'out_glob', 'stdout_glob', 'executable',
+                  'incomplete_outputs_behaviour', 'custom_exit_status',
+                  'custom_exit_behaviour', )
+
+    def clean(self):
+        cleaned_data = super(TaskForm, self).clean()
+        backend = cleaned_data.get('backend')
+        backends = cleaned_data.get('backends')
+        if backend is not None and backends:
+            for other in backends:
+                if other.queue_type_id != backend.queue_type_id:
+                    raise forms.ValidationError(
+                        "Backend "+other.name+" does not have the same queue "
+                        "type as "+backend.name)
+        return cleaned_data
 
 
 class ValidatorForm(BaseInlineFormSet):
@@ -0,0 +1,104 @@
+import json
+import time
+import logging
+import threading
+
+from celery.signals import worker_init, worker_process_init
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import RunningTask
+
+logger = logging.getLogger(__name__)
+
+'''
+    Worker heartbeats. When a task_runner starts a step it records a
+    RunningTask and, every HEARTBEAT_INTERVAL seconds while the step runs,
+    the worker process stamps the heartbeat of each RunningTask it holds.
+    The stamps come from a thread so they carry on while the step's command
+    runs. Each task has its own row so steps of a group or DAG which run at
+    once, on one worker or several, do not disturb each other.
+    reap_stuck_submissions deletes the rows whose heartbeat has gone quiet
+    and requeues or fails their steps; a worker which has lost its row to
+    the reaper has nothing left to stamp.
+'''
+
+_held = set()
+_lock = threading.Lock()
+_thread = None
+
+
+def beat(task_ids):
+    return RunningTask.objects.filter(task_id__in=task_ids) \
+                              .update(heartbeat=timezone.now())
+
+
+def hold(s, task_id, hostname, step, resume, backend=None):
+    """
+        Starts the heartbeat of a task this process is running a step of on
+        backend. resume is the signature which runs the step again. A task
+        called directly, rather than by a worker, has no id and is not
+        tracked
+    """
+    if settings.HEARTBEAT_INTERVAL is None or task_id is None:
+        return
+    try:
+        resume = json.dumps(dict(resume))
+    except (TypeError, ValueError) as e:
+        logger.error(s.UUID+": step can not be requeued: "+str(e))
+        resume = None
+    # a task redelivered after its worker went keeps its id
+    RunningTask.objects.update_or_create(
+        task_id=task_id, defaults={'submission': s, 'hostname': hostname,
+                                   'step': step, 'heartbeat': timezone.now(),
+                                   'resume_signature': resume,
+                                   'backend': backend})
+    with _lock:
+        _held.add(task_id)
+
+
+def drop(task_id):
+    """
+        Stops the heartbeat once the step has finished or failed
+    """
+    with _lock:
+        if task_id not in _held:
+            return
+        _held.discard(task_id)
+    RunningTask.objects.filter(task_id=task_id).delete()
+
+
+def beat_held():
+    with _lock:
+        held = list(_held)
+    if held:
+        beat(held)
+
+
+def run_heartbeats():
+    while True:
+        time.sleep(settings.HEARTBEAT_INTERVAL)
+        try:
+            close_old_connections()
+            beat_held()
+        except Exception as e:
+            logger.error("Unable to send heartbeats: "+str(e))
+
+
+@worker_init.connect
+@worker_process_init.connect
+def start_heartbeats(**kwargs):
+    """
+        Prefork children start their own thread as threads do not survive
+        the fork; solo and thread pools beat from the main process
+    """
+    global _thread
+    if settings.HEARTBEAT_INTERVAL is None:
+        return
+    if _thread is not None and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=run_heartbeats, name="aa-heartbeat",
+                               daemon=True)
+    _thread.start()
@@ -0,0 +1,204 @@
+import os
+import logging
+
+from celery import current_app
+from celery.signals import worker_init
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from prometheus_client import Counter, Histogram, CollectorRegistry
+from prometheus_client import generate_latest, start_http_server
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+from .models import Job, Submission, QueueType, Backend
+
+logger = logging.getLogger(__name__)
+
+'''
+    Prometheus metrics. Every process counts the submissions it creates or
+    moves to a new status in aa_submissions_total, by job and status, so
+    rates come from rate() over the sum of those counters. The web tier
+    serves /metrics, which reports its own counts and the active submissions
+    and queue depths read from the database and the broker at scrape time.
+    Workers record their status changes and task_runner durations and errors
+    and, if WORKER_METRICS_PORT is set, serve them on that port. Run
+    gunicorn and prefork workers with the prometheus_multiproc_dir
+    environment variable set so that every process's samples are reported;
+    the pinned prometheus_client reads only the lower case name.
+'''
+
+TASK_DURATION = Histogram('aa_task_runner_seconds',
+                          'Wall time of task_runner executions',
+                          ['task', 'backend'],
+                          buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800,
+                                   3600, 10800, 43200, float("inf")))
+TASK_ERRORS = Counter('aa_task_runner_errors',
+                      'task_runner executions which raised, by the phase '
+                      'they failed in',
+                      ['task', 'backend', 'exit_path'])
+SUBMISSIONS = Counter('aa_submissions',
+                      'Submissions made or moved to a new status, by job '
+                      'and the status they entered',
+                      ['job', 'status'])
+
+STATUS_NAMES = dict(Submission.STATUS_CHOICES)
+ACTIVE = (Submission.SUBMITTED, Submission.RUNNING)
+
+# job names by pk, looked up once per process as status changes only carry
+# the key. A job renamed in another process keeps its old label here until
+# this one restarts
+_job_names = {}
+
+
+def job_name(job_id):
+    if job_id is None:
+        return ''
+    name = _job_names.get(job_id)
+    if name is None:
+        name = Job.objects.filter(pk=job_id) \
+                          .values_list('name', flat=True).first() or ''
+        _job_names[job_id] = name
+    return name
+
+
+@receiver([post_save, post_delete], sender=Job)
+def forget_job_name(sender, instance, **kwargs):
+    _job_names.pop(instance.pk, None)
+
+
+def count_submissions(job, status, count=1):
+    """
+        Counts count submissions of job, given as a Job or its pk, entering
+        status
+    """
+    if isinstance(job, Job):
+        _job_names[job.pk] = job.name
+        job = job.pk
+    SUBMISSIONS.labels(job_name(job), STATUS_NAMES[status]).inc(count)
+
+
+def queue_names():
+    """
+        Every queue a job can be sent to; the low_, normal and high_ queue of
+        each QueueType plus the default and notification queues
+    """
+    names = ['celery', settings.NOTIFICATION_QUEUE]
+    for queue_type in QueueType.objects.exclude(name__isnull=True) \
+                                       .order_by('name') \
+                                       .values_list('name', flat=True):
+        names += ["low_"+queue_type, queue_type, "high_"+queue_type]
+    return names
+
+
+def queue_depth(connection, name):
+    channel = connection.channel()
+    try:
+        return channel.queue_declare(queue=name, passive=True).message_count
+    except Exception:
+        return 0  # the broker has never seen this queue
+    finally:
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+
+class SubmissionCollector(object):
+    def collect(self):
+        # only the unfinished submissions, which the status index finds
+        # without reading the finished ones
+        current = GaugeMetricFamily('aa_submissions_by_status',
+                                    'Submissions queued or running, by job',
+                                    labels=['job', 'status'])
+        rows = Submission.objects.filter(status__in=ACTIVE) \
+                                 .values('job__name', 'status') \
+                                 .annotate(count=Count('id')) \
+                                 .order_by('job__name', 'status')
+        for row in rows:
+            current.add_metric([row['job__name'] or '',
+                                STATUS_NAMES[row['status']]], row['count'])
+        yield current
+
+
+class BackendCollector(object):
+    def collect(self):
+        running = GaugeMetricFamily('aa_backend_running',
+                                    'task_runners running on each backend',
+                                    labels=['backend'])
+        for name, count in Backend.objects.order_by('name') \
+                                          .values_list('name', 'running'):
+            running.add_metric([name], count)
+        yield running
+
+
+class QueueCollector(object):
+    def collect(self):
+        depth = GaugeMetricFamily('aa_queue_depth',
+                                  'Messages waiting on each celery queue',
+                                  labels=['queue'])
+        try:
+            with current_app.connection_for_read() as connection:
+                for name in queue_names():
+                    depth.add_metric([name], queue_depth(connection, name))
+        except Exception as e:
+            logger.error("Unable to read queue depths: "+str(e))
+        yield depth
+
+
+def multiprocess_registry():
+    """
+        A registry of the samples every process has written to
+        prometheus_multiproc_dir, or None if it is not set
+    """
+    if 'prometheus_multiproc_dir' not in os.environ:
+        return None
+    from prometheus_client import multiprocess
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def worker_registry():
+    return multiprocess_registry() or REGISTRY
+
+
+def metrics(request):
+    """
+        The web tier's /metrics endpoint
+    """
+    registry = multiprocess_registry()
+    if registry is None:
+        registry = CollectorRegistry()
+        registry.register(SUBMISSIONS)
+    registry.register(SubmissionCollector())
+    registry.register(BackendCollector())
+    registry.register(QueueCollector())
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
+
+
+def observe_task(task, backend, duration, exit_path=None):
+    """
+        Records one task_runner execution on the backend it ran on; exit_path
+        names the phase it failed in, or is None if it succeeded
+    """
+    task_name = task.name if task is not None else ''
+    backend_name = backend.name if backend is not None else ''
+    TASK_DURATION.labels(task_name, backend_name).observe(duration)
+    if exit_path is not None:
+        TASK_ERRORS.labels(task_name, backend_name, exit_path).inc()
+
+
+@worker_init.connect
+def start_worker_exporter(**kwargs):
+    if settings.WORKER_METRICS_PORT is None:
+        return
+    logger.info("Serving worker metrics on port " +
+                str(settings.WORKER_METRICS_PORT))
+    start_http_server(settings.WORKER_METRICS_PORT,
+                      registry=worker_registry())
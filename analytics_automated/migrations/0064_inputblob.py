@@ -0,0 +1,35 @@
+# Generated by Django 3.2.14 on 2026-10-17 17:50
+
+import analytics_automated.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0063_auto_20210716_1342'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InputBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('digest', models.CharField(db_index=True, max_length=64, unique=True)),
+                ('data', models.FileField(upload_to=analytics_automated.models.blob_path)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='submissions', to='analytics_automated.inputblob'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.14 on 2026-10-17 17:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_active_submissions(apps, schema_editor):
+    Submission = apps.get_model('analytics_automated', 'Submission')
+    ActiveSubmissionCount = apps.get_model('analytics_automated',
+                                           'ActiveSubmissionCount')
+    active = Submission.objects.filter(status__lte=1).values('ip') \
+                               .annotate(count=Count('id'))
+    ActiveSubmissionCount.objects.bulk_create(
+        [ActiveSubmissionCount(ip=row['ip'], count=row['count'])
+         for row in active])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0064_inputblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveSubmissionCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip', models.GenericIPAddressField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_active_submissions,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.14 on 2026-10-17 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0065_activesubmissioncount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='leader',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='followers', to='analytics_automated.submission'),
+        ),
+    ]
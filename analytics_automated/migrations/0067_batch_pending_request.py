@@ -0,0 +1,23 @@
+# Generated by Django 3.2.14 on 2026-10-17 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0066_submission_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='last_message',
+            field=models.CharField(blank=True, default=None, max_length=2046, null=True),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='pending_request',
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:01
+
+import os
+
+from django.db import migrations, models
+
+
+def fill_extensions(apps, schema_editor):
+    Result = apps.get_model('analytics_automated', 'Result')
+    batch = []
+    for result in Result.objects.exclude(result_data='').only('result_data') \
+                                .iterator():
+        parts = os.path.basename(result.result_data.name).split(".", 1)
+        if len(parts) == 2:
+            result.extension = parts[1]
+            batch.append(result)
+        if len(batch) >= 1000:
+            Result.objects.bulk_update(batch, ['extension'])
+            batch = []
+    Result.objects.bulk_update(batch, ['extension'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0067_batch_pending_request'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='extension',
+            field=models.CharField(blank=True, max_length=256, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['submission', 'extension', 'step'], name='analytics_a_submiss_0f82a8_idx'),
+        ),
+        migrations.RunPython(fill_extensions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:09
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0068_result_extension'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:10
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_batch_submissions(apps, schema_editor):
+    Batch = apps.get_model('analytics_automated', 'Batch')
+    counts = Batch.objects.annotate(
+        n_pending=Count('submissions', filter=Q(submissions__status__lte=1)),
+        n_completed=Count('submissions', filter=Q(submissions__status=2)),
+        n_failed=Count('submissions', filter=Q(submissions__status__gte=3)))
+    for b in counts:
+        Batch.objects.filter(pk=b.pk).update(pending=b.n_pending,
+                                             completed=b.n_completed,
+                                             failed=b.n_failed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0069_task_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='completed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batch',
+            name='pending',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_batch_submissions,
+                             migrations.RunPython.noop),
+    ]
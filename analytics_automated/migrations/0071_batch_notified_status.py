@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0070_batch_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batch',
+            name='notified_status',
+            field=models.IntegerField(blank=True, choices=[(0, 'Submitted'), (1, 'Running'), (2, 'Complete'), (3, 'Error'), (4, 'Crash')], default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0071_batch_notified_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StepTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.IntegerField()),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField()),
+                ('queue_wait', models.FloatField(blank=True, null=True)),
+                ('metadata', models.FloatField(blank=True, null=True)),
+                ('get_data', models.FloatField(blank=True, null=True)),
+                ('prepare', models.FloatField(blank=True, null=True)),
+                ('run_cmd', models.FloatField(blank=True, null=True)),
+                ('insert_data', models.FloatField(blank=True, null=True)),
+                ('tidy', models.FloatField(blank=True, null=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timings', to='analytics_automated.submission')),
+                ('task', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='analytics_automated.task')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='steptiming',
+            index=models.Index(fields=['submission', 'step'], name='analytics_a_submiss_845673_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:19
+
+import analytics_automated.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0072_steptiming'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='step',
+            name='depends_on',
+            field=models.CharField(blank=True, max_length=256, null=True, validators=[analytics_automated.models.Step.validate_depends_on]),
+        ),
+        migrations.CreateModel(
+            name='PendingStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.IntegerField()),
+                ('waiting', models.IntegerField(default=0)),
+                ('released', models.BooleanField(default=False)),
+                ('signature', models.TextField(blank=True, null=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_steps', to='analytics_automated.submission')),
+            ],
+            options={
+                'unique_together': {('submission', 'step')},
+            },
+        ),
+    ]
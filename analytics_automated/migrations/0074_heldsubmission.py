@@ -0,0 +1,25 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0073_step_dependencies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeldSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client', models.CharField(db_index=True, max_length=64)),
+                ('weight', models.FloatField(default=1.0)),
+                ('request_contents', models.JSONField(default=dict)),
+                ('job_priority', models.IntegerField()),
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='held', to='analytics_automated.submission')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0074_heldsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backend',
+            name='running',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='backends',
+            field=models.ManyToManyField(blank=True, related_name='pooled_tasks', to='analytics_automated.Backend'),
+        ),
+    ]
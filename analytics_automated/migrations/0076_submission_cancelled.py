@@ -0,0 +1,28 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0075_task_backends'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='batch',
+            name='notified_status',
+            field=models.IntegerField(blank=True, choices=[(0, 'Submitted'), (1, 'Running'), (2, 'Complete'), (3, 'Error'), (4, 'Crash'), (5, 'Cancelled')], default=None, null=True),
+        ),
+        migrations.AlterField(
+            model_name='batch',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Submitted'), (1, 'Running'), (2, 'Complete'), (3, 'Error'), (4, 'Crash'), (5, 'Cancelled')], default=0),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Submitted'), (1, 'Running'), (2, 'Complete'), (3, 'Error'), (4, 'Crash'), (5, 'Cancelled')], default=0),
+        ),
+    ]
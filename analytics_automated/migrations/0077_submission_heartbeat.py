@@ -0,0 +1,28 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0076_submission_cancelled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='requeues',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='resume_signature',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:47
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0077_submission_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='plan_version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
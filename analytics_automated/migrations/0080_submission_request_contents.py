@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0079_submission_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='request_contents',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.14 on 2026-10-17 18:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0080_submission_request_contents'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='submission',
+            name='heartbeat',
+        ),
+        migrations.RemoveField(
+            model_name='submission',
+            name='resume_signature',
+        ),
+        migrations.CreateModel(
+            name='RunningTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=64, unique=True)),
+                ('hostname', models.CharField(max_length=256)),
+                ('step', models.IntegerField()),
+                ('heartbeat', models.DateTimeField(db_index=True)),
+                ('resume_signature', models.TextField(blank=True, null=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='running_tasks', to='analytics_automated.submission')),
+            ],
+        ),
+    ]
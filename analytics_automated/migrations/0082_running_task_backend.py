@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-17 19:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0081_running_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runningtask',
+            name='backend',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='running_tasks', to='analytics_automated.backend'),
+        ),
+    ]
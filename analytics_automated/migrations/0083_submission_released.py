@@ -0,0 +1,22 @@
+# Generated by Django 3.2.14 on 2026-10-17 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0082_running_task_backend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='released',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['ip', 'released'], name='analytics_a_ip_1d60a8_idx'),
+        ),
+    ]
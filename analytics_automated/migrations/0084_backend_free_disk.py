@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-17 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics_automated', '0083_submission_released'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backend',
+            name='free_disk',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
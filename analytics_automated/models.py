@@ -1,6 +1,15 @@
 import re
+import os
+import json
+import uuid
+import hashlib
 from django.db import models
 from django.db import transaction
+from django.db import IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
 
@@ -55,6 +64,12 @@ class Backend(models.Model):
     # port = models.IntegerField(default=80, null=False, blank=False)
     root_path = models.CharField(max_length=256, null=False, default="/tmp/",
                                  blank=False)
+    # task_runners currently running on this backend. Changed with F()
+    # updates by the workers and reconciled with the RunningTasks placed on
+    # it by reap_stuck_submissions
+    running = models.IntegerField(null=False, default=0)
+    # bytes free under root_path when a worker last finished a task here
+    free_disk = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -92,6 +107,14 @@ class Job(models.Model):
     name = models.CharField(max_length=64, unique=True, null=False,
                             blank=False, db_index=True)
     runnable = models.BooleanField(default=False, blank=False)
+    # replaced whenever the job, its steps or their tasks change so that
+    # every process knows when its compiled plan of the job is stale
+    plan_version = models.UUIDField(default=uuid.uuid4, null=False,
+                                    editable=False)
+
+    def save(self, *args, **kwargs):
+        self.plan_version = uuid.uuid4()
+        super(Job, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -143,6 +166,10 @@ class Task(models.Model):
     )
     backend = models.ForeignKey(Backend, on_delete=models.SET_NULL, null=True,
                                 related_name='tasks', blank=False)
+    # other backends of the same queue type the task may run on. Each run
+    # is sent to the queue of whichever of these and backend is least loaded
+    backends = models.ManyToManyField(Backend, blank=True,
+                                      related_name='pooled_tasks')
     name = models.CharField(max_length=64, unique=True, null=False,
                             blank=False)
     description = models.CharField(max_length=256, null=True)
@@ -157,9 +184,28 @@ class Task(models.Model):
                                           blank=True)
     custom_exit_behaviour = models.IntegerField(null=True, blank=True,
                                                 choices=COMPLETION_CHOICES,)
+    # replaced whenever the task, its backend or queue type changes so that
+    # workers know when their cached copy of the task is stale
+    version = models.UUIDField(default=uuid.uuid4, null=False, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.version = uuid.uuid4()
+        super(Task, self).save(*args, **kwargs)
 
     def __str__(self):
         return self.name
+
+    def pool(self):
+        """
+            The backends the task may run on: its backend then those of its
+            backends which share its queue type
+        """
+        if self.backend is None:
+            return []
+        return [self.backend] + \
+            [backend for backend in self.backends.all()
+             if backend.pk != self.backend_id and
+             backend.queue_type_id == self.backend.queue_type_id]
 # TODO: deleting a task should set any jobs to runnable false where it is
 # missing
 
@@ -188,16 +234,51 @@ class Configuration(models.Model):
         return(d[self.type])
 
 
+def parse_orderings(value):
+    if value is None:
+        return []
+    value = value.replace(" ", "")
+    if len(value) == 0:
+        return []
+    return list(map(int, value.split(",")))
+
+
 class Step(models.Model):
+
+    def validate_depends_on(value):
+        try:
+            parse_orderings(value)
+        except ValueError:
+            raise(ValidationError("DEPENDS ON MUST BE A COMMA SEPARATED "
+                                  "LIST OF ORDERINGS: "+value))
+
     job = models.ForeignKey(Job, related_name='steps',
                             on_delete=models.CASCADE)
     task = models.ForeignKey(Task, null=True,
                              on_delete=models.CASCADE)
     ordering = models.IntegerField(default=0, null=False, blank=False)
+    # the orderings of the steps this step takes its inputs from. If any
+    # step of a job sets this the job runs each step as soon as the steps
+    # it depends on are done. Steps without it depend on the ordering before
+    depends_on = models.CharField(max_length=256, null=True, blank=True,
+                                  validators=[validate_depends_on])
 
     def __str__(self):
         return str(self.task)
 
+    def upstream_orderings(self):
+        return parse_orderings(self.depends_on)
+
+    def clean(self):
+        try:
+            upstream = self.upstream_orderings()
+        except ValueError:
+            return  # reported by the field validator
+        for ordering in upstream:
+            if ordering >= self.ordering:
+                raise(ValidationError("STEPS CAN ONLY DEPEND ON STEPS WITH A "
+                                      "LOWER ORDERING: "+str(ordering)))
+
     class Meta:
         ordering = ['ordering']
 
@@ -238,32 +319,186 @@ class Batch(models.Model):
     ERROR = 3      # A task has failed, the job has stopped
     CRASH = 4      # Something crashed, went away of segfaulted in some way
     #                the job has stopped
+    CANCELLED = 5  # Cancelled by the user or an admin, the job has stopped
     STATUS_CHOICES = (
         (SUBMITTED, "Submitted"),
         (RUNNING, "Running"),
         (COMPLETE, "Complete"),
         (ERROR, "Error"),
         (CRASH, "Crash"),
+        (CANCELLED, "Cancelled"),
     )
+    # states no worker may move a submission or batch on from
+    STOPPED = (ERROR, CRASH, CANCELLED)
     UUID = models.CharField(max_length=64, unique=False, null=True,
                             blank=False, db_index=True)
     status = models.IntegerField(null=False, blank=False,
                                  choices=STATUS_CHOICES, default=SUBMITTED)
+    last_message = models.CharField(max_length=2046, null=True, blank=True,
+                                    default=None)
+    # the raw request of an asynchronous submission, cleared once dispatched
+    pending_request = models.JSONField(null=True, blank=True, default=None)
+    # submissions still queued or running and those which have finished.
+    # Only ever changed with F() updates, never by saving an instance
+    pending = models.IntegerField(null=False, default=0)
+    completed = models.IntegerField(null=False, default=0)
+    failed = models.IntegerField(null=False, default=0)
+    # the terminal status users have been notified of, if any
+    notified_status = models.IntegerField(null=True, blank=True,
+                                          choices=STATUS_CHOICES,
+                                          default=None)
 
     def __str__(self):
         return self.UUID
 
     @transaction.atomic
     def update_batch_state(b, new_status):
-        if b.status != Batch.ERROR and b.status != Batch.CRASH:
+        # a stale instance must not overwrite an error another worker set
+        updated = Batch.objects.filter(pk=b.pk) \
+                               .exclude(status__in=Batch.STOPPED) \
+                               .update(status=new_status)
+        if updated:
             b.status = new_status
-            b.save()
+
+    def claim_notification(batch_id):
+        """
+            Returns True to the one caller which gets to notify users that
+            the batch has reached its current terminal status
+        """
+        return Batch.objects.filter(pk=batch_id,
+                                    status__in=[Batch.COMPLETE, Batch.ERROR,
+                                                Batch.CRASH]) \
+                            .exclude(notified_status=F('status')) \
+                            .update(notified_status=F('status')) == 1
+
+    def finish_submission(batch_id, submission_status):
+        """
+            Moves one of the batch's submissions from pending to completed
+            or failed. When the last pending submission completes the batch
+            is marked complete; only one caller sees True for that. Errors
+            stop the batch themselves, so a batch whose last submission
+            completes or is cancelled after others were cancelled is marked
+            cancelled
+        """
+        done = 1 if submission_status == Batch.COMPLETE else 0
+        Batch.objects.filter(pk=batch_id) \
+                     .update(pending=F('pending')-1,
+                             completed=F('completed')+done,
+                             failed=F('failed')+(1-done))
+        finished = Batch.objects.filter(pk=batch_id, pending__lte=0,
+                                        status__in=[Batch.SUBMITTED,
+                                                    Batch.RUNNING])
+        if submission_status in (Batch.COMPLETE, Batch.CANCELLED) and \
+           finished.filter(failed__gt=0).update(status=Batch.CANCELLED):
+            return False
+        return finished.update(status=Batch.COMPLETE) == 1
 
     def returnStatus(self):
         d = dict(Batch.STATUS_CHOICES)
         return(d[self.status])
 
 
+def blob_path(instance, filename):
+    """
+        Blobs are fanned out over subdirectories by the first two characters
+        of their digest to keep the directory listings short
+    """
+    extension = os.path.splitext(filename)[1]
+    return os.path.join("blobs", instance.digest[:2],
+                        instance.digest+extension)
+
+
+# Store each distinct submission input once, addressed by its SHA-256 digest
+class InputBlob(TimeStampedModel):
+    digest = models.CharField(max_length=64, unique=True, null=False,
+                              blank=False, db_index=True)
+    data = models.FileField(upload_to=blob_path, null=False)
+    size = models.BigIntegerField(null=False, default=0)
+    ref_count = models.IntegerField(null=False, default=0)
+
+    def __str__(self):
+        return self.digest
+
+    def store(upload, references=1):
+        """
+            Returns the blob holding the upload's bytes, writing the file
+            only if these bytes have not been seen before, and takes
+            references on it for that many Submissions
+        """
+        sha = hashlib.sha256()
+        size = 0
+        for chunk in upload.chunks():
+            sha.update(chunk)
+            size += len(chunk)
+        digest = sha.hexdigest()
+        with transaction.atomic():
+            blob, created = InputBlob.objects.select_for_update() \
+                                     .get_or_create(digest=digest,
+                                                    defaults={'size': size})
+            if created or not blob.data.storage.exists(blob.data.name):
+                blob.data.save(os.path.basename(upload.name), upload,
+                               save=False)
+            blob.ref_count = F('ref_count') + references
+            blob.save()
+        blob.refresh_from_db()
+        return blob
+
+    def retain(blob_id, references):
+        InputBlob.objects.filter(pk=blob_id) \
+                         .update(ref_count=F('ref_count') + references)
+
+    def release(blob_id):
+        """
+            Drops a reference and removes the blob and its file once no
+            Submission uses it
+        """
+        with transaction.atomic():
+            try:
+                blob = InputBlob.objects.select_for_update().get(pk=blob_id)
+            except InputBlob.DoesNotExist:
+                return
+            if blob.ref_count > 1:
+                blob.ref_count = F('ref_count') - 1
+                blob.save(update_fields=['ref_count'])
+                return
+            name = blob.data.name
+            storage = blob.data.storage
+            blob.delete()
+        if name:
+            storage.delete(name)
+
+
+# Number of SUBMITTED or RUNNING submissions for each client ip. Kept up to
+# date as Submissions change state so queue quotas are a single row lookup
+class ActiveSubmissionCount(models.Model):
+    ip = models.GenericIPAddressField(unique=True, null=False, blank=False)
+    count = models.IntegerField(null=False, default=0)
+
+    def __str__(self):
+        return self.ip
+
+    def lookup(ip):
+        count = ActiveSubmissionCount.objects.filter(ip=ip) \
+                                     .values_list('count', flat=True).first()
+        if count is None:
+            return 0
+        return count
+
+    def adjust(ip, delta):
+        if ActiveSubmissionCount.objects.filter(ip=ip) \
+                                .update(count=F('count') + delta):
+            return
+        if delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                ActiveSubmissionCount.objects.create(ip=ip, count=delta)
+        except IntegrityError:
+            # another process created the row first
+            ActiveSubmissionCount.objects.filter(ip=ip) \
+                                 .update(count=F('count') + delta)
+
+
 class Submission(TimeStampedModel):
     SUBMITTED = 0  # a job has been submitted but no worker has claimed it
     RUNNING = 1    # job submitted and worker has claimed it
@@ -271,13 +506,17 @@ class Submission(TimeStampedModel):
     ERROR = 3      # A task has failed, the job has stopped
     CRASH = 4      # Something crashed, went away of segfaulted in some way
     #                the job has stopped
+    CANCELLED = 5  # Cancelled by the user or an admin, the job has stopped
     STATUS_CHOICES = (
         (SUBMITTED, "Submitted"),
         (RUNNING, "Running"),
         (COMPLETE, "Complete"),
         (ERROR, "Error"),
         (CRASH, "Crash"),
+        (CANCELLED, "Cancelled"),
     )
+    # states no worker may move a submission or batch on from
+    STOPPED = (ERROR, CRASH, CANCELLED)
 
     LOW = 0
     MEDIUM = 1
@@ -299,7 +538,8 @@ class Submission(TimeStampedModel):
                                       blank=False)
     input_data = models.FileField(blank=False)
     status = models.IntegerField(null=False, blank=False,
-                                 choices=STATUS_CHOICES, default=SUBMITTED)
+                                 choices=STATUS_CHOICES, default=SUBMITTED,
+                                 db_index=True)
     last_message = models.CharField(max_length=2046, null=True, blank=True,
                                     default="Submitted")
     claimed = models.BooleanField(null=False, default=False)
@@ -310,30 +550,143 @@ class Submission(TimeStampedModel):
     step_id = models.IntegerField(null=True, blank=False)
     batch = models.ForeignKey(Batch, null=True, related_name='submissions',
                               on_delete=models.CASCADE)
+    blob = models.ForeignKey(InputBlob, null=True, blank=True,
+                             related_name='submissions',
+                             on_delete=models.SET_NULL)
+    # identical requests share a fingerprint; while the first is still
+    # queued or running later ones follow it rather than running again
+    fingerprint = models.CharField(max_length=64, null=True, blank=True,
+                                   db_index=True)
+    leader = models.ForeignKey('self', null=True, blank=True,
+                               related_name='followers',
+                               on_delete=models.SET_NULL)
+    # a follower keeps its request so that it can run in its leader's place
+    # if the leader is cancelled or deleted
+    request_contents = models.JSONField(null=True, blank=True)
+    # how many steps the reaper has sent again after their worker went
+    requeues = models.IntegerField(default=0)
+    # when fair share released it from its client's held queue; the
+    # client's recent usage is charged from this
+    released = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['ip', 'released'])]
+
+    # the ip this row is counted against in ActiveSubmissionCount, if any
+    _counted_ip = None
+    # Messages waiting for the next flushed update_submission_state()
+    _pending_messages = None
 
     def __str__(self):
         return str(self.pk)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Submission, cls).from_db(db, field_names, values)
+        if 'status' in instance.__dict__ and 'ip' in instance.__dict__:
+            instance._counted_ip = Submission.active_ip(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            Submission.update_active_count(self)
+            super(Submission, self).save(*args, **kwargs)
+        self._counted_ip = Submission.active_ip(self)
+
+    def active_ip(s):
+        if s.status <= Submission.RUNNING:
+            return s.ip
+        return None
+
+    def update_active_count(s):
+        """
+            Moves this submission's contribution to ActiveSubmissionCount and
+            its batch's counters when its status or ip changes. Only the
+            first writer to take the stored row out of the active states
+            releases it, so workers saving the same submission concurrently
+            can't count it twice
+        """
+        active_ip = Submission.active_ip(s)
+        if s._counted_ip == active_ip:
+            return
+        if s._counted_ip is not None:
+            released = Submission.objects.filter(
+                pk=s.pk, ip=s._counted_ip,
+                status__lte=Submission.RUNNING).update(status=s.status,
+                                                       ip=s.ip)
+            if released:
+                ActiveSubmissionCount.adjust(s._counted_ip, -1)
+                if active_ip is None and s.batch_id is not None:
+                    Batch.finish_submission(s.batch_id, s.status)
+        if active_ip is not None:
+            ActiveSubmissionCount.adjust(active_ip, 1)
+            if s._counted_ip is None and s.batch_id is not None:
+                Batch.objects.filter(pk=s.batch_id) \
+                             .update(pending=F('pending')+1)
+
     def returnStatus(self):
         d = dict(Submission.STATUS_CHOICES)
         return(d[self.status])
 
     @transaction.atomic
-    def update_submission_state(s, claim, new_status, step, id, message, host):
+    def update_submission_state(s, claim, new_status, step, id, message, host,
+                                flush=True):
         """
-            Updates the Submission object with some book keeping
+            Updates the Submission object with some book keeping. Only the
+            columns which changed are written. The Message is buffered on
+            the instance and, unless flush is False, written along with any
+            earlier buffered Messages in one insert
         """
-        s.claimed = claim
-        s.status = new_status
-        s.last_message = message
-        s.worker_id = id
-        s.step_id = step
-        s.hostname = host
-        s.save()
-        m = Message.objects.create(submission=s,
-                                   step_id=step,
-                                   message=message)
-        m.save()
+        # a worker failing on a submission which was cancelled under it
+        # leaves it cancelled
+        if new_status in (Submission.ERROR, Submission.CRASH) and \
+           s.pk is not None and \
+           Submission.objects.filter(pk=s.pk,
+                                     status=Submission.CANCELLED).exists():
+            s.status = Submission.CANCELLED
+            return
+        values = {'claimed': claim, 'status': new_status,
+                  'last_message': message, 'worker_id': id, 'step_id': step,
+                  'hostname': host}
+        changed = [field for field, value in values.items()
+                   if getattr(s, field) != value]
+        for field in changed:
+            setattr(s, field, values[field])
+        if s.pk is None:
+            s.save()
+        elif changed:
+            s.save(update_fields=changed+['modified'])
+        if 'status' in changed:
+            # imported here as the metrics module reads these models
+            from .metrics import count_submissions
+            count_submissions(s.job_id, new_status)
+        if new_status in Submission.STOPPED:
+            # a stopped DAG submission releases no more of its steps
+            PendingStep.cancel(s.pk)
+        if s._pending_messages is None:
+            s._pending_messages = []
+        s._pending_messages.append(Message(submission=s, step_id=step,
+                                           message=message))
+        if flush:
+            Submission.flush_messages(s)
+
+    def flush_messages(s):
+        if s._pending_messages:
+            Message.objects.bulk_create(s._pending_messages)
+        s._pending_messages = None
+
+
+def file_extension(file_name):
+    """
+        Everything after the first '.' of a file's base name, so the output
+        "[UUID].horiz.txt" has the extension "horiz.txt"
+    """
+    if not file_name:
+        return None
+    parts = os.path.basename(file_name).split(".", 1)
+    if len(parts) < 2:
+        return None
+    return parts[1]
 
 
 # Store results data
@@ -344,13 +697,23 @@ class Result(TimeStampedModel):
     step = models.IntegerField(null=False, blank=False)
     previous_step = models.IntegerField(null=True, blank=False)
     result_data = models.FileField(null=False)
+    # the file ending later tasks select this result by with their in_glob
+    extension = models.CharField(max_length=256, null=True, blank=True)
     name = models.CharField(max_length=64, null=True, blank=False)
     message = models.CharField(max_length=256, null=True, blank=True,
                                default="Submitted")
 
+    class Meta:
+        indexes = [models.Index(fields=['submission', 'extension', 'step'])]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.extension is None:
+            self.extension = file_extension(self.result_data.name)
+        super(Result, self).save(*args, **kwargs)
+
 
 # keep a timestamped history of all the messages sent for this jobs
 class Message(TimeStampedModel):
@@ -362,3 +725,179 @@ class Message(TimeStampedModel):
 
     def __str__(self):
         return str(self.pk)
+
+
+# How long each phase of one task_runner execution took, in seconds
+class StepTiming(models.Model):
+    PHASES = ('queue_wait', 'metadata', 'get_data', 'prepare', 'run_cmd',
+              'insert_data', 'tidy')
+    submission = models.ForeignKey(Submission, related_name='timings',
+                                   on_delete=models.CASCADE)
+    task = models.ForeignKey(Task, on_delete=models.SET_NULL, null=True)
+    step = models.IntegerField(null=False, blank=False)
+    started = models.DateTimeField(null=False)
+    finished = models.DateTimeField(null=False)
+    queue_wait = models.FloatField(null=True, blank=True)
+    metadata = models.FloatField(null=True, blank=True)
+    get_data = models.FloatField(null=True, blank=True)
+    prepare = models.FloatField(null=True, blank=True)
+    run_cmd = models.FloatField(null=True, blank=True)
+    insert_data = models.FloatField(null=True, blank=True)
+    tidy = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['submission', 'step'])]
+
+    def __str__(self):
+        return str(self.pk)
+
+
+# A submission waiting in its client's fair share queue to be sent to celery.
+# The request and priority it was accepted with are kept to build its chain
+class HeldSubmission(models.Model):
+    submission = models.OneToOneField(Submission, related_name='held',
+                                      on_delete=models.CASCADE)
+    client = models.CharField(max_length=64, null=False, blank=False,
+                              db_index=True)
+    weight = models.FloatField(default=1.0, null=False)
+    request_contents = models.JSONField(null=False, default=dict)
+    job_priority = models.IntegerField(null=False)
+
+    def __str__(self):
+        return str(self.pk)
+
+    def hold(submission_ids, client, request_contents, job_priority,
+             weight):
+        HeldSubmission.objects.bulk_create(
+            [HeldSubmission(submission_id=submission_id, client=client,
+                            weight=weight, request_contents=request_contents,
+                            job_priority=job_priority)
+             for submission_id in submission_ids])
+
+
+# A task_runner a worker has claimed, one row per task so that the steps
+# of a group or DAG which run at once are each tracked. The worker stamps
+# heartbeat while the step runs and deletes the row when it finishes;
+# resume_signature runs the step again if the worker goes
+class RunningTask(models.Model):
+    submission = models.ForeignKey(Submission, related_name='running_tasks',
+                                   on_delete=models.CASCADE)
+    task_id = models.CharField(max_length=64, unique=True, null=False,
+                               blank=False)
+    hostname = models.CharField(max_length=256, null=False, blank=False)
+    step = models.IntegerField(null=False, blank=False)
+    heartbeat = models.DateTimeField(null=False, db_index=True)
+    resume_signature = models.TextField(null=True, blank=True)
+    backend = models.ForeignKey(Backend, null=True, blank=True,
+                                related_name='running_tasks',
+                                on_delete=models.SET_NULL)
+
+    def __str__(self):
+        return self.task_id
+
+
+# A step of a submission whose job runs as a DAG which has not finished
+# yet. waiting counts the steps it depends on which have not finished and
+# signature is the task_runner call sent once it is released
+class PendingStep(models.Model):
+    submission = models.ForeignKey(Submission, related_name='pending_steps',
+                                   on_delete=models.CASCADE)
+    step = models.IntegerField(null=False, blank=False)
+    waiting = models.IntegerField(default=0, null=False, blank=False)
+    released = models.BooleanField(default=False, null=False)
+    signature = models.TextField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('submission', 'step')
+
+    def __str__(self):
+        return str(self.pk)
+
+    def start(submission, nodes):
+        """
+            Records every step of a submission's DAG, given as (step,
+            parents, signature) nodes, and returns the signatures of the
+            steps which depend on nothing
+        """
+        roots = [node[2] for node in nodes if node[1] == 0]
+        PendingStep.objects.bulk_create(
+            [PendingStep(submission=submission, step=step, waiting=parents,
+                         released=parents == 0,
+                         signature=None if parents == 0 else
+                         json.dumps(signature))
+             for step, parents, signature in nodes],
+            ignore_conflicts=True)
+        return roots
+
+    def finish(submission_id, step, dependents):
+        """
+            Marks a step done and releases any of its dependents which were
+            only waiting on it. Returns the signatures to send and whether
+            every step of the submission has now finished. Each dependent is
+            only released once however many copies of a step finish
+        """
+        released = []
+        deleted, _ = PendingStep.objects.filter(submission_id=submission_id,
+                                                step=step).delete()
+        if deleted and dependents:
+            children = PendingStep.objects.filter(submission_id=submission_id,
+                                                  step__in=dependents)
+            children.update(waiting=F('waiting')-1)
+            for child in children.filter(waiting__lte=0, released=False):
+                if PendingStep.objects.filter(pk=child.pk, released=False) \
+                                      .update(released=True) == 1:
+                    released.append(json.loads(child.signature))
+        finished = not PendingStep.objects.filter(
+            submission_id=submission_id).exists()
+        return released, finished
+
+    def cancel(submission_id):
+        PendingStep.objects.filter(submission_id=submission_id).delete()
+
+
+@receiver(post_delete, sender=Submission)
+def release_input_blob(sender, instance, **kwargs):
+    if instance.blob_id is not None:
+        InputBlob.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=Submission)
+def release_active_count(sender, instance, **kwargs):
+    if instance._counted_ip is not None:
+        ActiveSubmissionCount.adjust(instance._counted_ip, -1)
+        if instance.batch_id is not None:
+            Batch.objects.filter(pk=instance.batch_id) \
+                         .update(pending=F('pending')-1)
+
+
+@receiver([post_save, pre_delete], sender=Backend)
+@receiver([post_save, pre_delete], sender=QueueType)
+@receiver([post_save, post_delete], sender=BackendUser)
+def renew_task_versions(sender, instance, **kwargs):
+    """
+        Deleting a Backend or QueueType nulls the tasks' keys without any
+        signal so their versions are renewed before the delete instead
+    """
+    if sender is BackendUser:
+        tasks = Task.objects.filter(models.Q(backend=instance.backend_id) |
+                                    models.Q(backends=instance.backend_id))
+    elif sender is Backend:
+        tasks = Task.objects.filter(models.Q(backend=instance) |
+                                    models.Q(backends=instance))
+    else:
+        tasks = Task.objects.filter(backend__queue_type=instance)
+    Task.objects.filter(pk__in=list(tasks.values_list('pk', flat=True))) \
+                .update(version=uuid.uuid4())
+
+
+@receiver(m2m_changed, sender=Task.backends.through)
+def renew_pooled_task_versions(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Task):
+        pks = [instance.pk]
+    elif pk_set is not None:
+        pks = list(pk_set)
+    else:
+        pks = list(instance.pooled_tasks.values_list('pk', flat=True))
+    Task.objects.filter(pk__in=pks).update(version=uuid.uuid4())
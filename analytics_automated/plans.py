@@ -0,0 +1,408 @@
+import uuid
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+from celery import chain, group
+from celery import current_app
+
+from django.db.models import Prefetch, Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import Job, Step, Task, Parameter, Environment, Backend
+from .models import QueueType, Submission
+from .tasks import task_runner, chord_end, start_dag
+from .routing import Placement, backend_queue
+
+logger = logging.getLogger(__name__)
+
+'''
+    Compiles Jobs in to reusable execution plans. A plan holds everything
+    about a job's steps that does not change between submissions (task names,
+    queues and the ParameterSchema of parameters and environments) so that
+    validating a submission and building its celery signatures needs no
+    database queries and no string building.
+'''
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+ParameterSpec = namedtuple('ParameterSpec', ['flag', 'default',
+                                             'bool_valued', 'rest_alias',
+                                             'spacing', 'switchless'])
+
+
+class TaskSchema(object):
+    """
+        The parameters and environment of one Task
+    """
+
+    def __init__(self, task):
+        self.parameters = [ParameterSpec(param.flag, param.default,
+                                         param.bool_valued, param.rest_alias,
+                                         param.spacing, param.switchless)
+                           for param in task.parameters.all()]
+        self.environment = {}
+        for env in task.environment.all():
+            self.environment[env.env] = env.value
+
+    def build_params(self, request_data):
+        params = []
+        param_values = {}
+        for param in self.parameters:
+            if "VALUE" in param.flag:
+                continue
+            if param.bool_valued is True:
+                # omit flag if user set false if not fail over to including it
+                if param.rest_alias in request_data and \
+                 (request_data[param.rest_alias] == 'FALSE' or
+                  request_data[param.rest_alias] == 'False'):
+                    params.append('')
+                else:
+                    params.append(param.flag)
+            else:
+                params.append(param.flag)
+                param_values[param.flag] = {}
+                if param.rest_alias in request_data:
+                    param_values[param.flag]['value'] = \
+                        request_data[param.rest_alias]
+                else:
+                    param_values[param.flag]['value'] = param.default
+                param_values[param.flag]['switchless'] = param.switchless
+                param_values[param.flag]['spacing'] = param.spacing
+        return(params, param_values)
+
+    def return_value(self, request_data):
+        for param in self.parameters:
+            if param.bool_valued is False and "VALUE" in param.flag:
+                if param.rest_alias in request_data:
+                    return request_data[param.rest_alias]
+                else:
+                    return param.default
+        return ''
+
+
+class ParameterSchema(object):
+    """
+        Every parameter alias, flag, default, switch and environment setting
+        for all the steps of a job. Loaded along with the job's plan so that
+        validating and dispatching a submission needs no further queries
+    """
+
+    def __init__(self, steps):
+        self.tasks = {}
+        self.aliases = []
+        for step in steps:
+            if step.task.name in self.tasks:
+                continue
+            task_schema = TaskSchema(step.task)
+            self.tasks[step.task.name] = task_schema
+            self.aliases += [param.rest_alias
+                             for param in task_schema.parameters]
+        self.alias_set = frozenset(self.aliases)
+
+    def missing_aliases(self, request_data):
+        return [alias for alias in self.aliases if alias not in request_data]
+
+    def has_all_aliases(self, request_data):
+        return self.alias_set.issubset(request_data)
+
+
+class StepPlan(object):
+    """
+        The compiled, submission independent, configuration of a single Step
+    """
+
+    def __init__(self, step, current_step, step_counter, total_steps,
+                 schema):
+        task = step.task
+        self.ordering = step.ordering
+        self.current_step = current_step
+        self.step_counter = step_counter
+        self.total_steps = total_steps
+        self.task_name = task.name
+        self.queue_type = str(task.backend.queue_type)
+        self.execution_behaviour = task.backend.queue_type.execution_behaviour
+        # only kept for tasks which may run on more than one backend
+        self.backends = task.pool()
+        if len(self.backends) < 2:
+            self.backends = []
+        self.schema = schema.tasks[task.name]
+        # only set for the steps of DAG plans
+        self.parents = []
+        self.upstream = None
+        self.dependents = []
+
+    def signature(self, UUID, request_data, queue_name, backend=None):
+        (params, param_values) = self.schema.build_params(request_data)
+        value = self.schema.return_value(request_data)
+        kwargs = {}
+        if self.upstream is not None:
+            kwargs = {'upstream': self.upstream,
+                      'dependents': self.dependents}
+        if backend is not None:
+            kwargs['backend'] = backend.pk
+        return task_runner.subtask((UUID,
+                                    self.ordering,
+                                    self.current_step,
+                                    self.step_counter,
+                                    self.total_steps,
+                                    self.task_name,
+                                    params,
+                                    param_values,
+                                    value,
+                                    self.execution_behaviour,
+                                    dict(self.schema.environment)),
+                                   kwargs,
+                                   immutable=True,
+                                   queue=queue_name)
+
+
+class ExecutionPlan(object):
+    """
+        The compiled form of a Job. Steps which share an ordering are
+        gathered in to a level which is sent to celery as a group()
+
+        If any step declares the steps it depends on the job is instead a
+        DAG. Each step gets its own current_step and is sent as soon as the
+        steps it depends on have finished rather than waiting for the whole
+        level before it
+    """
+
+    def __init__(self, job):
+        steps = list(job.steps.all()
+                     .select_related('task__backend__queue_type')
+                     .prefetch_related(
+                        Prefetch('task__parameters',
+                                 queryset=Parameter.objects.order_by('id')),
+                        'task__environment', 'task__backends')
+                     .order_by('ordering', 'pk'))
+        self.job_id = job.pk
+        self.schema = ParameterSchema(steps)
+        self.total_steps = len(steps)
+        self.dag = any(step.upstream_orderings() for step in steps)
+        self.chord_end = False
+        self.levels = []
+        # This hack means that a job which ends in a chord won't complete
+        # during the chord
+        if self.total_steps > 1 and not self.dag:
+            if steps[-1].ordering == steps[-2].ordering:
+                self.total_steps += 1
+                self.chord_end = True
+
+        current_step = 0
+        prev_step = None
+        for step_counter, step in enumerate(steps, start=1):
+            if step.ordering != prev_step or self.dag:
+                current_step += 1
+            if step.ordering != prev_step:
+                self.levels.append([])
+            self.levels[-1].append(StepPlan(step, current_step, step_counter,
+                                            self.total_steps, self.schema))
+            prev_step = step.ordering
+        self.final_step = current_step
+        if self.dag:
+            self.link_steps(steps)
+
+    def link_steps(self, steps):
+        """
+            Works out the parents, dependents and every upstream step of
+            each step of a DAG plan
+        """
+        step_plans = list(self.step_plans())
+        by_ordering = {}
+        for step_plan in step_plans:
+            by_ordering.setdefault(step_plan.ordering, []).append(step_plan)
+        orderings = sorted(by_ordering)
+        for step, step_plan in zip(steps, step_plans):
+            upstream = step.upstream_orderings()
+            if len(upstream) == 0:
+                index = orderings.index(step.ordering)
+                upstream = orderings[max(index-1, 0):index]
+            for ordering in upstream:
+                if ordering not in by_ordering:
+                    logger.warning("Step "+str(step.pk)+" depends on a "
+                                   "missing ordering: "+str(ordering))
+                for parent in by_ordering.get(ordering, []):
+                    step_plan.parents.append(parent)
+                    parent.dependents.append(step_plan.current_step)
+        # parents always have a lower ordering so are linked first
+        for step_plan in step_plans:
+            upstream = set()
+            for parent in step_plan.parents:
+                upstream.add(parent.current_step)
+                upstream.update(parent.upstream)
+            step_plan.upstream = sorted(upstream)
+
+    def __len__(self):
+        return sum(len(level) for level in self.levels)
+
+    def step_plans(self):
+        for level in self.levels:
+            for step_plan in level:
+                yield step_plan
+
+    def fingerprint(self, digest, request_data):
+        """
+            Canonical hash of a request: the job, the input's digest and the
+            value of every parameter the job takes. Fields the job does not
+            read, such as the submission name or email, are left out
+        """
+        sha = hashlib.sha256()
+        sha.update(str(self.job_id).encode("utf-8"))
+        sha.update(b"\0"+digest.encode("utf-8"))
+        for alias in sorted(self.schema.alias_set):
+            sha.update(b"\0"+alias.encode("utf-8")+b"=" +
+                       str(request_data.get(alias)).encode("utf-8"))
+        return sha.hexdigest()
+
+    def signature(self, UUID, request_data, job_priority, placement=None):
+        """
+            Returns the celery chain which runs this plan for one submission
+            or, for a DAG plan, the start_dag call which sends its first
+            steps. Callers dispatching several submissions at once share a
+            routing.Placement between them
+        """
+        if placement is None:
+            placement = Placement()
+        if self.dag:
+            return self.dag_signature(UUID, request_data, job_priority,
+                                      placement)
+        tasks = []
+        queue_name = 'celery'
+        for level in self.levels:
+            sigs = []
+            for step_plan in level:
+                queue_name, backend = queue_for(step_plan, job_priority,
+                                                placement)
+                sigs.append(step_plan.signature(UUID, request_data,
+                                                queue_name, backend))
+            if len(sigs) > 1:
+                tasks.append(group(*sigs))
+            else:
+                tasks.append(sigs[0])
+        if self.chord_end is True:
+            tasks.append(chord_end.subtask((UUID, self.final_step,
+                                            self.total_steps),
+                                           immutable=True, queue=queue_name))
+        return chain(*tasks)
+
+    def dag_signature(self, UUID, request_data, job_priority, placement):
+        nodes = []
+        queue_name = None
+        for step_plan in self.step_plans():
+            step_queue, backend = queue_for(step_plan, job_priority,
+                                            placement)
+            if queue_name is None:
+                queue_name = step_queue
+            nodes.append((step_plan.current_step, len(step_plan.parents),
+                          dict(step_plan.signature(UUID, request_data,
+                                                   step_queue, backend))))
+        return start_dag.subtask((UUID, nodes), immutable=True,
+                                 queue=queue_name)
+
+
+def queue_for(step_plan, job_priority, placement):
+    """
+        The queue a step is sent to and, if its task may run on several
+        backends, the least loaded of them whose queue that is
+    """
+    queue_name = step_plan.queue_type
+    if job_priority is Submission.LOW:
+        queue_name = "low_"+queue_name
+    if job_priority is Submission.HIGH:
+        queue_name = "high_"+queue_name
+    if len(step_plan.backends) == 0:
+        return queue_name, None
+    backend = placement.choose(step_plan.backends, queue_name)
+    return backend_queue(queue_name, backend), backend
+
+
+def dispatch_chains(chains):
+    """
+        Publish a batch of chains. Celery has no multi message publish so
+        instead every chain's first message goes out over the same pooled
+        broker connection rather than each acquiring its own
+    """
+    with current_app.pool.acquire(block=True) as connection:
+        return [tchain.apply_async(connection=connection)
+                for tchain in chains]
+
+
+def get_plan(job):
+    """
+        Return the cached ExecutionPlan for a job, compiling it if the job's
+        plan_version has moved on since it was cached. The version is read
+        from the database so that edits made in one process are seen by all
+        the others. Raises Job.DoesNotExist if the job has been deleted
+    """
+    version = Job.objects.filter(pk=job.pk) \
+                         .values_list('plan_version', flat=True).get()
+    with _plans_lock:
+        plan = _plans.get(job.pk)
+    if plan is None or plan.version != version:
+        logger.debug("Compiling execution plan for "+str(job))
+        plan = ExecutionPlan(job)
+        plan.version = version
+        with _plans_lock:
+            _plans[job.pk] = plan
+    return plan
+
+
+def clear_plans():
+    with _plans_lock:
+        _plans.clear()
+
+
+def renew_plan_versions(jobs):
+    Job.objects.filter(pk__in=list(jobs.values_list('pk', flat=True))) \
+               .update(plan_version=uuid.uuid4())
+
+
+@receiver(post_delete, sender=Job)
+def plan_job_deleted(sender, instance, **kwargs):
+    with _plans_lock:
+        _plans.pop(instance.pk, None)
+
+
+@receiver([post_save, post_delete], sender=Step)
+@receiver([post_save, post_delete], sender=Task)
+@receiver([post_save, post_delete], sender=Parameter)
+@receiver([post_save, post_delete], sender=Environment)
+@receiver([post_save, pre_delete], sender=Backend)
+@receiver([post_save, pre_delete], sender=QueueType)
+def plan_config_changed(sender, instance, **kwargs):
+    """
+        Deleting a Backend or QueueType nulls the tasks' keys without any
+        signal so the plans are renewed before the delete instead
+    """
+    logger.debug("Renewing execution plans, "+sender.__name__+" changed")
+    if sender is Step:
+        jobs = Job.objects.filter(pk=instance.job_id)
+    elif sender is Task:
+        jobs = Job.objects.filter(steps__task=instance)
+    elif sender is Backend:
+        jobs = Job.objects.filter(Q(steps__task__backend=instance) |
+                                  Q(steps__task__backends=instance))
+    elif sender is QueueType:
+        jobs = Job.objects.filter(steps__task__backend__queue_type=instance)
+    else:
+        jobs = Job.objects.filter(steps__task_id=instance.task_id)
+    renew_plan_versions(jobs)
+
+
+@receiver(m2m_changed, sender=Task.backends.through)
+def plan_pool_changed(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Task):
+        jobs = Job.objects.filter(steps__task=instance)
+    elif pk_set is not None:
+        jobs = Job.objects.filter(steps__task__in=pk_set)
+    else:
+        jobs = Job.objects.filter(steps__task__backends=instance)
+    renew_plan_versions(jobs)
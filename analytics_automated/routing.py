@@ -0,0 +1,161 @@
+import getpass
+import shutil
+import logging
+
+from celery import current_app
+
+from django.conf import settings
+from django.db.models import F, Count
+
+from .models import Backend, RunningTask
+from .metrics import queue_depth
+
+logger = logging.getLogger(__name__)
+
+'''
+    Load aware choice of where a task runs. A task may list several backends
+    of its queue type and each of those backends has a celery queue of its
+    own, named after the task's queue and the backend (high_localhost.host2).
+    When a submission is dispatched each step of such a task is sent to the
+    queue of the backend with the least load, counting the task_runners
+    running on it and the messages waiting in its queue, and passing over
+    backends whose workers last reported less than BACKEND_MIN_FREE_DISK
+    bytes free under the root path. The workers of each backend consume its
+    queues and run the step under its root path. A task with a single
+    backend keeps using the queue type's queues and is not counted.
+'''
+
+
+def free_disk(backend):
+    """
+        Bytes free under the backend's root path, or None if this worker
+        can not see it
+    """
+    try:
+        return shutil.disk_usage(backend.root_path).free
+    except OSError:
+        return None
+
+
+def backend_queue(queue_name, backend):
+    return queue_name+"."+backend.name
+
+
+def queue_depths(names):
+    """
+        Messages waiting in each of the named queues, all read over one
+        pooled broker connection. Zero for all of them if the broker can not
+        be reached
+    """
+    try:
+        with current_app.pool.acquire(block=True) as connection:
+            return [queue_depth(connection, name) for name in names]
+    except Exception as e:
+        logger.error("Unable to read queue depths: "+str(e))
+        return [0 for name in names]
+
+
+class Placement(object):
+    """
+        The load on a pool of backends for one dispatch. Each backend's load
+        is read once, from the database and the broker, and every step this
+        dispatch places on it adds to it, so the submissions of a batch
+        spread over the backends instead of all going to whichever was least
+        loaded when the batch arrived
+    """
+
+    def __init__(self):
+        self.loads = {}
+
+    def read_loads(self, backends, queue_name):
+        rows = Backend.objects.filter(pk__in=[b.pk for b in backends]) \
+                              .values_list('pk', 'running', 'free_disk')
+        reported = {pk: (running, free) for pk, running, free in rows}
+        depths = queue_depths([backend_queue(queue_name, backend)
+                               for backend in backends])
+        for backend, depth in zip(backends, depths):
+            running, free = reported.get(backend.pk, (0, None))
+            self.loads[(queue_name, backend.pk)] = [running+depth, free]
+
+    def choose(self, backends, queue_name):
+        """
+            The least loaded of a task's backends. Ties go to the one with
+            the most free disk, then to the order the task lists them in
+        """
+        if any((queue_name, b.pk) not in self.loads for b in backends):
+            self.read_loads(backends, queue_name)
+        candidates = []
+        for index, backend in enumerate(backends):
+            load, free = self.loads[(queue_name, backend.pk)]
+            if settings.BACKEND_MIN_FREE_DISK and free is not None and \
+               free < settings.BACKEND_MIN_FREE_DISK:
+                logger.warning("Backend "+backend.name+" is low on disk")
+                continue
+            candidates.append((load, -(free or 0), index, backend))
+        if len(candidates) == 0:
+            chosen = backends[0]
+        else:
+            chosen = min(candidates)[3]
+        self.loads[(queue_name, chosen.pk)][0] += 1
+        return chosen
+
+
+def choose_user(users, priority):
+    """
+        The user to submit as: the highest priority BackendUser which does
+        not exceed the submission's priority, else the lowest priority one
+    """
+    allowed = [user for user in users if user.priority <= priority]
+    if allowed:
+        return max(allowed, key=lambda user: user.priority)
+    if users:
+        return min(users, key=lambda user: user.priority)
+    return None
+
+
+def check_user(backend, users, priority):
+    """
+        Warns if this worker is not running as the backend's user for the
+        submission's priority
+    """
+    user = choose_user(users, priority)
+    if user is None:
+        return
+    login = getpass.getuser()
+    if login != user.login_name:
+        logger.warning("Running on backend "+backend.name+" as "+login +
+                       " rather than its user "+user.login_name)
+
+
+def claim_backend(backend):
+    Backend.objects.filter(pk=backend.pk).update(running=F('running')+1)
+
+
+def release_backend(backend):
+    """
+        Counts a task off the backend and reports the disk left under its
+        root path for the dispatcher to read
+    """
+    Backend.objects.filter(pk=backend.pk, running__gt=0) \
+                   .update(running=F('running')-1,
+                           free_disk=free_disk(backend))
+
+
+def reconcile_backends():
+    """
+        Resets each backend's running count to the number of RunningTasks
+        placed on it, correcting counts left by workers which were killed
+        mid task. Returns the number of backends corrected
+    """
+    placed = dict(RunningTask.objects.filter(backend__isnull=False)
+                                     .values_list('backend')
+                                     .annotate(Count('pk')))
+    corrected = 0
+    for pk, running in Backend.objects.values_list('pk', 'running'):
+        actual = placed.get(pk, 0)
+        if running != actual:
+            logger.warning("Backend "+str(pk)+" counted "+str(running) +
+                           " running tasks, resetting to "+str(actual))
+            corrected += Backend.objects.filter(pk=pk, running=running) \
+                                        .update(running=actual)
+    return corrected
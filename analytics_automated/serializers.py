@@ -24,7 +24,7 @@ class StepSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Step
-        fields = ('task', 'ordering')
+        fields = ('task', 'ordering', 'depends_on')
 
 
 class JobDetailSerializer(serializers.ModelSerializer):
@@ -83,7 +83,7 @@ class BatchSerializer (serializers.ModelSerializer):
 
     class Meta:
         model = Batch
-        fields = ('UUID', 'state', 'submissions')
+        fields = ('UUID', 'state', 'last_message', 'submissions')
 
 
 class JobSerializer (serializers.ModelSerializer):
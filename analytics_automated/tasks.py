@@ -1,9 +1,13 @@
 from __future__ import absolute_import
+import os
+import stat
+import shutil
 import logging
 import time
 import socket
 import uuid
-import pprint
+import json
+import datetime
 from commandRunner.localRunner import *
 from commandRunner.rRunner import *
 from commandRunner.pythonRunner import *
@@ -12,15 +16,28 @@ from celery import Celery
 from celery import shared_task
 from celery import group
 from celery import chain
+from celery import signature
+from celery import current_app
 
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.mail import send_mail
+from django.core.files import File
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from django.utils import timezone
 from django.db import transaction
 from django.core.files.base import ContentFile
+from django.db.models import Max, F
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
 
 from .models import Backend, Job, Submission, Task, Result, Parameter
-from .models import QueueType, BackendUser, Batch
+from .models import QueueType, BackendUser, Batch, InputBlob
+from .models import file_extension, StepTiming, PendingStep
+from .models import HeldSubmission, RunningTask
+from .descriptors import get_task_descriptor, build_file_globs
+from .metrics import observe_task, count_submissions
+from .routing import claim_backend, release_backend, check_user
+from .routing import reconcile_backends
+from . import heartbeat
 
 logger = logging.getLogger(__name__)
 
@@ -50,84 +67,176 @@ def add(x, y):
     return x + y
 
 
-# When starting a previous job we get the previous data out of the
-# db
-def get_data(s, uuid, current_step, in_globs):
-    data_dict = {}
-    data = None
+def read_input(field_file, text=False):
+    """
+        Reads a stored input. Inputs are passed around as bytes and are only
+        decoded for the runners which write their inputs out as text
+    """
+    field_file.open(mode='rb')
+    try:
+        data = field_file.read()
+    finally:
+        field_file.close()
+    if text:
+        try:
+            data = data.decode(encoding='UTF-8')
+        except UnicodeDecodeError:
+            logger.warning("Input "+field_file.name+" is not UTF-8 text")
+    return(data)
+
+
+# When starting a previous job we find the previous data in the db. The
+# files are keyed by the name they take in the task's working directory
+# The steps of DAG jobs name the steps upstream of them and only read those
+def get_input_files(s, uuid, current_step, in_globs, upstream=None):
+    input_files = {}
     previous_step = None
-    # found_set = set()
     # if this is the first task in a chain get the input_data from submission
     # if this is not the first task get the input_data from the results
-    if current_step == 1:
-        s.input_data.open(mode='rb')
-        content = s.input_data.read()
-        try:  # depending on the version of django data might reach here
-                # as either a byte str or a regular str. if we were being
-                # super defensive we should check line is a str
-            data = content.decode(encoding='UTF-8')
-        except AttributeError:
-            data = content
-        except UnicodeDecodeError:
-            data = content
-        except TypeError:
-            data = content
-        s.input_data.close()
+    if current_step == 1 or upstream == []:
+        # read through the shared blob where the input has one
+        input_data = s.input_data
+        if s.blob_id is not None:
+            input_data = s.blob.data
         local_glob = in_globs[0].lstrip(".")
-        data_dict[uuid+"."+local_glob] = data
+        input_files[uuid+"."+local_glob] = input_data
     else:
         previous_step = current_step-1
-        # print("DATA GETTING STEP ID"+str(previous_step))
-        r = Result.objects.filter(submission=s, step__lte=previous_step).all()
+        # only fetch the earlier outputs whose ending this task reads
+        extensions = [glob.lstrip(".") for glob in in_globs]
+        r = Result.objects.filter(submission=s, extension__in=extensions)
+        if upstream is None:
+            r = r.filter(step__lte=previous_step)
+        else:
+            previous_step = max(upstream)
+            r = r.filter(step__in=upstream)
+        r = r.only('result_data')
         for result in r:
-            # print("RESULT ID"+str(result))
-            for glob in in_globs:
-                # print("GLOB TO MATCH"+str(glob))
-                if glob in result.result_data.name:
-                    # print("FOUND A MATCH"+str(result.result_data.name)+str(glob))
-                    # found_set.add(glob)
-                    result.result_data.open(mode='rb')
-                    content = result.result_data.read()
-                    # print("OPENED DATA FILE")
-                    data = None
-                    # print(line)
-                    try:  # depending on the version of django data might
-                            # reach here as either a byte str or a str
-                        data = content.decode(encoding='UTF-8')
-                    except AttributeError:
-                        data = content
-                    except UnicodeDecodeError:
-                        data = content
-                    except TypeError:
-                        data = content
-                    data_dict[result.result_data.name] = data
-                    result.result_data.close()
-                    # print("GOT FILE DATA")
-    # if current_step != 1:
-    #     if len(in_globs) != len(found_set):
-    #         raise Exception("Found set of globs not the same size as",
-    #                         "requested:", str(len(in_globs)), "vs",
-    #                         str(len(found_set)))
+            input_files[result.result_data.name] = result.result_data
+    return(input_files, previous_step)
 
+
+def get_data(s, uuid, current_step, in_globs, text=False, upstream=None):
+    input_files, previous_step = get_input_files(s, uuid, current_step,
+                                                 in_globs, upstream)
+    data_dict = {}
+    for name, field_file in input_files.items():
+        data_dict[name] = read_input(field_file, text)
     return(data_dict, previous_step)
 
 
+def split_input_files(input_files, text=False):
+    """
+        Splits a step's inputs in to the files which we put in the working
+        directory ourselves and the data of those which have to be read and
+        passed to commandRunner. Only runners which need text (text=True)
+        and DEBUG, where commandRunner sets up the working directory as
+        usual, have their inputs read in to memory
+    """
+    data_dict = {}
+    local_files = {}
+    for name, field_file in input_files.items():
+        if text or settings.DEBUG:
+            data_dict[name] = read_input(field_file, text)
+        else:
+            local_files[name] = field_file
+    return(data_dict, local_files)
+
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def stage_input_files(path, local_files):
+    """
+        Puts stored input files in the task's working directory. They are
+        hard or soft linked, as INPUT_HANDOFF says, and streamed in when
+        INPUT_HANDOFF is 'copy', storage has no local paths or storage and
+        the working directory are on different filesystems. A linked input
+        is the stored blob or result itself, shared with other submissions,
+        so it is made read only and copied instead if that is not possible
+    """
+    if len(local_files) == 0:
+        return
+    os.makedirs(path, exist_ok=True)
+    for name, field_file in local_files.items():
+        target = os.path.join(path, name)
+        if settings.INPUT_HANDOFF != 'copy':
+            try:
+                source = field_file.path
+                if settings.INPUT_HANDOFF == 'symlink':
+                    os.symlink(source, target)
+                else:
+                    os.link(source, target)
+                try:
+                    os.chmod(source, READ_ONLY)
+                    continue
+                except OSError as e:
+                    os.unlink(target)
+                    raise e
+            except NotImplementedError:
+                pass  # storage without local paths
+            except OSError as e:
+                logger.debug("Copying "+name+", unable to link it: "+str(e))
+        field_file.open(mode='rb')
+        try:
+            with open(target, 'wb') as dst:
+                for chunk in field_file.chunks():
+                    dst.write(chunk)
+        finally:
+            field_file.close()
+
+
+class WorkingFile(File):
+    """
+        An output file still sitting in the task's working directory. Storage
+        backends which know about temporary_file_path() (FileSystemStorage
+        does) move it in to place rather than copying it through memory
+    """
+
+    def __init__(self, file, name, path):
+        super(WorkingFile, self).__init__(file, name)
+        self.working_path = path
+
+    def temporary_file_path(self):
+        return self.working_path
+
+
+def open_output(path, fName, fData):
+    """
+        Returns a File for one output. Where the file is still in the working
+        directory it is streamed (or, out of DEBUG, moved) from there, else we
+        fall back to the bytes commandRunner captured
+    """
+    if path is not None:
+        working_path = os.path.join(path, fName)
+        if os.path.isfile(working_path):
+            if settings.DEBUG is True:
+                # leave the working dir intact for debugging
+                return File(open(working_path, 'rb'), name=fName)
+            return WorkingFile(open(working_path, 'rb'), fName, working_path)
+    return ContentFile(fData, name=fName)
+
+
 # we get a llist of the files and insert them in to the db
-def insert_data(output_data, s, t, current_step, previous_step):
+def insert_data(output_data, s, t, current_step, previous_step, path=None):
     if output_data is not None:
         # If not we trigger the No Outputs behaviour instead of pushing
         # the results to the db
-
+        results = []
         for fName, fData in output_data.items():
             # print("Writing Captured data")
-            file = SimpleUploadedFile(fName, fData)
             logger.info("Result: Adding file to Results "+fName)
-            r = Result.objects.create(submission=s, task=t,
-                                      step=current_step, name=t.name,
-                                      message='Result',
-                                      previous_step=previous_step,
-                                      result_data=file)
-            logger.info("Result: File added")
+            r = Result(submission=s, task=t, step=current_step, name=t.name,
+                       message='Result', previous_step=previous_step,
+                       extension=file_extension(fName))
+            file = open_output(path, fName, fData)
+            try:
+                r.result_data.save(fName, file, save=False)
+            finally:
+                file.close()
+            results.append(r)
+        Result.objects.bulk_create(results)
+        logger.info("Result: "+str(len(results))+" files added")
     else:
         logger.info("Result: No files to add")
         r = Result.objects.create(submission=s, task=t,
@@ -137,26 +246,20 @@ def insert_data(output_data, s, t, current_step, previous_step):
                                   result_data=None)
 
 
-def build_file_globs(t):
-    '''
-        Not yet covered with unit tests
-    '''
-    in_globs = "".join(t.in_glob.split()).split(",")
-    out_globs = "".join(t.out_glob.split()).split(",")
-
-    iglob = in_globs[0].lstrip(".")
-    oglob = out_globs[0].lstrip(".")
-    return(in_globs, out_globs, iglob, oglob)
+# The commandRunner runners which write their input_data out in text mode
+TEXT_RUNNERS = (QueueType.R, QueueType.PYTHON)
 
 
 def make_runner(value, uuid, t, out_globs, in_globs, data_dict, params,
                 param_values, stdoglob, environment, state, step_id, self,
-                execution_behaviour):
+                execution_behaviour, backend=None):
     '''
         Not yet covered with unit tests
     '''
+    if backend is None:
+        backend = t.backend
     kwargs = {'tmp_id': uuid,
-              'tmp_path': t.backend.root_path,
+              'tmp_path': backend.root_path,
               'out_globs': out_globs,
               'in_globs': in_globs,
               'input_data': data_dict,
@@ -193,35 +296,24 @@ def make_runner(value, uuid, t, out_globs, in_globs, data_dict, params,
     return None
 
 
-def prepare_exit_statuses(uuid, t, state, step_id, self,
+def prepare_exit_statuses(uuid, td, state, step_id, self,
                           current_step, command, s):
     '''
         Not yet covered with unit tests
     '''
-    valid_exit_status = [0, ]
-    custom_exit_statuses = []
-    if t.custom_exit_status is not None:
-        statuses = t.custom_exit_status.replace(" ", "")
-        try:
-            if len(statuses) > 0:
-                custom_exit_statuses = list(map(int, statuses.split(",")))
-        except Exception as e:
-            exit_status_message = "Exit statuses contains non-numerical and " \
-                                  "other punctuation "+str(e) + \
-                                  " : "+str(current_step) + " : " + command
-            Submission.update_submission_state(s, True, state, step_id,
-                                               self.request.id,
-                                               exit_status_message,
-                                               socket.gethostname())
-            Batch.update_batch_state(s.batch, state)
-            __handle_batch_email(s)
-            logger.debug(uuid+": prepare_exit_statuses():"+exit_status_message)
-            raise OSError(exit_status_message)
-        if t.custom_exit_behaviour == Task.CONTINUE or \
-           t.custom_exit_behaviour == Task.TERMINATE:
-            valid_exit_status += custom_exit_statuses
-
-    return valid_exit_status, custom_exit_statuses
+    if td.exit_status_error is not None:
+        exit_status_message = "Exit statuses contains non-numerical and " \
+                              "other punctuation "+td.exit_status_error + \
+                              " : "+str(current_step) + " : " + command
+        Submission.update_submission_state(s, True, state, step_id,
+                                           self.request.id,
+                                           exit_status_message,
+                                           socket.gethostname())
+        Batch.update_batch_state(s.batch, state)
+        __handle_batch_email(s)
+        logger.debug(uuid+": prepare_exit_statuses():"+exit_status_message)
+        raise OSError(exit_status_message)
+    return list(td.valid_exit_status), list(td.custom_exit_statuses)
 
 
 def handle_task_exit(exit_status, valid_exit_status, custom_exit_statuses,
@@ -245,11 +337,13 @@ def handle_task_exit(exit_status, valid_exit_status, custom_exit_statuses,
                 found_endings.append("."+fName.split(".")[-1])
 
         if set(out_globs).issubset(found_endings):
-            insert_data(run.output_data, s, t, current_step, previous_step)
+            insert_data(run.output_data, s, t, current_step, previous_step,
+                        run.path)
         else:
             if t.incomplete_outputs_behaviour == Task.FAIL:
                 # insert what we have and then raise and error
-                insert_data(run.output_data, s, t, current_step, previous_step)
+                insert_data(run.output_data, s, t, current_step, previous_step,
+                            run.path)
                 Submission.update_submission_state(s, True, state, step_id,
                                                    self.request.id,
                                                    "Failed with missing"
@@ -261,17 +355,20 @@ def handle_task_exit(exit_status, valid_exit_status, custom_exit_statuses,
                 raise OSError("Failed with missing outputs: "+str(run.command))
             if t.incomplete_outputs_behaviour == Task.TERMINATE:
                 # insert what we have and end the job gracefully
-                insert_data(run.output_data, s, t, current_step, previous_step)
+                insert_data(run.output_data, s, t, current_step, previous_step,
+                            run.path)
                 if self.request.chain:
                     self.request.chain = None
                 incomplete_outputs_termination = True
             if t.incomplete_outputs_behaviour == Task.CONTINUE:
                 # by default we insert whatever results we have and keep going
-                insert_data(run.output_data, s, t, current_step, previous_step)
+                insert_data(run.output_data, s, t, current_step, previous_step,
+                            run.path)
     elif exit_status in custom_exit_statuses and \
             t.custom_exit_behaviour == Task.FAIL:
             # if we hit an exit status that we ought to fail on raise an error
-        insert_data(run.output_data, s, t, current_step, previous_step)
+        insert_data(run.output_data, s, t, current_step, previous_step,
+                    run.path)
         Submission.update_submission_state(s, True, state, step_id,
                                            self.request.id,
                                            'Failed step, non 0 exit at step:' +
@@ -299,125 +396,151 @@ def handle_task_exit(exit_status, valid_exit_status, custom_exit_statuses,
 
 
 def __handle_batch_email(s):
-    entries = Batch.objects.filter(UUID=s.batch.UUID)
-    message_str = settings.EMAIL_MESSAGE_STRING+s.batch.UUID
-    if entries[0].status == Batch.ERROR or entries[0].status == Batch.CRASH:
-        message_str = "Job "+s.batch.UUID+" has failed\n\n" + \
-                      "Please contact the server administrator with the job " \
-                      "ID and the following error message\n\n"+s.last_message
+    """
+        Queues the batch's notification once it reaches a terminal state.
+        The mail itself is sent by send_batch_notification on the
+        NOTIFICATION_QUEUE so that no compute worker waits on the mail relay
+    """
+    if s.batch_id is None or not Batch.claim_notification(s.batch_id):
+        return
+    batch_id = s.batch_id
 
-    if entries[0].status == Batch.COMPLETE or entries[0].status == Batch.ERROR\
-       or entries[0].status == Batch.CRASH:
+    def queue_notification():
         try:
-            if s.email is not None and \
-                    len(s.email) > 5 and \
-                    settings.DEFAULT_FROM_EMAIL is not None:
-                send_mail(str(s.job)+" : "+settings.EMAIL_SUBJECT_STRING+": "+s.batch.UUID,
-                          message_str,
-                          from_email=None,
-                          recipient_list=[s.email],
-                          fail_silently=False)
-            logger.info("SENDING MAIL TO: "+s.email)
+            send_batch_notification.apply_async(
+                (batch_id,), queue=settings.NOTIFICATION_QUEUE)
         except Exception as e:
-            logger.info("Mail server not available:" + str(e))
-        s.email = None
-        # if settings.EMAIL_DELETE_AFTER_USE:
-        #     s.email = None
-        #     s.save()
-        # print('batch not complete yet')
-
-
-def __build_environment(task):
-    environment = {}
-    envs = task.environment.all()
-    for env in envs:
-        environment[env.env] = env.value
-    return(environment)
-
-
-def __construct_chain_string(steps, UUID, job_priority):
-    """
-        Function takes all the step and task information for a given job
-        and returns a valid celery string
-    """
-    total_steps = len(steps)
-    chord_end = False
-    current_step = 0
-    step_counter = 1
-    prev_step = None
-    queue_name = 'celery'
-    flags = {}
-    options = {}
-    value = ''
-
-    if total_steps > 1:
-        if steps[total_steps-1].ordering == steps[total_steps-2].ordering:
-            total_steps += 1
-            chord_end = True
-
-    task_strings = {}
-    # loop over steps and build the subtask string for each
-    # track which have the same step priority
-    # build group() for any which have equivalent priority
-    # where priority list > 1
-    # insert subtask or group in to chain()()
-
-    for step in steps:
-        params = []
-        param_values = {}
-        value = ''
-        environment = __build_environment(step.task)
-        queue_name = str(step.task.backend.queue_type)
-        if step.ordering != prev_step:
-            current_step += 1
-
-        # tchain += "task_runner.si('%s',%i,%i,%i,'%s') | " \
-        task_string = "task_runner.subtask(('%s', %i, %i, %i, %i, '%s', " \
-                      "%s, %s, '%s', %i, %s), " \
-                      "immutable=True, queue='%s')" \
-                      % (UUID,
-                         step.ordering,
-                         current_step,
-                         step_counter,
-                         total_steps,
-                         step.task.name,
-                         params,
-                         pprint.pformat(param_values).replace('\n',''),
-                         value,
-                         step.task.backend.queue_type.execution_behaviour,
-                         environment,
-                         queue_name)
-
-        if step.ordering in task_strings:
-            task_strings[step.ordering].append(task_string)
-        else:
-            task_strings[step.ordering] = [task_string]
-        prev_step = step.ordering
-        step_counter += 1
-
-    tchain = "chain("
-    for key in sorted(task_strings):
-        if len(task_strings[key]) > 1:
-            tchain += "group("
-        for task_string in task_strings[key]:
-            tchain += task_string+", "
-        if len(task_strings[key]) > 1:
-            tchain = tchain[:-2]
-            tchain += "), "
-    tchain = tchain[:-2]
-
-    # This hack means that a job which ends in a chord won't complete
-    # during the chord
-    if chord_end is True:
-        tchain += ", chord_end.subtask(('%s', %i, %i), " \
-                  "immutable=True, queue='%s')" \
-                  % (UUID, current_step, total_steps, queue_name)
-    tchain += ',).apply_async()'
-
-    logger.debug("TASK COMMAND: "+tchain)
-    return(tchain)
+            logger.error("Unable to queue notification for batch " +
+                         str(batch_id)+": "+str(e))
+    transaction.on_commit(queue_notification)
+
+
+@shared_task(bind=True, default_retry_delay=5 * 60, max_retries=5)
+def send_batch_notification(self, batch_id):
+    """
+        Mails everyone who submitted to a finished batch, once per address,
+        over a single connection to the mail server
+    """
+    try:
+        b = Batch.objects.get(pk=batch_id)
+    except Batch.DoesNotExist:
+        return
+    if settings.DEFAULT_FROM_EMAIL is None:
+        return
+    subs = list(b.submissions.select_related('job')
+                 .filter(email__isnull=False).order_by('pk'))
+    message_str = settings.EMAIL_MESSAGE_STRING+b.UUID
+    if b.notified_status == Batch.ERROR or b.notified_status == Batch.CRASH:
+        error_message = b.last_message
+        for s in subs:
+            if s.status == Submission.ERROR or s.status == Submission.CRASH:
+                error_message = s.last_message
+                break
+        message_str = "Job "+b.UUID+" has failed\n\n" + \
+                      "Please contact the server administrator with the job " \
+                      "ID and the following error message\n\n" + \
+                      str(error_message)
+    messages = []
+    recipients = set()
+    for s in subs:
+        if len(s.email) <= 5 or s.email in recipients:
+            continue
+        recipients.add(s.email)
+        messages.append(EmailMessage(str(s.job)+" : " +
+                                     settings.EMAIL_SUBJECT_STRING+": "+b.UUID,
+                                     message_str, to=[s.email]))
+    if len(messages) == 0:
+        return
+    try:
+        get_connection(fail_silently=False).send_messages(messages)
+        logger.info("SENT MAIL FOR "+b.UUID+" TO: "+", ".join(recipients))
+    except Exception as e:
+        logger.info("Mail server not available:" + str(e))
+        raise self.retry(exc=e)
 
 
+def fan_out_results(s):
+    """
+        Hands a finished submission's state and results to every identical
+        submission which was coalesced on to it while it ran. A cancelled
+        submission has no results to hand on so one of its followers runs
+        in its place
+    """
+    if s.status == Submission.CANCELLED:
+        promote_follower(Submission.objects.filter(leader=s))
+        return
+    followers = Submission.objects.filter(leader=s,
+                                          status__lte=Submission.RUNNING)
+    for follower in followers:
+        mirror_submission(s, follower)
+
+
+def promote_follower(followers):
+    """
+        Sends the oldest of the followers of a cancelled or deleted leader
+        which are still waiting to celery and makes it the leader of the
+        rest. The chain is sent once the transaction commits. Returns the
+        promoted submission, or None if no follower was waiting
+    """
+    with transaction.atomic():
+        waiting = list(followers.select_for_update()
+                                .filter(status__lte=Submission.RUNNING)
+                                .order_by('pk'))
+        if len(waiting) == 0:
+            return None
+        promoted = waiting[0]
+        Submission.objects.filter(pk=promoted.pk).update(leader=None)
+        Submission.objects.filter(pk__in=[s.pk for s in waiting[1:]]) \
+                          .update(leader=promoted)
+        promoted.leader = None
+        request_contents = promoted.request_contents or {}
+        if settings.FAIR_SHARE:
+            HeldSubmission.hold([promoted.pk], promoted.ip, request_contents,
+                                promoted.priority, 1)
+            transaction.on_commit(release_slot)
+        else:
+            # imported here as the plans module builds on the tasks above
+            from .plans import get_plan, dispatch_chains
+            tchain = get_plan(promoted.job).signature(promoted.UUID,
+                                                      request_contents,
+                                                      promoted.priority)
+            transaction.on_commit(lambda: dispatch_chains([tchain]))
+    logger.info(promoted.UUID+": promoted to run in place of its leader, " +
+                str(len(waiting)-1)+" submissions follow it")
+    return promoted
+
+
+def mirror_submission(leader, follower):
+    with transaction.atomic():
+        follower = Submission.objects.select_for_update() \
+                                     .select_related('batch') \
+                                     .get(pk=follower.pk)
+        if follower.status > Submission.RUNNING:
+            return  # another process got here first
+        # the copies point at the leader's files rather than duplicating them
+        Result.objects.bulk_create(
+            [Result(submission=follower, task_id=r.task_id, step=r.step,
+                    previous_step=r.previous_step, name=r.name,
+                    message=r.message, result_data=r.result_data.name,
+                    extension=r.extension)
+             for r in leader.results.all()])
+        Submission.update_submission_state(follower, True, leader.status,
+                                           leader.step_id, leader.worker_id,
+                                           leader.last_message,
+                                           leader.hostname)
+    if follower.batch is None:
+        return
+    if follower.status != Submission.COMPLETE:
+        Batch.update_batch_state(follower.batch, follower.status)
+    __handle_batch_email(follower)
+
+
+@receiver(post_save, sender=Submission)
+def submission_saved(sender, instance, **kwargs):
+    if instance.fingerprint is not None and instance.leader_id is None and \
+       instance.status > Submission.RUNNING:
+        fan_out_results(instance)
+
 
 @shared_task(bind=True, default_retry_delay=5 * 60, rate_limit=40,
              max_retries=5)
@@ -429,33 +552,158 @@ def task_job_runner(self, *args, **kwargs):
     try:
         job = Job.objects.get(name=args[0])
         if job:
-            steps = job.steps.all().select_related('task') \
-                    .extra(order_by=['ordering'])
             s = Submission()
             s.priority = settings.DEFAULT_JOB_PRIORITY
             s.UUID = str(uuid.uuid1())
             s.email = settings.ADMIN_EMAIL
             s.batch = b
-            s.input_data.save("dummy.txt", ContentFile("empty"))
+            blob = InputBlob.store(ContentFile(b"empty", name="dummy.txt"))
+            s.input_data = blob.data.name
+            s.blob = blob
             s.job = job
             s.save()
+            count_submissions(job, Submission.SUBMITTED)
 
-            tchain = __construct_chain_string(steps, s.UUID,
-                                              settings.DEFAULT_JOB_PRIORITY)
-            #print(tchain)
+            # imported here as the plans module builds on the tasks above
+            from .plans import get_plan
+            tchain = get_plan(job).signature(s.UUID, {},
+                                             settings.DEFAULT_JOB_PRIORITY)
             try:
-                logger.info('Sending this chain: '+tchain)
-                exec(tchain)
-            except SyntaxError:
-                logger.error('SyntaxError: Invalid string exec on: ' + tchain)
+                logger.info('Sending chain for periodic job: '+str(job))
+                tchain.apply_async()
             except Exception as e:
-                logger.error('500 Error: Invalid string exec on: ' + tchain)
+                logger.error('500 Error: Unable to send chain for ' + s.UUID)
                 logger.error('500 Error' + str(e))
     except Job.DoesNotExist:
         pass
 
 
 
+@shared_task(bind=True, default_retry_delay=5 * 60, max_retries=5)
+def dispatch_batch(self, batch_uuid):
+    """
+        Validates and publishes a batch accepted by the asynchronous
+        submission mode
+    """
+    # imported here as the api module imports this one
+    from .api import SubmissionDetails
+    SubmissionDetails().dispatch_pending(batch_uuid)
+
+
+@shared_task
+def dispatch_pending_batches():
+    """
+        Dispatches any accepted batch whose dispatch_batch message was lost.
+        Each batch is sent as its own dispatch_batch task so that one which
+        fails does not hold up the rest. Schedule this periodically if
+        ASYNC_SUBMISSIONS is on. Returns the number of batches sent
+    """
+    pending = Batch.objects.filter(pending_request__isnull=False) \
+                           .values_list('UUID', flat=True)
+    sent = 0
+    for batch_uuid in pending:
+        try:
+            dispatch_batch.delay(batch_uuid)
+            sent += 1
+        except Exception as e:
+            logger.error("Unable to send dispatch task for "+batch_uuid +
+                         ": "+str(e))
+    return sent
+
+
+def release_slot():
+    """
+        A submission has finished so its fair share slot can go to the next
+        held submission
+    """
+    # imported here as fairshare imports plans, which imports this module
+    from .fairshare import release_held
+    try:
+        release_held()
+    except Exception as e:
+        logger.error("Unable to release held submissions: "+str(e))
+
+
+@shared_task
+def release_held_submissions():
+    """
+        Sends held submissions to celery as fair share slots come free.
+        Schedule this periodically if FAIR_SHARE is on to catch slots freed
+        by submissions which stopped without finishing their task_runner
+    """
+    from .fairshare import release_held
+    release_held()
+
+
+class StepTimer(object):
+    """
+        Collects how long each phase of a task_runner execution takes and
+        records them as a StepTiming
+    """
+
+    def __init__(self, current_step, upstream=None):
+        self.current_step = current_step
+        self.upstream = upstream
+        self.submission = None
+        self.task = None
+        self.backend = None
+        self.pooled = False
+        self.started = timezone.now()
+        self.clock = time.monotonic()
+        self.durations = {}
+        self.exit_path = None
+        self._mark = time.monotonic()
+
+    def lap(self, phase):
+        """
+            Charges the time since the last lap to the phase
+        """
+        now = time.monotonic()
+        self.durations[phase] = self.durations.get(phase, 0.0) + \
+            now - self._mark
+        self._mark = now
+
+    def skip(self):
+        """
+            Leaves the time since the last lap out of every phase
+        """
+        self._mark = time.monotonic()
+
+    def failed_in(self):
+        """
+            Names the exit path of a step which raised; the failure site if
+            one was noted, else the first phase that did not finish
+        """
+        if self.exit_path is not None:
+            return self.exit_path
+        for phase in StepTiming.PHASES[1:]:
+            if phase not in self.durations:
+                return phase
+        return 'complete'
+
+    def record(self):
+        if self.submission is None:
+            return
+        try:
+            # we waited in the queue from the end of the previous step, or
+            # from submission for the first
+            upstream = self.upstream
+            if upstream is None:
+                upstream = [self.current_step-1]
+            ready = StepTiming.objects.filter(
+                submission=self.submission,
+                step__in=upstream).aggregate(Max('finished'))
+            ready = ready['finished__max'] or self.submission.created
+            StepTiming.objects.create(
+                submission=self.submission, task=self.task,
+                step=self.current_step, started=self.started,
+                finished=timezone.now(),
+                queue_wait=max((self.started-ready).total_seconds(), 0.0),
+                **self.durations)
+        except Exception as e:
+            logger.error("Unable to record step timings: "+str(e))
+
+
 # time limits?
 # step_id is the numerical value the user provides when they set the steps
 #         in the UI
@@ -469,7 +717,8 @@ def task_job_runner(self, *args, **kwargs):
              max_retries=5)
 def task_runner(self, uuid, step_id, current_step, step_counter,
                 total_steps, task_name, params, param_values, value,
-                execution_behaviour, environment):
+                execution_behaviour, environment, upstream=None,
+                dependents=None, backend=None):
     """
         Here is the action. Takes and task name and a job UUID. Gets the task
         config from the db and the job data and runs the job.
@@ -480,7 +729,38 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
         Results are pushed to the frontend db but because they are files
         we just use the celery results for messaging and the results table
         for the files
+        The steps of DAG jobs are also given the current_steps upstream of
+        them, whose outputs they read, and of the steps which depend on them,
+        which they release once they finish. Tasks which may run on several
+        backends are sent to the queue of the one chosen for them, given as
+        backend
     """
+    timer = StepTimer(current_step, upstream)
+    exit_path = None
+    try:
+        run_step(self, timer, uuid, step_id, current_step, step_counter,
+                 total_steps, task_name, params, param_values, value,
+                 execution_behaviour, environment, upstream, dependents,
+                 backend)
+    except Exception:
+        exit_path = timer.failed_in()
+        raise
+    finally:
+        timer.record()
+        heartbeat.drop(self.request.id)
+        if timer.pooled:
+            release_backend(timer.backend)
+        observe_task(timer.task, timer.backend, time.monotonic()-timer.clock,
+                     exit_path)
+        if settings.FAIR_SHARE and timer.submission is not None and \
+           timer.submission.status > Submission.RUNNING:
+            release_slot()
+
+
+def run_step(self, timer, uuid, step_id, current_step, step_counter,
+             total_steps, task_name, params, param_values, value,
+             execution_behaviour, environment, upstream=None,
+             dependents=None, backend_id=None):
     logger.info("TASK:" + task_name)
     logger.info("CURRENT STEP:" + str(current_step))
     logger.info("TOTAL STEPS:" + str(total_steps))
@@ -488,43 +768,69 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
 
     # prepare all objects and parameters for commandRunner.
     s = Submission.objects.get(UUID=uuid)
-    t = Task.objects.get(name=task_name)
+    if s.status == Submission.CANCELLED:
+        logger.info(uuid+": cancelled, dropping step "+str(current_step))
+        self.request.chain = None
+        return
+    td = get_task_descriptor(task_name)
+    t = td.task
+    timer.submission, timer.task = s, t
+    timer.lap('metadata')
     # b = Batch.objects.get()
     state = Submission.ERROR
     logger.info("BUILDING GLOBS:" + str(step_id))
-    in_globs, out_globs, iglob, oglob = build_file_globs(t)
+    in_globs, out_globs = list(td.in_globs), list(td.out_globs)
     logger.info("GETTING PREVIOUS DATA:" + str(step_id))
-    data_dict, previous_step = get_data(s, uuid, current_step, in_globs)
+    input_files, previous_step = get_input_files(s, uuid, current_step,
+                                                 in_globs, upstream)
+    data_dict, local_files = split_input_files(input_files,
+                                               execution_behaviour in
+                                               TEXT_RUNNERS)
+    timer.lap('get_data')
     logger.info("SETTING STDOUT GLOB:" + str(step_id))
-    stdoglob = ".stdout"
-    if t.stdout_glob is not None and len(t.stdout_glob) > 0:
-        stdoglob = "."+t.stdout_glob.lstrip(".")
-
-    # update submission tracking to note that this is running
+    stdoglob = td.stdoglob
+
+    # Here we find the backend the step was sent to. Only tasks which may
+    # run on several backends are counted on them
+    backend = td.backends[0] if td.backends else None
+    if len(td.backends) > 1:
+        for pooled in td.backends:
+            if pooled.pk == backend_id:
+                backend = pooled
+        check_user(backend, td.users[backend.pk], s.priority)
+        claim_backend(backend)
+        timer.pooled = True
+    timer.backend = backend
+
+    # update submission tracking to note that this is running. The Message
+    # is written with the step's final state
     logger.info("SETTING RUN FLAG:" + str(step_id))
     with transaction.atomic():
-        if s.status != Submission.ERROR and s.status != Submission.CRASH:
+        if s.status not in Submission.STOPPED:
             Submission.update_submission_state(s, True, Submission.RUNNING,
                                                step_id,
                                                self.request.id,
                                                'Running step: ' +
                                                str(current_step),
-                                               socket.gethostname())
+                                               socket.gethostname(),
+                                               flush=False)
             Batch.update_batch_state(s.batch, Batch.RUNNING)
+            # a new task id, as the reaper revokes this one if it requeues
+            resume = self.signature_from_request()
+            resume.options.pop('task_id', None)
+            heartbeat.hold(s, self.request.id, socket.gethostname(),
+                           current_step, resume,
+                           backend if timer.pooled else None)
 
     # Now we run the task handing off the actual running to the commandRunner
     # library
     run = None
-    # Here we get the users list and decide which one to submit the job with
-    # TODO: Candidate to move to the command runner as it should handle the
-    # finding out what is happening on the backend. Perhaps API call in
-    # which returns the number of running processes and maybe the load average
 
     # Initialise commandRunner here
     try:
         run = make_runner(value, uuid, t, out_globs, in_globs, data_dict,
                           params, param_values, stdoglob, environment, state,
-                          step_id, self, execution_behaviour)
+                          step_id, self, execution_behaviour, backend)
     # print(vars(run))
     except Exception as e:
         cr_message = "Unable to initialise commandRunner: "+str(e)+" : " + \
@@ -534,12 +840,16 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
                                            socket.gethostname())
         Batch.update_batch_state(s.batch, state)
         logger.debug(uuid+": make_runner(): "+cr_message)
+        timer.exit_path = 'make_runner'
         __handle_batch_email(s)
         raise OSError(cr_message)
 
     # prepare the temp working directory here
     try:
+        timer.skip()
+        stage_input_files(run.path, local_files)
         run.prepare()
+        timer.lap('prepare')
     except Exception as e:
         prep_message = "Unable to prepare files and tmp directory: "+str(e) + \
                        " : "+str(current_step)
@@ -552,7 +862,7 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
         raise OSError(prep_message)
     # print(vars(run))
     # set the valid exit statuses in case their is a defined value alternative
-    valid_exit_status, custom_exit_statuses = prepare_exit_statuses(uuid, t,
+    valid_exit_status, custom_exit_statuses = prepare_exit_statuses(uuid, td,
                                                                     state,
                                                                     step_id,
                                                                     self,
@@ -561,6 +871,7 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
                                                                     s)
 
     # execute the command
+    timer.skip()
     try:
         logger.info("STD OUT: "+run.std_out_str)
         logger.info("EXIT STATUSES: "+str(valid_exit_status))
@@ -570,7 +881,9 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
         if hasattr(run, 'script'):
             logger.info("SCRIPT: "+run.script)
             exit_status = run.run_cmd()
+        timer.lap('run_cmd')
     except Exception as e:
+        timer.lap('run_cmd')
         if hasattr(run, 'command'):
             run_message = "Unable to call commandRunner.run_cmd(): "+str(e) + \
                            " : "+str(current_step) + " : " + run.command
@@ -584,6 +897,7 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
                                            socket.gethostname())
         Batch.update_batch_state(s.batch, state)
         logger.debug(uuid+": run.run_cmd(): "+run_message)
+        timer.exit_path = 'run_cmd'
         # We don't raise and error here as we want to test the exit status
         # and make a decision later
         __handle_batch_email(s)
@@ -594,20 +908,24 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
     # TODO: For now we write everything to the file as utf-8 but we'll need to
     # handle binary data eventually
 
-    # if DEBUG settings are true we leave behind the temp working dir.
-    if settings.DEBUG is not True:
-        run.tidy()
-
     # now the job has run handle getting results and what happens with differen
-    # exit statusesd or outputs
-    custom_exit_termination,\
-        incomplete_outputs_termination = handle_task_exit(exit_status,
-                                                          valid_exit_status,
-                                                          custom_exit_statuses,
-                                                          run, out_globs, t, s,
-                                                          current_step,
-                                                          previous_step, self,
-                                                          state, step_id)
+    # exit statusesd or outputs. Outputs are taken from the working dir so it
+    # is only tidied afterwards
+    try:
+        custom_exit_termination,\
+            incomplete_outputs_termination = handle_task_exit(
+                exit_status, valid_exit_status, custom_exit_statuses, run,
+                out_globs, t, s, current_step, previous_step, self, state,
+                step_id)
+    except Exception:
+        timer.exit_path = 'task_exit'
+        raise
+    finally:
+        timer.lap('insert_data')
+        # if DEBUG settings are true we leave behind the temp working dir.
+        if settings.DEBUG is not True:
+            run.tidy()
+        timer.lap('tidy')
 
     # decide if we should complete the job
     complete_job = False
@@ -619,7 +937,17 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
         complete_job = True
         logger.debug(uuid+": completing job due to incomplete outputs")
 
-    if step_counter == total_steps:
+    released = []
+    if upstream is not None:
+        # a DAG job completes when its last outstanding step finishes
+        if complete_job:
+            PendingStep.cancel(s.pk)
+        else:
+            released, complete_job = PendingStep.finish(s.pk, current_step,
+                                                        dependents)
+            if complete_job:
+                logger.debug(uuid+": completing job as all steps finished")
+    elif step_counter == total_steps:
         complete_job = True
         logger.debug(uuid+": completing job due to final step: " +
                      str(step_counter)+"=="+str(total_steps))
@@ -635,20 +963,19 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
     # s2 = Submission.objects.get(UUID=uuid)
     # send message to frontend now the task is run and the results are handled
     s.refresh_from_db()
-    if s.status != Submission.ERROR and s.status != Submission.CRASH:
+    if s.status not in Submission.STOPPED:
         Submission.update_submission_state(s, True, state, step_id,
                                            self.request.id, message,
                                            socket.gethostname())
-
-    batch_subs = Submission.objects.filter(batch=s.batch)
-    complete_count = 0
-    for sub in batch_subs:
-        if sub.status == Submission.COMPLETE:
-            complete_count += 1
-    if complete_count == len(batch_subs):
-        if s.batch.status != Batch.ERROR and s.batch.status != Batch.CRASH:
-            Batch.update_batch_state(s.batch, state)
-
+    Submission.flush_messages(s)
+    # send the DAG steps which were only waiting on this one, unless another
+    # branch of the job has already failed
+    if s.status not in Submission.STOPPED:
+        for step_signature in released:
+            signature(step_signature).apply_async()
+
+    # the batch is marked complete by its counters when its last
+    # submission completes
     __handle_batch_email(s)
     # if we need to terminate the chain send that signal here
     if t.custom_exit_status is not None:
@@ -659,6 +986,232 @@ def task_runner(self, uuid, step_id, current_step, step_counter,
                 self.request.chain = None
 
 
+def cancel_submission(s, message="Cancelled"):
+    """
+        Stops a queued or running submission and marks it as cancelled. Its
+        batch counts it as failed, and is marked cancelled once none of its
+        submissions are still going. Work it has waiting in A_A is dropped
+        here and its celery tasks are stopped by revoke_submission.
+        Submissions which were coalesced on to it carry on, the oldest
+        running in its place. Returns False if it had already finished
+    """
+    if s.status > Submission.RUNNING:
+        return False
+    worker_id = s.worker_id if s.status == Submission.RUNNING else None
+    HeldSubmission.objects.filter(submission=s).delete()
+    Submission.update_submission_state(s, s.claimed, Submission.CANCELLED,
+                                       s.step_id, s.worker_id, message,
+                                       s.hostname)
+    try:
+        revoke_submission.delay(s.UUID, worker_id)
+    except Exception as e:
+        logger.error("Unable to send revoke task for "+s.UUID+": "+str(e))
+    if settings.FAIR_SHARE:
+        release_slot()
+    return True
+
+
+def submission_tasks(uuid, tasks_by_worker):
+    """
+        The ids of the task_runners for a submission in a celery inspect
+        reply. Older workers report a task's args as a string
+    """
+    ids = []
+    for worker_tasks in (tasks_by_worker or {}).values():
+        for task in worker_tasks:
+            args = task.get('args') or ()
+            if isinstance(args, str):
+                found = uuid in args
+            else:
+                found = len(args) > 0 and args[0] == uuid
+            if found:
+                ids.append(task['id'])
+    return ids
+
+
+@shared_task
+def revoke_submission(uuid, worker_id=None):
+    """
+        Stops the celery tasks of a cancelled submission. Running tasks are
+        sent SIGUSR1, which celery raises in the task as a soft time limit so
+        that commandRunner kills the command it is waiting on, and tasks a
+        worker has reserved are revoked. Tasks still on the broker are
+        dropped by task_runner when they reach a worker. uuid and worker_id
+        can also be lists, so a delete stops all of its submissions in one
+        task
+    """
+    uuids = [uuid] if isinstance(uuid, str) else list(uuid)
+    worker_ids = worker_id if isinstance(worker_id, list) else [worker_id]
+    control = current_app.control
+    running = [w for w in worker_ids if w]
+    reserved = []
+    try:
+        inspect = control.inspect(timeout=settings.CANCEL_INSPECT_TIMEOUT)
+        active = inspect.active()
+        waiting = inspect.reserved()
+        for u in uuids:
+            running += submission_tasks(u, active)
+            reserved += submission_tasks(u, waiting)
+    except Exception as e:
+        logger.error("Unable to inspect workers for "+", ".join(uuids) +
+                     ": "+str(e))
+    running = list(set(running))
+    if running:
+        control.revoke(running, terminate=True, signal='SIGUSR1')
+    if reserved:
+        control.revoke(reserved)
+    logger.info("Revoked "+str(len(running)+len(reserved))+" tasks for " +
+                ", ".join(uuids))
+
+
+def revoke_on_commit(uuid, worker_id):
+    """
+        Queues a deleted submission's tasks to be revoked once the delete
+        commits. The submissions one transaction deletes share a single
+        revoke_submission task; a delete which is rolled back drops its
+        batch along with its on_commit hook
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'aa_revokes', None)
+    hooks = [func for sids, func in connection.run_on_commit]
+    if pending is not None and pending[2] in hooks:
+        pending[0].append(uuid)
+        pending[1].append(worker_id)
+        return
+    uuids = [uuid]
+    worker_ids = [worker_id]
+
+    def send():
+        try:
+            revoke_submission.delay(uuids, worker_ids)
+        except Exception as e:
+            logger.error("Unable to send revoke task for " +
+                         ", ".join(uuids)+": "+str(e))
+    connection.aa_revokes = (uuids, worker_ids, send)
+    transaction.on_commit(send)
+
+
+@receiver(pre_delete, sender=Submission)
+def stop_deleted_submission(sender, instance, **kwargs):
+    if instance.status <= Submission.RUNNING:
+        worker_id = None
+        if instance.status == Submission.RUNNING:
+            worker_id = instance.worker_id
+        revoke_on_commit(instance.UUID, worker_id)
+        if instance.leader_id is None:
+            # the delete clears the followers' leader so note them now
+            instance._followers = list(Submission.objects.filter(
+                leader=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Submission)
+def promote_deleted_leader(sender, instance, **kwargs):
+    followers = getattr(instance, '_followers', None)
+    if followers:
+        promote_follower(Submission.objects.filter(pk__in=followers,
+                                                   leader__isnull=True))
+
+
+def requeue_task(s, running, message):
+    """
+        Sends the step a vanished worker was running again, with the rest of
+        its chain. The submission shows as waiting again unless other steps
+        of it are still running
+    """
+    resume = signature(json.loads(running.resume_signature))
+    Submission.objects.filter(pk=s.pk).update(requeues=F('requeues')+1)
+    state = Submission.SUBMITTED
+    if s.running_tasks.exists():
+        state = Submission.RUNNING
+    Submission.update_submission_state(s, state == Submission.RUNNING,
+                                       state, s.step_id, None,
+                                       message+", requeued", s.hostname)
+    resume.apply_async()
+
+
+def crash_submission(s, message, state=Submission.CRASH):
+    Submission.update_submission_state(s, True, state, s.step_id,
+                                       s.worker_id, message, s.hostname)
+    if s.batch is not None:
+        Batch.update_batch_state(s.batch, state)
+    __handle_batch_email(s)
+
+
+@shared_task
+def reap_stuck_submissions():
+    """
+        Finds the running tasks whose worker has not sent a heartbeat in
+        HEARTBEAT_TIMEOUT seconds. Their step is requeued while the
+        submission has been requeued fewer than REAPER_MAX_REQUEUES times
+        and after that the submission is marked as crashed. Running
+        submissions with no running task which have not changed in
+        STUCK_SUBMISSION_TIMEOUT seconds, as happens when heartbeats are off
+        or a worker went between steps, are timed out as errors. While
+        heartbeats are on the backends' running counts are then reconciled
+        with the running tasks. Schedule this every few minutes. Returns how
+        many were reaped
+    """
+    cutoff = timezone.now() - \
+        datetime.timedelta(seconds=settings.HEARTBEAT_TIMEOUT)
+    stuck = RunningTask.objects.filter(heartbeat__lt=cutoff) \
+                               .select_related('submission__batch')
+    reaped = 0
+    for running in stuck:
+        # the worker may have beaten or finished since we looked
+        if not RunningTask.objects.filter(pk=running.pk,
+                                          heartbeat=running.heartbeat) \
+                                  .delete()[0]:
+            continue
+        s = running.submission
+        message = "Worker on "+running.hostname+" stopped responding"
+        logger.info(s.UUID+": "+message+" at step "+str(running.step))
+        try:
+            # in case it is only hung
+            current_app.control.revoke(running.task_id, terminate=True,
+                                       signal='SIGUSR1')
+        except Exception as e:
+            logger.error("Unable to revoke "+running.task_id+": "+str(e))
+        if s.status != Submission.RUNNING:
+            continue
+        reaped += 1
+        if running.resume_signature is not None and \
+           s.requeues < settings.REAPER_MAX_REQUEUES:
+            try:
+                requeue_task(s, running, message)
+                continue
+            except Exception as e:
+                logger.error(s.UUID+": unable to requeue: "+str(e))
+        crash_submission(s, message)
+    if settings.STUCK_SUBMISSION_TIMEOUT is not None:
+        # the heartbeats can not vouch for these
+        cutoff = timezone.now() - \
+            datetime.timedelta(seconds=settings.STUCK_SUBMISSION_TIMEOUT)
+        for s in Submission.objects.filter(status=Submission.RUNNING,
+                                           modified__lt=cutoff,
+                                           running_tasks__isnull=True) \
+                                   .select_related('batch'):
+            reaped += 1
+            logger.info(s.UUID+": timed out")
+            crash_submission(s, "JOB TIMED OUT", Submission.ERROR)
+    if settings.HEARTBEAT_INTERVAL is not None:
+        reconcile_backends()
+    if reaped and settings.FAIR_SHARE:
+        release_slot()
+    return reaped
+
+
+@shared_task(bind=True, default_retry_delay=5 * 60, max_retries=5)
+def start_dag(self, uuid, nodes):
+    """
+        Starts a submission of a DAG job. Every step is recorded as a
+        PendingStep and those which depend on nothing are sent at once, the
+        rest are sent by the steps they depend on as they finish
+    """
+    s = Submission.objects.get(UUID=uuid)
+    for step_signature in PendingStep.start(s, nodes):
+        signature(step_signature).apply_async()
+
+
 @shared_task(bind=True, default_retry_delay=5 * 60, rate_limit=40)
 def chord_end(self, uuid, step_id, current_step):
     s = Submission.objects.get(UUID=uuid)
@@ -666,9 +1219,8 @@ def chord_end(self, uuid, step_id, current_step):
     message = 'Completed job at step #' + str(current_step)
     # TODO: This needs a try-catch
     s.refresh_from_db()
-    if s.status != Submission.ERROR and s.status != Submission.CRASH:
+    if s.status not in Submission.STOPPED:
         Submission.update_submission_state(s, True, state, step_id,
                                            self.request.id, message,
                                            socket.gethostname())
-    Batch.update_batch_state(s.batch, state)
     __handle_batch_email(s)
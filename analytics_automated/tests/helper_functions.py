@@ -1,9 +1,11 @@
 import glob
 import os
+import shutil
 
 from analytics_automated.models import Backend, Task, Job, Parameter, Batch
 from analytics_automated.models import Step, Submission, Validator, Result
-from analytics_automated.models import Configuration
+from analytics_automated.models import Configuration, InputBlob
+from analytics_automated.models import ActiveSubmissionCount
 from .model_factories import *
 
 '''
@@ -21,6 +23,8 @@ def clearDatabase():
     Result.objects.all().delete()
     Batch.objects.all().delete()
     Configuration.objects.all().delete()
+    InputBlob.objects.all().delete()
+    ActiveSubmissionCount.objects.all().delete()
 
     BackendFactory.reset_sequence(0)
     JobFactory.reset_sequence(0)
@@ -44,3 +48,5 @@ def clearDatabase():
     for example in glob.glob(settings.BASE_DIR.child("submissions") +
                              "/huh*"):
         os.remove(example)
+    shutil.rmtree(settings.BASE_DIR.child("submissions").child("blobs"),
+                  ignore_errors=True)
@@ -25,13 +25,16 @@ from rest_framework.parsers import MultiPartParser
 from rest_framework.parsers import FormParser
 
 from analytics_automated.api import SubmissionDetails
+from analytics_automated.plans import get_plan, ExecutionPlan
+from analytics_automated.routing import Placement
 from analytics_automated.models import *
 from .model_factories import *
 from analytics_automated.tasks import *
 from .helper_functions import clearDatabase
 
 '''
-    Unit tests for the private functions in the api.py files
+    Unit tests for the construction of the celery chains from compiled
+    job plans
 '''
 
 
@@ -64,7 +67,30 @@ class CeleryChainConstructionTests(APITransactionTestCase):
     def tearDown(self):
         clearDatabase()
 
-    def test__construct_chain_string(self):
+    def __task_args(self, sig):
+        return (sig.args, sig.options['queue'], sig.immutable)
+
+    @patch('analytics_automated.routing.queue_depths', return_value=[0, 0])
+    def test_pooled_steps_are_sent_to_their_backends_queues(self, m):
+        b2 = BackendFactory.create(root_path="/tmp/",
+                                   queue_type=self.b.queue_type)
+        self.t.backends.add(b2)
+        plan = get_plan(self.j1)
+        sigs = [plan.signature(str(uuid.uuid1()), {},
+                               Submission.HIGH).tasks[0] for i in range(2)]
+        queue = "high_"+str(self.b.queue_type)
+        self.assertEqual(sigs[0].options['queue'], queue+"."+self.b.name)
+        self.assertEqual(sigs[0].kwargs['backend'], self.b.pk)
+        # each submission reads the load afresh unless they share a placement
+        self.assertEqual(sigs[1].options['queue'], queue+"."+self.b.name)
+        placement = Placement()
+        sigs = [plan.signature(str(uuid.uuid1()), {}, Submission.HIGH,
+                               placement).tasks[0] for i in range(2)]
+        self.assertEqual([sig.kwargs['backend'] for sig in sigs],
+                         [self.b.pk, b2.pk])
+        self.assertEqual(sigs[1].options['queue'], queue+"."+b2.name)
+
+    def test__construct_chain(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
                                      rest_alias="this")
         p1 = ParameterFactory.create(task=self.t, flag="-th",
@@ -79,74 +105,24 @@ class CeleryChainConstructionTests(APITransactionTestCase):
 
         request_contents = {'task1_this': 'True', 'task1_that': 123,
                             'task1_other': 'things'}
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-t', '-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 123}}, "
-                                    "'things', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
-
-    def test__construct_chain_string_high_priority(self):
-        p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
-                                     rest_alias="this")
-        p1 = ParameterFactory.create(task=self.t, flag="-th",
-                                     bool_valued=False,
-                                     rest_alias="that",
-                                     default=123,
-                                     spacing=True)
-        p1 = ParameterFactory.create(task=self.t, flag="VALUE",
-                                     bool_valued=False,
-                                     rest_alias="other",
-                                     default="huh")
+        tchain = get_plan(self.j1).signature(local_id, request_contents, 1)
+        self.assertEqual(len(tchain.tasks), 1)
+        self.assertEqual(self.__task_args(tchain.tasks[0]),
+                         ((local_id, 0, 1, 1, 1, 'task1', ['-t', '-th'],
+                           {'-th': {'spacing': True, 'switchless': False,
+                                    'value': 123}},
+                           'things', 1, {}), 'localhost', True))
 
-        request_contents = {'task1_this': 'True', 'task1_that': 123,
-                            'task1_other': 'things'}
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
+    def test__construct_chain_high_priority(self):
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 2)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-t', '-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 123}}, "
-                                    "'things', 1, {}), immutable=True, "
-                                    "queue='high_localhost'),).apply_async()")
-
-    def test__construct_chain_string_low_priority(self):
-        p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
-                                     rest_alias="this")
-        p1 = ParameterFactory.create(task=self.t, flag="-th",
-                                     bool_valued=False,
-                                     rest_alias="that",
-                                     default=123,
-                                     spacing=True)
-        p1 = ParameterFactory.create(task=self.t, flag="VALUE",
-                                     bool_valued=False,
-                                     rest_alias="other",
-                                     default="huh")
+        tchain = get_plan(self.j1).signature(local_id, {}, 2)
+        self.assertEqual(tchain.tasks[0].options['queue'], 'high_localhost')
 
-        request_contents = {'task1_this': 'True', 'task1_that': 123,
-                            'task1_other': 'things'}
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
+    def test__construct_chain_low_priority(self):
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 0)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-t', '-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 123}}, "
-                                    "'things', 1, {}), immutable=True, "
-                                    "queue='low_localhost'),).apply_async()")
+        tchain = get_plan(self.j1).signature(local_id, {}, 0)
+        self.assertEqual(tchain.tasks[0].options['queue'], 'low_localhost')
 
     def test__ensure_option_order_preserved_with_value(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
@@ -163,18 +139,10 @@ class CeleryChainConstructionTests(APITransactionTestCase):
 
         request_contents = {'task1_this': 'True', 'task1_that': 123,
                             'task1_other': 'things'}
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-t', '-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 123}}, "
-                                    "'things', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
+        tchain = get_plan(self.j1).signature(local_id, request_contents, 1)
+        self.assertEqual(tchain.tasks[0].args[6], ['-t', '-th'])
+        self.assertEqual(tchain.tasks[0].args[8], 'things')
 
     def test__ensure_we_pass_more_than_one_option(self):
         p1 = ParameterFactory.create(task=self.t, flag="-th",
@@ -189,21 +157,15 @@ class CeleryChainConstructionTests(APITransactionTestCase):
                                      spacing=True)
 
         request_contents = {'task1_chain': 'AS', 'task1_that': 123, }
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        # print(chain_str)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-th', '-ch'], "
-                                    "{'-ch': {'spacing': True, "
-                                    "'switchless': False, 'value': 'AS'}, "
-                                    "'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 123}}, "
-                                    "'', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
+        tchain = get_plan(self.j1).signature(local_id, request_contents, 1)
+        self.assertEqual(tchain.tasks[0].args[6:9],
+                         (['-th', '-ch'],
+                          {'-ch': {'spacing': True, 'switchless': False,
+                                   'value': 'AS'},
+                           '-th': {'spacing': True, 'switchless': False,
+                                   'value': 123}},
+                          ''))
 
     def test__option_uses_default_if_not_passed(self):
         p1 = ParameterFactory.create(task=self.t, flag="-th",
@@ -213,19 +175,11 @@ class CeleryChainConstructionTests(APITransactionTestCase):
                                      spacing=True)
 
         request_contents = {'task1_chain': 'AS', }
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        # print(chain_str)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': '123'}}, "
-                                    "'', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
+        tchain = get_plan(self.j1).signature(local_id, request_contents, 1)
+        self.assertEqual(tchain.tasks[0].args[7],
+                         {'-th': {'spacing': True, 'switchless': False,
+                                  'value': '123'}})
 
     def test__request_sets_option_value(self):
         p1 = ParameterFactory.create(task=self.t, flag="-th",
@@ -235,41 +189,41 @@ class CeleryChainConstructionTests(APITransactionTestCase):
                                      spacing=True)
 
         request_contents = {'task1_that': 456, }
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 1, 'task1', ['-th'], "
-                                    "{'-th': {'spacing': True, "
-                                    "'switchless': False, 'value': 456}}, "
-                                    "'', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
-
-    def test__construct_chain_string_multitask(self):
+        tchain = get_plan(self.j1).signature(local_id, request_contents, 1)
+        self.assertEqual(tchain.tasks[0].args[7],
+                         {'-th': {'spacing': True, 'switchless': False,
+                                  'value': 456}})
+
+    def test__bool_flag_omitted_when_false(self):
+        p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
+                                     rest_alias="this")
+        local_id = str(uuid.uuid1())
+        tchain = get_plan(self.j1).signature(local_id,
+                                             {'task1_this': 'False'}, 1)
+        self.assertEqual(tchain.tasks[0].args[6], [''])
+
+    def test__environment_is_passed(self):
+        e1 = EnvironmentFactory.create(task=self.t, env="Test",
+                                       value="McPath")
+        local_id = str(uuid.uuid1())
+        tchain = get_plan(self.j1).signature(local_id, {}, 1)
+        self.assertEqual(tchain.tasks[0].args[10], {"Test": "McPath"})
+
+    def test__construct_chain_multitask(self):
         self.t2 = TaskFactory.create(backend=self.b, name="task2",
                                      executable="rm")
         s = StepFactory(job=self.j1, task=self.t2, ordering=1)
 
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
         local_id = str(uuid.uuid1())
-        request_contents = {}
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 2, 'task1', [], "
-                                    "{}, '', 1, {}), immutable=True, "
-                                    "queue='localhost'), "
-                                    "task_runner.subtask(('" + local_id +
-                                    "', 1, 2, 2, 2, 'task2', [], "
-                                    "{}, '', 1, {}), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
-
-    def test__construct_group_chain_string(self):
+        tchain = get_plan(self.j1).signature(local_id, {}, 1)
+        self.assertEqual([self.__task_args(sig) for sig in tchain.tasks],
+                         [((local_id, 0, 1, 1, 2, 'task1', [], {}, '', 1, {}),
+                           'localhost', True),
+                          ((local_id, 1, 2, 2, 2, 'task2', [], {}, '', 1, {}),
+                           'localhost', True)])
+
+    def test__construct_group_plan(self):
         self.t2 = TaskFactory.create(backend=self.b, name="task2",
                                      executable="rm")
         s = StepFactory(job=self.j1, task=self.t2, ordering=1)
@@ -280,28 +234,16 @@ class CeleryChainConstructionTests(APITransactionTestCase):
                                      executable="wc")
         s = StepFactory(job=self.j1, task=self.t4, ordering=2)
 
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
-        local_id = str(uuid.uuid1())
-        request_contents = {}
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 4, 'task1', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost'), "
-                                    "group(task_runner.subtask(('" + local_id +
-                                    "', 1, 2, 2, 4, 'task2', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost'), "
-                                    "task_runner.subtask(('" + local_id +
-                                    "', 1, 2, 3, 4, 'task3', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost')), "
-                                    "task_runner.subtask(('" + local_id +
-                                    "', 2, 3, 4, 4, 'task4', [], {}, '', 1, {}), "
-                                    "immutable=True, "
-                                    "queue='localhost'),).apply_async()")
-
-    def test__construct_chain_string_with_ending_group(self):
+        plan = get_plan(self.j1)
+        self.assertEqual(plan.total_steps, 4)
+        self.assertFalse(plan.chord_end)
+        self.assertEqual([[(sp.task_name, sp.current_step, sp.step_counter)
+                           for sp in level] for level in plan.levels],
+                         [[('task1', 1, 1)],
+                          [('task2', 2, 2), ('task3', 2, 3)],
+                          [('task4', 3, 4)]])
+
+    def test__construct_plan_with_ending_group(self):
         self.t2 = TaskFactory.create(backend=self.b, name="task2",
                                      executable="rm")
         s = StepFactory(job=self.j1, task=self.t2, ordering=1)
@@ -309,23 +251,71 @@ class CeleryChainConstructionTests(APITransactionTestCase):
                                      executable="diff")
         s = StepFactory(job=self.j1, task=self.t3, ordering=1)
 
-        steps = self.j1.steps.all().select_related('task') \
-                       .extra(order_by=['ordering'])
-        sd = SubmissionDetails()
+        plan = get_plan(self.j1)
+        self.assertEqual(plan.total_steps, 4)
+        self.assertTrue(plan.chord_end)
+        self.assertEqual(plan.final_step, 2)
+
+    def test__construct_dag_plan(self):
+        self.t2 = TaskFactory.create(backend=self.b, name="task2",
+                                     executable="rm")
+        s = StepFactory(job=self.j1, task=self.t2, ordering=1)
+        self.t3 = TaskFactory.create(backend=self.b, name="task3",
+                                     executable="diff")
+        s = StepFactory(job=self.j1, task=self.t3, ordering=2,
+                        depends_on="0")
+        self.t4 = TaskFactory.create(backend=self.b, name="task4",
+                                     executable="wc")
+        s = StepFactory(job=self.j1, task=self.t4, ordering=3,
+                        depends_on="1")
+
+        plan = get_plan(self.j1)
+        self.assertTrue(plan.dag)
+        self.assertFalse(plan.chord_end)
+        self.assertEqual([(sp.task_name, sp.current_step,
+                           [p.current_step for p in sp.parents],
+                           sp.upstream, sp.dependents)
+                          for sp in plan.step_plans()],
+                         [('task1', 1, [], [], [2, 3]),
+                          ('task2', 2, [1], [1], [4]),
+                          ('task3', 3, [1], [1], []),
+                          ('task4', 4, [2], [1, 2], [])])
+
         local_id = str(uuid.uuid1())
-        request_contents = {}
-        chain_str = sd._SubmissionDetails__construct_chain_string(
-                    steps, request_contents, local_id, 1)
-        # print(chain_str)
-        self.assertEqual(chain_str, "chain(task_runner.subtask(('" + local_id +
-                                    "', 0, 1, 1, 4, 'task1', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost'), "
-                                    "group(task_runner.subtask(('" + local_id +
-                                    "', 1, 2, 2, 4, 'task2', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost'), "
-                                    "task_runner.subtask(('" + local_id +
-                                    "', 1, 2, 3, 4, 'task3', [], {}, '', 1, {}), "
-                                    "immutable=True, queue='localhost')), "
-                                    "chord_end.subtask(('" + local_id +
-                                    "', 2, 4), immutable=True, "
-                                    "queue='localhost'),).apply_async()")
+        start = plan.signature(local_id, {}, 1)
+        self.assertEqual(start.task, 'analytics_automated.tasks.start_dag')
+        self.assertEqual(start.options['queue'], 'localhost')
+        uuid_arg, nodes = start.args
+        self.assertEqual([(step, parents) for step, parents, sig in nodes],
+                         [(1, 0), (2, 1), (3, 1), (4, 1)])
+        self.assertEqual(nodes[3][2]['kwargs'], {'upstream': [1, 2],
+                                                 'dependents': []})
+
+    def test__plan_is_cached(self):
+        self.assertIs(get_plan(self.j1), get_plan(self.j1))
+
+    def test__plan_is_invalidated_by_config_change(self):
+        plan = get_plan(self.j1)
+        p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=True,
+                                     rest_alias="this")
+        new_plan = get_plan(self.j1)
+        self.assertIsNot(plan, new_plan)
+        self.assertEqual(new_plan.schema.aliases, ['task1_this'])
+
+    def test__plan_is_renewed_by_another_process(self):
+        plan = get_plan(self.j1)
+        # an edit made elsewhere only shows up as the job's new version
+        Job.objects.filter(pk=self.j1.pk).update(plan_version=uuid.uuid4())
+        self.assertIsNot(get_plan(self.j1), plan)
+
+    def test__schema_collects_aliases_across_steps(self):
+        self.t2 = TaskFactory.create(backend=self.b, name="task2",
+                                     executable="rm")
+        s = StepFactory(job=self.j1, task=self.t2, ordering=1)
+        p1 = ParameterFactory.create(task=self.t, rest_alias="this")
+        p2 = ParameterFactory.create(task=self.t2, rest_alias="that")
+        schema = get_plan(self.j1).schema
+        self.assertTrue(schema.has_all_aliases({'task1_this': 'a',
+                                                'task2_that': 'b'}))
+        self.assertEqual(schema.missing_aliases({'task1_this': 'a'}),
+                         ['task2_that'])
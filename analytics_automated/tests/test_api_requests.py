@@ -8,9 +8,13 @@ from unipath import Path
 from unittest.mock import patch
 
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
 from django.test import TestCase
+from django.test import override_settings
 from django.conf import settings
+from django.utils import timezone
 from django.http import HttpRequest
+from django.db import connection
 from django.template import RequestContext
 from django.urls import reverse
 from django.urls import reverse_lazy
@@ -23,7 +27,10 @@ from rest_framework.request import Request
 from rest_framework.parsers import MultiPartParser
 from rest_framework.parsers import FormParser
 
+from prometheus_client import REGISTRY
+
 from analytics_automated.api import SubmissionDetails
+from analytics_automated.fairshare import release_held
 from analytics_automated.models import *
 from .model_factories import *
 from analytics_automated.tasks import *
@@ -181,6 +188,178 @@ class JobTimeTests(APITestCase):
         clearDatabase()
 
 
+class StepTimeTests(APITestCase):
+
+    def test_return_mean_phase_times_per_job_and_task(self):
+        j1 = JobFactory.create(name="job1")
+        b = BackendFactory.create(root_path="/tmp/")
+        t1 = TaskFactory.create(backend=b, name="task1", executable="ls")
+        now = datetime.datetime(year=2016, month=3, day=21, hour=12,
+                                tzinfo=pytz.UTC)
+        for run_cmd in (1.0, 3.0):
+            s = SubmissionFactory.create(job=j1)
+            StepTiming.objects.create(submission=s, task=t1, step=1,
+                                      started=now, finished=now,
+                                      queue_wait=0.5, run_cmd=run_cmd)
+        response = self.client.get(reverse('steptimes',)+"?format=json")
+        self.assertEqual(response.status_code, 200)
+        task_times = response.data["job1"]["task1"]
+        self.assertEqual(task_times['count'], 2)
+        self.assertEqual(task_times['run_cmd'], 2.0)
+        self.assertEqual(task_times['queue_wait'], 0.5)
+        self.assertIsNone(task_times['tidy'])
+
+    def test_filter_step_times_by_job(self):
+        response = self.client.get(reverse('steptimes',)+"?job=job1" +
+                                   "&format=json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode("utf-8"), '{}')
+
+    def tearDown(self):
+        clearDatabase()
+
+
+class FairShareTests(APITestCase):
+
+    def hold(self, ip, count, weight=1):
+        subs = [SubmissionFactory.create(ip=ip) for i in range(count)]
+        HeldSubmission.hold([sub.pk for sub in subs], ip, {},
+                            Submission.MEDIUM, weight)
+        return subs
+
+    @override_settings(FAIR_SHARE_SLOTS=2)
+    @patch('analytics_automated.fairshare.dispatch_chains')
+    def test_slots_are_shared_between_clients(self, m):
+        heavy = self.hold("10.0.0.1", 3)
+        light = self.hold("10.0.0.2", 1)
+        self.assertEqual(release_held(), 2)
+        self.assertEqual(sorted(HeldSubmission.objects.values_list(
+                                'submission_id', flat=True)),
+                         [heavy[1].pk, heavy[2].pk])
+        # the two released submissions now fill the slots
+        self.assertEqual(release_held(), 0)
+        self.assertEqual(HeldSubmission.objects.count(), 2)
+
+    @override_settings(FAIR_SHARE_SLOTS=2)
+    @patch('analytics_automated.fairshare.dispatch_chains')
+    def test_recent_heavy_users_wait_behind_light_ones(self, m):
+        # charged when they were released, however long ago they were made
+        made = timezone.now() - datetime.timedelta(
+            seconds=settings.FAIR_SHARE_WINDOW+60)
+        for i in range(2):
+            s = SubmissionFactory.create(ip="10.0.0.1",
+                                         status=Submission.COMPLETE,
+                                         released=timezone.now())
+            Submission.objects.filter(pk=s.pk).update(created=made)
+        self.hold("10.0.0.1", 2)
+        light = self.hold("10.0.0.2", 2)
+        release_held()
+        self.assertEqual(set(HeldSubmission.objects.values_list(
+                             'client', flat=True)), {"10.0.0.1"})
+        # and the released ones are charged from now
+        self.assertEqual(Submission.objects.filter(
+                         ip="10.0.0.2", released__isnull=False).count(), 2)
+
+    @override_settings(FAIR_SHARE_SLOTS=3)
+    @patch('analytics_automated.fairshare.dispatch_chains')
+    def test_weighted_clients_get_more_turns(self, m):
+        light = self.hold("10.0.0.1", 3)
+        heavy = self.hold("10.0.0.2", 3, weight=2)
+        self.assertEqual(release_held(), 3)
+        self.assertEqual(sorted(HeldSubmission.objects.values_list(
+                                'submission_id', flat=True)),
+                         [light[1].pk, light[2].pk, heavy[2].pk])
+
+    def tearDown(self):
+        clearDatabase()
+
+
+class CancelTests(APITestCase):
+
+    @patch('analytics_automated.tasks.revoke_submission.delay')
+    def test_cancel_a_batch(self, m):
+        b = BatchFactory.create(status=Batch.RUNNING)
+        s1 = SubmissionFactory.create(batch=b, status=Submission.RUNNING)
+        s2 = SubmissionFactory.create(batch=b, status=Submission.COMPLETE)
+        response = self.client.post(reverse('cancel', args=[b.UUID]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['cancelled'], [s1.UUID])
+        self.assertEqual(Submission.objects.get(pk=s1.pk).status,
+                         Submission.CANCELLED)
+        self.assertEqual(Submission.objects.get(pk=s2.pk).status,
+                         Submission.COMPLETE)
+        self.assertEqual(Batch.objects.get(pk=b.pk).status, Batch.CANCELLED)
+        # there is nothing left to cancel
+        response = self.client.post(reverse('cancel', args=[b.UUID]))
+        self.assertEqual(response.status_code, 409)
+
+    @patch('analytics_automated.tasks.revoke_submission.delay')
+    def test_cancelling_one_submission_leaves_its_batch_running(self, m):
+        b = BatchFactory.create(status=Batch.RUNNING)
+        s1 = SubmissionFactory.create(batch=b, status=Submission.RUNNING)
+        s2 = SubmissionFactory.create(batch=b, status=Submission.RUNNING)
+        response = self.client.post(reverse('cancel', args=[s1.UUID]))
+        self.assertEqual(response.status_code, 202)
+        b.refresh_from_db()
+        self.assertEqual(b.status, Batch.RUNNING)
+        self.assertEqual((b.pending, b.failed), (1, 1))
+        # the batch is cancelled once its last submission stops
+        response = self.client.post(reverse('cancel', args=[s2.UUID]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Batch.objects.get(pk=b.pk).status, Batch.CANCELLED)
+
+    def test_cancel_unknown_submission(self):
+        response = self.client.post(reverse('cancel',
+                                            args=[str(uuid.uuid1())]))
+        self.assertEqual(response.status_code, 404)
+
+    def tearDown(self):
+        clearDatabase()
+
+
+class MetricsTests(APITestCase):
+
+    @patch('analytics_automated.metrics.queue_depth', return_value=3)
+    def test_metrics_report_submissions_and_queue_depths(self, mock_depth):
+        j1 = JobFactory.create(name="job1")
+        SubmissionFactory.create(job=j1, status=Submission.SUBMITTED)
+        SubmissionFactory.create(job=j1, status=Submission.RUNNING)
+        SubmissionFactory.create(job=j1, status=Submission.COMPLETE)
+        QueueTypeFactory.create(name="localhost")
+        response = self.client.get(reverse('metrics',))
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode("utf-8")
+        self.assertIn('aa_submissions_by_status{job="job1",'
+                      'status="Running"} 1.0', metrics)
+        # finished submissions are counted as they happen, not scanned
+        self.assertNotIn('status="Complete"} 1.0', metrics)
+        self.assertIn('aa_queue_depth{queue="high_localhost"} 3.0', metrics)
+        self.assertIn('aa_queue_depth{queue="'+settings.NOTIFICATION_QUEUE +
+                      '"} 3.0', metrics)
+
+    def test_status_changes_are_counted(self):
+        j1 = JobFactory.create(name="counted_job")
+        s = SubmissionFactory.create(job=j1, status=Submission.RUNNING)
+
+        def completed():
+            return REGISTRY.get_sample_value(
+                'aa_submissions_total', {'job': 'counted_job',
+                                         'status': 'Complete'}) or 0
+        before = completed()
+        Submission.update_submission_state(s, True, Submission.COMPLETE, 1,
+                                           "w1", "Completed", "h1")
+        # a repeated update is not a transition
+        Submission.update_submission_state(s, True, Submission.COMPLETE, 1,
+                                           "w1", "Completed", "h1")
+        self.assertEqual(completed(), before+1)
+        response = self.client.get(reverse('metrics',))
+        self.assertIn('aa_submissions_total{job="counted_job",'
+                      'status="Complete"}', response.content.decode("utf-8"))
+
+    def tearDown(self):
+        clearDatabase()
+
+
 class EndpointListTests(APITestCase):
 
     def test_return_of_available_endpoint_types(self):
@@ -298,7 +477,7 @@ class SubmissionRequestTests(APITestCase):
                                            args=[b1.UUID, ]) + ".json")
         self.assertEqual(response.status_code, 200)
         test_data = '{{"UUID":"{0}",' \
-                    '"state":"Submitted",' \
+                    '"state":"Submitted","last_message":null,' \
                     '"submissions":[{{"submission_name":"{1}",' \
                     '"job_name":"{2}",' \
                     '"UUID":"{3}",' \
@@ -338,7 +517,7 @@ class SubmissionRequestTests(APITestCase):
                                            args=[b1.UUID, ]) + ".json")
         self.assertEqual(response.status_code, 200)
         test_data = '{{"UUID":"{0}",' \
-                    '"state":"Submitted",' \
+                    '"state":"Submitted","last_message":null,' \
                     '"submissions":[{{"submission_name":"{1}",' \
                     '"job_name":"{2}",' \
                     '"UUID":"{3}",' \
@@ -369,7 +548,7 @@ class SubmissionRequestTests(APITestCase):
                      )
         self.assertEqual(response.content.decode("utf-8"), test_data)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_accepts_when_file_validates(self, m):
         vt = ValidatorTypesFactory.create(name='png')
         v = ValidatorFactory.create(job=self.j1, validation_type=vt)
@@ -385,7 +564,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_rejects_when_file_does_not_validate(self, m):
         vt = ValidatorTypesFactory.create(name='png')
         v = ValidatorFactory.create(job=self.j1, validation_type=vt)
@@ -401,7 +580,41 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
-    @patch('builtins.exec', return_value=True)
+    @override_settings(MAX_UPLOAD_SIZE=10)
+    def test_submission_abandons_oversized_upload_part_way(self):
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        view = SubmissionDetails.as_view()
+        response = view(request)
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(Submission.objects.count(), 0)
+        # the rest of the body is drained so the 413 reaches the client
+        self.assertEqual(request._stream.remaining, 0)
+
+    @override_settings(MAX_UPLOAD_SIZE=10)
+    def test_client_receives_413_for_oversized_upload(self):
+        response = self.client.post(reverse('submission'), self.data,
+                                    format='multipart',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("byte limit", response.json()['error'])
+        self.assertEqual(Submission.objects.count(), 0)
+
+    @override_settings(MAX_UPLOAD_SIZE=10, DATA_UPLOAD_MAX_MEMORY_SIZE=None)
+    def test_submission_rejects_oversized_content_length_unread(self):
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        view = SubmissionDetails.as_view()
+        response = view(request)
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # the body is not read
+        self.assertEqual(request._stream.remaining,
+                         int(request.META['CONTENT_LENGTH']))
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_accepts_when_all_params_given(self, m):
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
         p2 = ParameterFactory.create(task=self.t, rest_alias="that")
@@ -413,7 +626,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_rejects_when_a_param_is_missed(self, m):
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
         p2 = ParameterFactory.create(task=self.t, rest_alias="that")
@@ -425,7 +638,7 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(len(Submission.objects.all()), 0)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_ignores_undefined_params(self, m):
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
         self.data['task1_strange'] = "Value2"
@@ -436,7 +649,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_checks_params_across_more_than_one_task(self, m):
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
         t2 = TaskFactory.create(backend=self.b, name="task2", executable="ls")
@@ -449,7 +662,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_valid_submission_post_creates_entry(self, m):
         request = self.factory.post(reverse('submission'), self.data,
                                     format='multipart')
@@ -457,7 +670,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_valid_submission_gets_medium_priority(self, m):
         request = self.factory.post(reverse('submission'), self.data,
                                     format='multipart')
@@ -466,7 +679,7 @@ class SubmissionRequestTests(APITestCase):
         subs = Submission.objects.get()
         self.assertEqual(subs.priority, Submission.MEDIUM)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submissions_after_threshold_get_low_priority(self, m):
         # THIS FUNCTION AND OTHERS THAT DEPEND ON SETTINGS
         # ARE NOT IDEMPOTENT.
@@ -483,7 +696,7 @@ class SubmissionRequestTests(APITestCase):
         subs = Submission.objects.all()
         self.assertEqual(subs[10].priority, Submission.LOW)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submissions_after_hard_limit_get_rejection(self, m):
         for i in range(0, settings.QUEUE_HARD_LIMIT):
             s = SubmissionFactory.create(ip="127.0.0.1", status=0)
@@ -494,6 +707,20 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(response.status_code,
                          status.HTTP_429_TOO_MANY_REQUESTS)
 
+    @override_settings(FAIR_SHARE=True, FAIR_SHARE_SLOTS=0)
+    @patch('analytics_automated.fairshare.dispatch_chains')
+    def test_fair_share_holds_rather_than_rejects(self, m):
+        for i in range(0, settings.QUEUE_HARD_LIMIT):
+            s = SubmissionFactory.create(ip="127.0.0.1", status=0)
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        view = SubmissionDetails.as_view()
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        held = HeldSubmission.objects.get()
+        self.assertEqual((held.client, held.weight), ("127.0.0.1", 1))
+        self.assertFalse(m.called)
+
     def test_rejection_with_bad_email(self):
         self.data['email'] = 'b'
         request = self.factory.post(reverse('submission'), self.data,
@@ -564,7 +791,7 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
     # Batch processing tests
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_submission_makes_single_batch_entry(self, m):
         request = self.factory.post(reverse('submission'), self.data,
                                     format='multipart')
@@ -573,7 +800,7 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(len(Batch.objects.all()), 1)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_dual_submission_makes_common_batch_entries(self, m):
         self.data['job'] = 'job1,job2'
         request = self.factory.post(reverse('submission'), self.data,
@@ -588,7 +815,146 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(submission_entries[0].batch, batch_entries[0])
         self.assertEqual(submission_entries[1].batch, batch_entries[0])
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_dual_submission_shares_input_and_dispatches_once(self, m):
+        self.data['job'] = 'job1,job2'
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        view = SubmissionDetails.as_view()
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        submission_entries = Submission.objects.all()
+        self.assertEqual(submission_entries[0].input_data.name,
+                         submission_entries[1].input_data.name)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len(m.call_args[0][0]), 2)
+        self.assertEqual(ActiveSubmissionCount.lookup(
+                         submission_entries[0].ip), 2)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_identical_submission_follows_the_one_in_flight(self, m):
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.data['input_data'] = SimpleUploadedFile('file1.txt',
+                                                     bytes('these are the '
+                                                           'file contents!',
+                                                           'utf-8'))
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first, second = Submission.objects.order_by('pk')
+        self.assertEqual(first.fingerprint, second.fingerprint)
+        self.assertEqual(second.leader, first)
+        self.assertEqual(m.call_count, 1)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    @patch('analytics_automated.api.dispatch_batch')
+    def test_async_submission_is_accepted_then_dispatched(self, d, m):
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        with self.settings(ASYNC_SUBMISSIONS=True):
+            response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        batch_uuid = response.data['UUID']
+        d.delay.assert_called_once_with(batch_uuid)
+        self.assertEqual(Submission.objects.count(), 0)
+        SubmissionDetails().dispatch_pending(batch_uuid)
+        b = Batch.objects.get(UUID=batch_uuid)
+        self.assertIsNone(b.pending_request)
+        self.assertEqual(b.submissions.count(), 1)
+        self.assertEqual(b.submissions.get().blob.ref_count, 1)
+        self.assertEqual(m.call_count, 1)
+
+    @patch('analytics_automated.api.dispatch_chains')
+    @patch('analytics_automated.api.dispatch_batch')
+    def test_async_submission_publishes_after_its_transaction(self, d, m):
+        depths = []
+        m.side_effect = lambda chains: depths.append(
+            len(connection.savepoint_ids))
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        with self.settings(ASYNC_SUBMISSIONS=True):
+            response = SubmissionDetails.as_view()(request)
+        SubmissionDetails().dispatch_pending(response.data['UUID'])
+        self.assertEqual(depths, [len(connection.savepoint_ids)])
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    @patch('analytics_automated.api.dispatch_batch')
+    def test_async_submission_failure_is_recorded_on_batch(self, d, m):
+        self.j1.runnable = False
+        self.j1.save()
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        with self.settings(ASYNC_SUBMISSIONS=True):
+            response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        SubmissionDetails().dispatch_pending(response.data['UUID'])
+        b = Batch.objects.get(UUID=response.data['UUID'])
+        self.assertEqual(b.status, Batch.ERROR)
+        self.assertIn("currently disabled", b.last_message)
+        self.assertEqual(InputBlob.objects.count(), 0)
+        self.assertEqual(m.call_count, 0)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_split_fasta_makes_one_submission_per_record(self, m):
+        fasta = open("submissions/files/5ptpA_msa.fasta", "rb").read()
+        self.data['input_data'] = SimpleUploadedFile('file1.fasta', fasta)
+        self.data['split_fasta'] = 'true'
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        b = Batch.objects.get(UUID=response.data['UUID'])
+        records = fasta.count(b">")
+        self.assertEqual(b.submissions.count(), records)
+        self.assertEqual(b.pending, records)
+        # the records are identical so they share one stored blob
+        self.assertEqual(InputBlob.objects.get().ref_count, records)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(len(m.call_args[0][0]), records)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_split_fasta_rejects_invalid_records(self, m):
+        fasta = open("submissions/files/5ptpA_msa.fasta", "rb").read() + \
+            open("submissions/files/nucleotide.fasta", "rb").read()
+        self.data['input_data'] = SimpleUploadedFile('file1.fasta', fasta)
+        self.data['split_fasta'] = 'true'
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(fasta.count(b">")), response.data['error'])
+        self.assertEqual(Submission.objects.count(), 0)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_split_fasta_rejects_text_before_the_first_record(self, m):
+        fasta = b"stray header\n" + \
+            open("submissions/files/5ptpA_msa.fasta", "rb").read()
+        self.data['input_data'] = SimpleUploadedFile('file1.fasta', fasta)
+        self.data['split_fasta'] = 'true'
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("before its first", response.data['error'])
+
+    @override_settings(MAX_FASTA_RECORDS=2)
+    @patch('analytics_automated.api.ContentFile', wraps=ContentFile)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
+    def test_split_fasta_stops_at_the_record_limit(self, m, content_file):
+        fasta = open("submissions/files/5ptpA_msa.fasta", "rb").read()
+        self.data['input_data'] = SimpleUploadedFile('file1.fasta', fasta)
+        self.data['split_fasta'] = 'true'
+        request = self.factory.post(reverse('submission'), self.data,
+                                    format='multipart')
+        response = SubmissionDetails.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("more than 2", response.data['error'])
+        self.assertEqual(content_file.call_count, 2)
+
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_multiple_submission_makes_seperate_batch_entries(self, m):
         self.data['job'] = 'job1'
         request = self.factory.post(reverse('submission'), self.data,
@@ -608,7 +974,7 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(len(batch_entries), 2)
         self.assertNotEqual(batch_entries[0].UUID, batch_entries[1].UUID)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_reject_where_one_job_does_not_exist(self, m):
         self.data['job'] = 'job1,job34'
         request = self.factory.post(reverse('submission'), self.data,
@@ -620,7 +986,7 @@ class SubmissionRequestTests(APITestCase):
         self.assertEqual(len(batch_entries), 0)
         self.assertEqual(len(Submission.objects.all()), 0)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_accept_batch_with_params(self, m):
         self.data['job'] = 'job1,job2'
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
@@ -633,7 +999,7 @@ class SubmissionRequestTests(APITestCase):
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-    @patch('builtins.exec', return_value=True)
+    @patch('analytics_automated.api.dispatch_chains', return_value=True)
     def test_reject_batch_with_missin_params(self, m):
         self.data['job'] = 'job1,job2'
         p1 = ParameterFactory.create(task=self.t, rest_alias="this")
@@ -25,6 +25,9 @@ from rest_framework.parsers import MultiPartParser
 from rest_framework.parsers import FormParser
 
 from analytics_automated.api import SubmissionDetails
+from analytics_automated.plans import get_plan
+from analytics_automated.cmdline import forbidden_token_index
+from analytics_automated import cmdline
 from analytics_automated.models import *
 from .model_factories import *
 from analytics_automated.tasks import *
@@ -141,7 +144,7 @@ class APIPrivateFunctionTests(APITestCase):
     def test_get_job_returns_job_id(self):
         sd = SubmissionDetails()
         value = sd._SubmissionDetails__get_job("job1")
-        self.assertEqual(value, [self.j1.pk])
+        self.assertEqual(value, [self.j1])
 
     def test_get_job_raises_if_not_entry(self):
         sd = SubmissionDetails()
@@ -151,9 +154,8 @@ class APIPrivateFunctionTests(APITestCase):
         p1 = ParameterFactory.create(task=self.t, flag="VALUE",
                                      bool_valued=False,
                                      rest_alias="this")
-        sd = SubmissionDetails()
-        value = sd._SubmissionDetails__return_value(self.t,
-                                                    {'task1_this': 456})
+        step_plan = get_plan(self.j1).levels[0][0]
+        value = step_plan.schema.return_value({'task1_this': 456})
         self.assertEqual(value, 456)
 
     def test__return_value_default_with_no_value_flag(self):
@@ -161,29 +163,25 @@ class APIPrivateFunctionTests(APITestCase):
                                      bool_valued=False,
                                      rest_alias="this",
                                      default="A")
-        sd = SubmissionDetails()
-        value = sd._SubmissionDetails__return_value(self.t,
-                                                    {'task1_that': 456})
+        step_plan = get_plan(self.j1).levels[0][0]
+        value = step_plan.schema.return_value({'task1_that': 456})
         self.assertEqual(value, "A")
 
     def test__return_value_empty_string_with_no_value_set(self):
         p1 = ParameterFactory.create(task=self.t, flag="thingy",
                                      bool_valued=False,
                                      rest_alias="this")
-        sd = SubmissionDetails()
-        value = sd._SubmissionDetails__return_value(self.t,
-                                                    {'task1_this': 456})
+        step_plan = get_plan(self.j1).levels[0][0]
+        value = step_plan.schema.return_value({'task1_this': 456})
         self.assertEqual(value, '')
 
     def test__build_environment_returns_valid_dict(self):
         p1 = EnvironmentFactory.create(task=self.t, env="Test", value="McPath")
-        sd = SubmissionDetails()
-        dict = sd._SubmissionDetails__build_environment(self.t)
+        dict = get_plan(self.j1).schema.tasks['task1'].environment
         self.assertEqual(dict, {"Test": "McPath"})
 
     def test__build_environment_returns_empty_dict_without_settings(self):
-        sd = SubmissionDetails()
-        dict = sd._SubmissionDetails__build_environment(self.t)
+        dict = get_plan(self.j1).schema.tasks['task1'].environment
         self.assertEqual(dict, {})
 
     def test__test_params_returns_true_when_set_is_contained(self):
@@ -192,11 +190,11 @@ class APIPrivateFunctionTests(APITestCase):
         p1 = ParameterFactory.create(task=self.t, flag="-th",
                                      bool_valued=False,
                                      rest_alias="that")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_that': 123,
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_that': 123,
                                                           'task1_this': 69})
-        self.assertEqual(bool, True)
+        self.assertEqual(bool[0], True)
 
     def test__test_params_returns_false_when_set_is_not_complete(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
@@ -204,61 +202,93 @@ class APIPrivateFunctionTests(APITestCase):
         p1 = ParameterFactory.create(task=self.t, flag="-th",
                                      bool_valued=False,
                                      rest_alias="that")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_that': 123, })
-        self.assertEqual(bool, False)
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_that': 123, })
+        self.assertEqual(bool[0], False)
 
     def test__test_params_returns_true_when_too_many_items_passed(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
                                      rest_alias="this")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_that': 123,
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_that': 123,
                                                           'task1_this': 69})
-        self.assertEqual(bool, True)
+        self.assertEqual(bool[0], True)
 
     def test__test_params_returns_true_with_nothing(self):
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {})
-        self.assertEqual(bool, True)
+        bool = sd._SubmissionDetails__test_params(schema, {})
+        self.assertEqual(bool[0], True)
 
     def test_params_rejected_with_punctuation(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
                                      rest_alias="this")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_this':
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_this':
                                                           'asd|:'})
-        self.assertEqual(bool, False)
+        self.assertEqual(bool[0], False)
 
     def test_params_reject_with_unix_commands(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
                                      rest_alias="this")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_this':
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_this':
                                                           'rm'})
-        self.assertEqual(bool, False)
+        self.assertEqual(bool[0], False)
 
     def test_params_rejected_with_python_reserved_words(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
                                      rest_alias="this")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_this':
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_this':
                                                           'import'})
-        self.assertEqual(bool, False)
+        self.assertEqual(bool[0], False)
 
     def test_params_rejected_with_r_reserved_words(self):
         p1 = ParameterFactory.create(task=self.t, flag="-t", bool_valued=False,
                                      rest_alias="this")
-        steps = self.j1.steps.all()
+        schema = get_plan(self.j1).schema
         sd = SubmissionDetails()
-        bool = sd._SubmissionDetails__test_params(steps, {'task1_this':
+        bool = sd._SubmissionDetails__test_params(schema, {'task1_this':
                                                           'format.packageInfo'})
-        self.assertEqual(bool, False)
+        self.assertEqual(bool[0], False)
+
+    def test_params_rejection_names_the_punctuation(self):
+        sd = SubmissionDetails()
+        result = sd._SubmissionDetails__assess_param_value_sanity(
+                 {'task1_this': 'asd|'})
+        self.assertEqual(result, [False, "Incoming data can not contain "
+                                         "punctuation: |"])
+
+    def test_params_rejection_prefers_python_keywords(self):
+        sd = SubmissionDetails()
+        result = sd._SubmissionDetails__assess_param_value_sanity(
+                 {'task1_this': 'if'})
+        self.assertEqual(result, [False, "Incoming data can not contain "
+                                         "python keyords: if"])
+
+    def test_forbidden_token_index_is_reused(self):
+        index = forbidden_token_index()
+        self.assertIs(index, forbidden_token_index(refresh=True))
+        self.assertEqual(index['mkdir'], "unix commands")
+        self.assertNotIn('in', index)
+
+    def test_forbidden_token_index_is_checked_on_a_timer(self):
+        forbidden_token_index(refresh=True)
+        stamp = cmdline.__dict__['__command_paths_stamp']
+        with patch('analytics_automated.cmdline.__command_paths_stamp',
+                   wraps=stamp) as m:
+            with self.settings(TOKEN_INDEX_REFRESH=None):
+                forbidden_token_index()
+            self.assertEqual(m.call_count, 0)
+            with self.settings(TOKEN_INDEX_REFRESH=0):
+                forbidden_token_index()
+            self.assertGreater(m.call_count, 0)
 
     #
     # TEST FOR __submit_job needed here
@@ -57,3 +57,23 @@ class TaskForms(TestCase):
         s = SubmissionFactory.create(input_data=File(pngFile))
         self.assertFalse(sf._SubmissionForm__validate_input(validators,
                          s.input_data))
+
+    def test__validate_input_maps_files_on_disk(self):
+        vt = ValidatorTypesFactory.create(name='pdb_file')
+        v = ValidatorFactory.create(job=self.j1, validation_type=vt)
+        validators = self.j1.validators.all()
+        sf = SubmissionForm()
+        f = open("submissions/files/1iar.pdb", "rb").read()
+        pdbFile = SimpleUploadedFile('file1.pdb', f)
+        s = SubmissionFactory.create(input_data=File(pdbFile))
+        self.assertTrue(sf._SubmissionForm__validate_input(validators,
+                        s.input_data))
+
+    def test_oversized_input_is_rejected(self):
+        with self.settings(MAX_UPLOAD_SIZE=10):
+            sf = SubmissionForm(data={'job': self.j1.pk,
+                                      'submission_name': 'test',
+                                      'email': 'a@b.com'},
+                                files={'input_data': self.file})
+            self.assertFalse(sf.is_valid())
+            self.assertIn('input_data', sf.errors)
@@ -2,12 +2,15 @@ import uuid
 import glob
 
 from django.test import TestCase
-from django.db import transaction
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.exceptions import ValidationError
 
 from analytics_automated.models import Backend, Task, Job
 from analytics_automated.models import Step, Submission, Validator
+from analytics_automated.models import InputBlob, ActiveSubmissionCount
+from analytics_automated.models import PendingStep
 from .model_factories import *
 from .helper_functions import clearDatabase
 
@@ -96,6 +99,15 @@ class StepMethodTest(TestCase):
     #         error_ocurred = True
     #     self.assertTrue(error_ocurred)
 
+    def test_steps_only_depend_on_lower_orderings(self):
+        j = JobFactory.create()
+        s = StepFactory(job=j, ordering=2, depends_on="0, 1")
+        s.full_clean()
+        s.depends_on = "2"
+        self.assertRaises(ValidationError, s.full_clean)
+        s.depends_on = "a"
+        self.assertRaises(ValidationError, s.full_clean)
+
     def test_ensure_all_steps_are_removed_on_job_deletion(self):
         b = BackendFactory.create()
         t = TaskFactory.create(backend=b)
@@ -118,6 +130,156 @@ class SubmissionTest(TestCase):
         s = SubmissionFactory.create()
         self.assertEqual(Submission.objects.count(), 1)
 
+    def test_active_count_follows_state_changes(self):
+        """
+            finishing or deleting a submission releases its ip's count
+        """
+        s1 = SubmissionFactory.create(ip="10.0.0.1")
+        s2 = SubmissionFactory.create(ip="10.0.0.1")
+        self.assertEqual(ActiveSubmissionCount.lookup("10.0.0.1"), 2)
+        s1.status = Submission.RUNNING
+        s1.save()
+        self.assertEqual(ActiveSubmissionCount.lookup("10.0.0.1"), 2)
+        s1.status = Submission.COMPLETE
+        s1.save()
+        self.assertEqual(ActiveSubmissionCount.lookup("10.0.0.1"), 1)
+        Submission.objects.get(pk=s2.pk).delete()
+        self.assertEqual(ActiveSubmissionCount.lookup("10.0.0.1"), 0)
+
+    def test_active_count_released_once_by_stale_copies(self):
+        """
+            two workers failing the same submission only release it once
+        """
+        s = SubmissionFactory.create(ip="10.0.0.1")
+        worker1 = Submission.objects.get(pk=s.pk)
+        worker2 = Submission.objects.get(pk=s.pk)
+        worker1.status = Submission.ERROR
+        worker1.save()
+        worker2.status = Submission.ERROR
+        worker2.save()
+        self.assertEqual(ActiveSubmissionCount.lookup("10.0.0.1"), 0)
+
+    def test_state_messages_can_be_buffered_until_the_next_flush(self):
+        s = SubmissionFactory.create()
+        Submission.update_submission_state(s, True, Submission.RUNNING, 1,
+                                           "worker", "Running step: 1",
+                                           "host", flush=False)
+        self.assertEqual(Submission.objects.get(pk=s.pk).status,
+                         Submission.RUNNING)
+        self.assertEqual(s.messages.count(), 0)
+        Submission.update_submission_state(s, True, Submission.COMPLETE, 1,
+                                           "worker", "Completed job",
+                                           "host")
+        self.assertEqual([m.message for m in s.messages.order_by('pk')],
+                         ["Running step: 1", "Completed job"])
+
+    def test_unchanged_state_does_not_update_the_submission(self):
+        s = SubmissionFactory.create()
+        Submission.update_submission_state(s, True, Submission.RUNNING, 1,
+                                           "worker", "Running", "host")
+        with CaptureQueriesContext(connection) as queries:
+            Submission.update_submission_state(s, True, Submission.RUNNING,
+                                               1, "worker", "Running", "host")
+        self.assertFalse([q for q in queries.captured_queries
+                          if q['sql'].startswith('UPDATE')])
+        self.assertEqual(s.messages.count(), 2)
+
+    def test_batch_completes_when_its_last_submission_completes(self):
+        b = BatchFactory.create(status=Batch.RUNNING)
+        s1 = SubmissionFactory.create(batch=b)
+        s2 = SubmissionFactory.create(batch=b)
+        b.refresh_from_db()
+        self.assertEqual(b.pending, 2)
+        Submission.update_submission_state(s1, True, Submission.COMPLETE, 1,
+                                           "worker", "done", "host")
+        b.refresh_from_db()
+        self.assertEqual((b.pending, b.completed), (1, 1))
+        self.assertEqual(b.status, Batch.RUNNING)
+        # a second, stale copy of the finished submission is not recounted
+        stale = Submission.objects.get(pk=s2.pk)
+        Submission.update_submission_state(s2, True, Submission.COMPLETE, 1,
+                                           "worker", "done", "host")
+        Submission.update_submission_state(stale, True, Submission.COMPLETE,
+                                           1, "worker", "done", "host")
+        b.refresh_from_db()
+        self.assertEqual((b.pending, b.completed, b.failed), (0, 2, 0))
+        self.assertEqual(b.status, Batch.COMPLETE)
+
+    def test_batch_with_a_failure_does_not_complete(self):
+        b = BatchFactory.create(status=Batch.RUNNING)
+        s1 = SubmissionFactory.create(batch=b)
+        s2 = SubmissionFactory.create(batch=b)
+        Submission.update_submission_state(s1, True, Submission.ERROR, 1,
+                                           "worker", "failed", "host")
+        Batch.update_batch_state(b, Batch.ERROR)
+        Submission.update_submission_state(s2, True, Submission.COMPLETE, 1,
+                                           "worker", "done", "host")
+        b.refresh_from_db()
+        self.assertEqual((b.pending, b.completed, b.failed), (0, 1, 1))
+        self.assertEqual(b.status, Batch.ERROR)
+
+    def tearDown(self):
+        clearDatabase()
+
+
+class PendingStepTest(TestCase):
+
+    def test_dependents_are_released_once_all_parents_finish(self):
+        s = SubmissionFactory.create()
+        roots = PendingStep.start(s, [(1, 0, {'task': 'one'}),
+                                      (2, 0, {'task': 'two'}),
+                                      (3, 2, {'task': 'three'})])
+        self.assertEqual(roots, [{'task': 'one'}, {'task': 'two'}])
+        self.assertEqual(PendingStep.finish(s.pk, 1, [3]), ([], False))
+        # a second copy of the same step does not count twice
+        self.assertEqual(PendingStep.finish(s.pk, 1, [3]), ([], False))
+        self.assertEqual(PendingStep.finish(s.pk, 2, [3]),
+                         ([{'task': 'three'}], False))
+        self.assertEqual(PendingStep.finish(s.pk, 3, []), ([], True))
+
+    def test_an_erroring_submission_drops_its_pending_steps(self):
+        s = SubmissionFactory.create(status=Submission.RUNNING)
+        PendingStep.start(s, [(1, 0, {'task': 'one'}),
+                              (2, 1, {'task': 'two'})])
+        Submission.update_submission_state(s, True, Submission.ERROR, 1,
+                                           None, "Failed", "localhost")
+        self.assertEqual(PendingStep.objects.filter(submission=s).count(),
+                         0)
+
+    def tearDown(self):
+        clearDatabase()
+
+
+class InputBlobTest(TestCase):
+
+    def test_identical_inputs_share_one_blob(self):
+        """
+            storing the same bytes twice keeps one file and counts references
+        """
+        b1 = InputBlob.store(SimpleUploadedFile('file1.txt', b'ACGT'))
+        b2 = InputBlob.store(SimpleUploadedFile('file1.txt', b'ACGT'),
+                             references=2)
+        self.assertEqual(b1.pk, b2.pk)
+        self.assertEqual(InputBlob.objects.count(), 1)
+        self.assertEqual(b2.ref_count, 3)
+        self.assertEqual(b2.size, 4)
+        self.assertEqual(b2.digest, b2.data.name.split("/")[-1][:64])
+
+    def test_deleting_submissions_releases_the_blob(self):
+        """
+            the blob and its file go once the last submission is deleted
+        """
+        blob = InputBlob.store(SimpleUploadedFile('file1.txt', b'ACGT'),
+                               references=2)
+        name = blob.data.name
+        s1 = SubmissionFactory.create(blob=blob, input_data=name)
+        s2 = SubmissionFactory.create(blob=blob, input_data=name)
+        s1.delete()
+        self.assertEqual(InputBlob.objects.get(pk=blob.pk).ref_count, 1)
+        s2.delete()
+        self.assertEqual(InputBlob.objects.count(), 0)
+        self.assertFalse(blob.data.storage.exists(name))
+
     def tearDown(self):
         clearDatabase()
 
@@ -13,7 +13,7 @@ from django.test import override_settings
 
 from analytics_automated.tasks import *
 from analytics_automated import tasks
-from analytics_automated.models import Submission, Message
+from analytics_automated.models import Submission, Message, PendingStep
 from .model_factories import *
 from .helper_functions import clearDatabase
 
@@ -92,6 +92,74 @@ class TaskTestCase(TestCase):
         #     print(str(m))
         self.assertGreater(len(self.messages), 1)
 
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=0)
+    def testTaskRunnerRecordsStepTimings(self, m):
+        task_runner(self.uuid1, 0, 1, 1, 1, "test_task", [], {}, None, 1, {})
+        timing = StepTiming.objects.get(submission__UUID=self.uuid1)
+        self.assertEqual(timing.step, 1)
+        self.assertEqual(timing.task.name, "test_task")
+        for phase in StepTiming.PHASES:
+            self.assertGreaterEqual(getattr(timing, phase), 0)
+
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=1)
+    def testTaskRunnerRecordsStepTimingsOfFailures(self, m):
+        self.assertRaises(OSError, task_runner, self.uuid1, 0, 1, 1, 1,
+                          "test_task", [], {}, None, 1, {})
+        timing = StepTiming.objects.get(submission__UUID=self.uuid1)
+        self.assertIsNotNone(timing.run_cmd)
+
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=0)
+    def testTaskRunnerRunsOnThePooledBackendItWasSentTo(self, m):
+        b2 = BackendFactory.create(root_path="/tmp/")
+        self.t.backends.add(b2)
+        with patch('analytics_automated.tasks.claim_backend') as mock_claim, \
+             patch('analytics_automated.tasks.make_runner',
+                   wraps=tasks.make_runner) as mock_make:
+            task_runner(self.uuid1, 0, 1, 1, 1, "test_task", [], {}, None, 1,
+                        {}, backend=b2.pk)
+        self.assertEqual(mock_make.call_args[0][-1], b2)
+        mock_claim.assert_called_once_with(b2)
+
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=0)
+    def testTaskRunnerDoesNotCountTasksWithOneBackend(self, m):
+        with patch('analytics_automated.tasks.claim_backend') as mock_claim, \
+             patch('analytics_automated.tasks.release_backend') as mock_rel:
+            task_runner(self.uuid1, 0, 1, 1, 1, "test_task", [], {}, None, 1,
+                        {})
+        mock_claim.assert_not_called()
+        mock_rel.assert_not_called()
+
+    @patch('analytics_automated.tasks.observe_task')
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=1)
+    def testTaskRunnerCountsFailuresByExitPath(self, m, mock_observe):
+        self.assertRaises(OSError, task_runner, self.uuid1, 0, 1, 1, 1,
+                          "test_task", [], {}, None, 1, {})
+        task, backend, duration, exit_path = mock_observe.call_args[0]
+        self.assertEqual(task.name, "test_task")
+        self.assertEqual(backend, self.b)
+        self.assertGreaterEqual(duration, 0)
+        self.assertEqual(exit_path, "task_exit")
+
+    @patch('analytics_automated.tasks.signature')
+    @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=0)
+    def testDagStepsAreReleasedAsTheirParentsFinish(self, m, mock_signature):
+        PendingStep.start(self.sub, [(1, 0, {}), (2, 0, {}),
+                                     (3, 1, {'task': 'three'})])
+        task_runner(self.uuid1, 0, 1, 1, 3, "test_task", [], {}, None, 1, {},
+                    upstream=[], dependents=[3])
+        mock_signature.assert_called_once_with({'task': 'three'})
+        self.sub = Submission.objects.get(UUID=self.uuid1)
+        self.assertEqual(self.sub.status, Submission.RUNNING)
+        task_runner(self.uuid1, 1, 3, 3, 3, "test_task", [], {}, None, 1, {},
+                    upstream=[1], dependents=[])
+        self.sub = Submission.objects.get(UUID=self.uuid1)
+        self.assertEqual(self.sub.status, Submission.RUNNING)
+        task_runner(self.uuid1, 0, 2, 2, 3, "test_task", [], {}, None, 1, {},
+                    upstream=[], dependents=[])
+        self.sub = Submission.objects.get(UUID=self.uuid1)
+        self.assertEqual(self.sub.status, Submission.COMPLETE)
+        self.assertEqual(self.sub.last_message, "Completed job at step #2")
+
     @patch('analytics_automated.tasks.localRunner.run_cmd', return_value=1)
     def testTaskRunnerExecuteNoneZeroExit(self, m):
         self.assertRaises(OSError, task_runner, self.uuid1, 0, 1, 1, 1,
@@ -79,7 +79,9 @@ class TaskIncompleteFilesBehaviours(TestCase):
                                 executable="grep 'previous' /tmp/",
                                 in_glob="in", out_glob="out, this",
                                 incomplete_outputs_behaviour=Task.CONTINUE)
-        with patch('analytics_automated.tasks.localRunner') as lr:
+        # a mocked runner has no working directory to stage inputs in
+        with patch('analytics_automated.tasks.localRunner') as lr, \
+             patch('analytics_automated.tasks.stage_input_files'):
             lr().run_cmd.return_value = 0
             lr().output_data = {"huh.py": b"this"}
             task_runner.delay(self.uuid1, 0, 1, 1, 1, "test_custom_continue",
@@ -104,7 +106,9 @@ class TaskIncompleteFilesBehaviours(TestCase):
                                 executable="grep 'previous' /tmp/",
                                 in_glob="in", out_glob="out, this",
                                 incomplete_outputs_behaviour=Task.FAIL)
-        with patch('analytics_automated.tasks.localRunner') as lr:
+        # a mocked runner has no working directory to stage inputs in
+        with patch('analytics_automated.tasks.localRunner') as lr, \
+             patch('analytics_automated.tasks.stage_input_files'):
             lr().run_cmd.return_value = 0
             lr().output_data = {"huh.py": b"this"}
             with transaction.atomic():
@@ -126,7 +130,9 @@ class TaskIncompleteFilesBehaviours(TestCase):
                                 executable="grep 'previous' /tmp/",
                                 in_glob="in", out_glob="out, this",
                                 incomplete_outputs_behaviour=Task.TERMINATE)
-        with patch('analytics_automated.tasks.localRunner') as lr:
+        # a mocked runner has no working directory to stage inputs in
+        with patch('analytics_automated.tasks.localRunner') as lr, \
+             patch('analytics_automated.tasks.stage_input_files'):
             lr().run_cmd.return_value = 0
             lr().output_data = {"huh.py": b"this"}
             task_runner.delay(self.uuid1, 0, 1, 1, 1, "test_custom_continue",
@@ -1,12 +1,14 @@
 import uuid
 import glob
 import os
+import shutil
 import factory
 
 from unittest.mock import patch
 
 from commandRunner.localRunner import *
 
+from django.core import mail
 from django.db import transaction
 from django.test import TestCase
 
@@ -14,7 +16,10 @@ from django.test import override_settings
 
 from analytics_automated.tasks import *
 from analytics_automated import tasks
-from analytics_automated.models import Submission, Message
+from analytics_automated.routing import Placement, claim_backend
+from analytics_automated.routing import release_backend, choose_user
+from analytics_automated.routing import reconcile_backends
+from analytics_automated.models import Submission, Message, RunningTask
 from .model_factories import *
 from .helper_functions import clearDatabase
 
@@ -66,8 +71,8 @@ class TaskPrivateFunctionUnitTests(TestCase):
     def test_get_data_correctly_gets_input_data(self):
         data, previous_step = tasks.get_data(self.sub, self.sub.UUID, 1,
                                              [".txt", ])
-        self.assertEqual(data, {self.sub.UUID+".txt": "these are the file "
-                                                      "contents!\n"})
+        self.assertEqual(data, {self.sub.UUID+".txt": b"these are the file "
+                                                       b"contents!\n"})
 
     def test_get_data_correctly_gets_previous_data(self):
         res = ResultFactory.create(submission=self.sub,
@@ -76,8 +81,8 @@ class TaskPrivateFunctionUnitTests(TestCase):
                                    previous_step=None,)
         data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 2,
                                              [".txt"])
-        self.assertEqual(data, {res.result_data.name: "Here is some previous "
-                                                      "results!\n"})
+        self.assertEqual(data, {res.result_data.name: b"Here is some previous "
+                                                       b"results!\n"})
 
     def test_correctly_gets_multiple_prior_results(self):
         res = ResultFactory.create(submission=self.sub,
@@ -91,12 +96,26 @@ class TaskPrivateFunctionUnitTests(TestCase):
         data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 2,
                                              [".txt"])
         self.assertEqual(data,
-                         {res2.result_data.name: "Here is some previous "
-                                                 "results!\n",
-                          res.result_data.name: "Here is some previous "
-                                                "results!\n"
+                         {res2.result_data.name: b"Here is some previous "
+                                                  b"results!\n",
+                          res.result_data.name: b"Here is some previous "
+                                                 b"results!\n"
                           })
 
+    def test_dag_steps_only_get_their_upstream_results(self):
+        res = ResultFactory.create(submission=self.sub,
+                                   task=self.t,
+                                   step=1,
+                                   previous_step=None,)
+        res2 = ResultFactory.create(submission=self.sub,
+                                    task=self.t,
+                                    step=2,
+                                    previous_step=None,)
+        data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 3,
+                                             [".txt"], upstream=[2])
+        self.assertEqual(list(data), [res2.result_data.name])
+        self.assertEqual(previous_step, 2)
+
     def test_correctly_gets_multiple_results_from_multiple_prior_steps(self):
         res = ResultFactory.create(submission=self.sub,
                                    task=self.t,
@@ -109,10 +128,10 @@ class TaskPrivateFunctionUnitTests(TestCase):
         data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 3,
                                              [".txt"])
         self.assertEqual(data,
-                         {res2.result_data.name: "Here is some previous "
-                                                 "results!\n",
-                          res.result_data.name: "Here is some previous "
-                                                "results!\n"
+                         {res2.result_data.name: b"Here is some previous "
+                                                  b"results!\n",
+                          res.result_data.name: b"Here is some previous "
+                                                 b"results!\n"
                           })
 
     def test_correctly_gets_2_different_results_from_multiple_prior_steps(self):
@@ -130,12 +149,225 @@ class TaskPrivateFunctionUnitTests(TestCase):
         data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 3,
                                              [".txt", ".txt2"])
         self.assertEqual(data,
-                         {res2.result_data.name: "Here is some previous "
-                                                 "results!\n",
-                          res.result_data.name: "Here is some previous "
-                                                "results!\n"
+                         {res2.result_data.name: b"Here is some previous "
+                                                  b"results!\n",
+                          res.result_data.name: b"Here is some previous "
+                                                 b"results!\n"
                           })
 
+    def test_get_data_only_reads_results_with_a_requested_ending(self):
+        res = ResultFactory.create(submission=self.sub,
+                                   task=self.t,
+                                   step=1,
+                                   previous_step=None,)
+        RESULT_DATA = settings.BASE_DIR.child("submissions").child("files"). \
+                                                             child("result1.txt2")
+        res2 = ResultFactory.create(submission=self.sub,
+                                    task=self.t,
+                                    step=2,
+                                    previous_step=None,
+                                    result_data = factory.django.FileField(from_path=RESULT_DATA),)
+        self.assertEqual(res2.extension, "txt2")
+        data, previous_step = tasks.get_data(self.sub, res.submission.UUID, 3,
+                                             ["txt2"])
+        self.assertEqual(data,
+                         {res2.result_data.name: b"Here is some previous "
+                                                  b"results!\n"})
+
+    def test_task_descriptor_is_reused_until_the_task_changes(self):
+        td = get_task_descriptor("test_task")
+        self.assertEqual(td.in_globs, ["txt"])
+        with self.assertNumQueries(1):
+            self.assertIs(get_task_descriptor("test_task"), td)
+        self.t.custom_exit_status = "1, 2"
+        self.t.custom_exit_behaviour = Task.CONTINUE
+        self.t.save()
+        td2 = get_task_descriptor("test_task")
+        self.assertIsNot(td2, td)
+        self.assertEqual(td2.valid_exit_status, [0, 1, 2])
+
+    def test_task_descriptor_is_reloaded_when_the_backend_changes(self):
+        td = get_task_descriptor("test_task")
+        self.b.root_path = "/var/tmp/"
+        self.b.save()
+        td2 = get_task_descriptor("test_task")
+        self.assertEqual(td2.task.backend.root_path, "/var/tmp/")
+
+    def test_task_descriptor_lists_pooled_backends(self):
+        td = get_task_descriptor("test_task")
+        b2 = BackendFactory.create(root_path="/tmp/")
+        self.t.backends.add(b2)
+        td2 = get_task_descriptor("test_task")
+        self.assertEqual(td2.backends, [self.b, b2])
+
+    @patch('analytics_automated.routing.queue_depths')
+    def test_least_loaded_backend_is_chosen(self, m):
+        b2 = BackendFactory.create(root_path="/tmp/")
+        Backend.objects.filter(pk=self.b.pk).update(running=2)
+        m.return_value = [0, 0]
+        self.assertEqual(Placement().choose([self.b, b2], "q"), b2)
+        claim_backend(b2)
+        claim_backend(b2)
+        claim_backend(b2)
+        self.assertEqual(Placement().choose([self.b, b2], "q"), self.b)
+        # messages waiting in a backend's queue count against it
+        m.return_value = [4, 0]
+        self.assertEqual(Placement().choose([self.b, b2], "q"), b2)
+        m.assert_called_with(["q."+self.b.name, "q."+b2.name])
+
+    @patch('analytics_automated.routing.queue_depths', return_value=[0, 0])
+    def test_a_placement_spreads_steps_over_its_backends(self, m):
+        b2 = BackendFactory.create(root_path="/tmp/")
+        placement = Placement()
+        chosen = [placement.choose([self.b, b2], "q") for i in range(4)]
+        self.assertEqual(chosen, [self.b, b2, self.b, b2])
+        # the load is read once per dispatch
+        m.assert_called_once()
+
+    @override_settings(BACKEND_MIN_FREE_DISK=100)
+    @patch('analytics_automated.routing.queue_depths', return_value=[0, 0])
+    def test_backends_low_on_disk_are_passed_over(self, m):
+        b2 = BackendFactory.create(root_path="/tmp/", name="full")
+        Backend.objects.filter(pk=b2.pk).update(free_disk=10)
+        Backend.objects.filter(pk=self.b.pk).update(running=5)
+        self.assertEqual(Placement().choose([b2, self.b], "q"), self.b)
+
+    @patch('analytics_automated.routing.free_disk', return_value=1000)
+    def test_releasing_a_backend_reports_its_free_disk(self, m):
+        claim_backend(self.b)
+        release_backend(self.b)
+        b = Backend.objects.get(pk=self.b.pk)
+        self.assertEqual((b.running, b.free_disk), (0, 1000))
+
+    def test_backend_user_is_chosen_by_priority(self):
+        low = BackendUser(login_name="low", priority=BackendUser.LOW)
+        high = BackendUser(login_name="high", priority=BackendUser.HIGH)
+        self.assertEqual(choose_user([low, high], Submission.MEDIUM), low)
+        self.assertEqual(choose_user([low, high], Submission.HIGH), high)
+        self.assertEqual(choose_user([high], Submission.LOW), high)
+        self.assertIsNone(choose_user([], Submission.LOW))
+
+    def test_backend_counts_are_reconciled_with_running_tasks(self):
+        b2 = BackendFactory.create(root_path="/tmp/")
+        Backend.objects.filter(pk=self.b.pk).update(running=3)
+        RunningTask.objects.create(submission=self.sub, task_id="w1",
+                                   hostname="h1", step=1,
+                                   heartbeat=timezone.now(), backend=b2)
+        self.assertEqual(reconcile_backends(), 2)
+        self.assertEqual(Backend.objects.get(pk=self.b.pk).running, 0)
+        self.assertEqual(Backend.objects.get(pk=b2.pk).running, 1)
+        self.assertEqual(reconcile_backends(), 0)
+
+    def test_task_descriptor_records_bad_exit_statuses(self):
+        self.t.custom_exit_status = "1,a"
+        self.t.save()
+        td = get_task_descriptor("test_task")
+        self.assertIsNotNone(td.exit_status_error)
+        self.assertEqual(td.valid_exit_status, [0])
+
+    def test_insert_data_records_the_output_ending(self):
+        tasks.insert_data({self.uuid1+".horiz.txt": b"result"}, self.sub,
+                          self.t, 1, None)
+        r = Result.objects.get(submission=self.sub)
+        self.assertEqual(r.extension, "horiz.txt")
+        r.result_data.delete()
+
+    @override_settings(DEBUG=False)
+    def test_insert_data_moves_outputs_out_of_the_working_directory(self):
+        path = "/tmp/"+self.uuid1+"/"
+        os.makedirs(path)
+        names = [self.uuid1+".out"+str(i) for i in range(3)]
+        for name in names:
+            with open(os.path.join(path, name), "wb") as fh:
+                fh.write(b"output of "+name.encode())
+        with self.assertNumQueries(1):
+            tasks.insert_data({name: b"" for name in names}, self.sub,
+                              self.t, 1, None, path)
+        self.assertEqual(os.listdir(path), [])
+        results = Result.objects.filter(submission=self.sub).order_by('pk')
+        self.assertEqual(len(results), 3)
+        for r, name in zip(results, names):
+            self.assertEqual(r.result_data.read(), b"output of "+name.encode())
+            r.result_data.delete()
+        shutil.rmtree(path)
+
+    @override_settings(DEBUG=True)
+    def test_insert_data_leaves_outputs_in_place_in_debug(self):
+        path = "/tmp/"+self.uuid1+"/"
+        os.makedirs(path)
+        name = self.uuid1+".out"
+        with open(os.path.join(path, name), "wb") as fh:
+            fh.write(b"output")
+        tasks.insert_data({name: b"output"}, self.sub, self.t, 1, None, path)
+        self.assertEqual(os.listdir(path), [name])
+        r = Result.objects.get(submission=self.sub)
+        self.assertEqual(r.result_data.read(), b"output")
+        r.result_data.delete()
+        shutil.rmtree(path)
+
+    @override_settings(DEBUG=False, INPUT_HANDOFF='hardlink')
+    def test_inputs_are_hardlinked_in_to_the_working_directory(self):
+        res = ResultFactory.create(submission=self.sub, task=self.t, step=1,
+                                   previous_step=None,)
+        input_files, previous_step = tasks.get_input_files(self.sub,
+                                                           self.uuid1, 2,
+                                                           [".txt"])
+        data_dict, local_files = tasks.split_input_files(input_files)
+        self.assertEqual(data_dict, {})
+        path = "/tmp/"+self.uuid1+"/"
+        tasks.stage_input_files(path, local_files)
+        staged = os.path.join(path, res.result_data.name)
+        self.assertTrue(os.path.samefile(staged, res.result_data.path))
+        # the task can not write through to the stored result
+        self.assertFalse(os.stat(staged).st_mode & 0o222)
+        shutil.rmtree(path)
+
+    @override_settings(DEBUG=False, INPUT_HANDOFF='hardlink')
+    def test_inputs_are_copied_when_they_can_not_be_linked(self):
+        res = ResultFactory.create(submission=self.sub, task=self.t, step=1,
+                                   previous_step=None,)
+        path = "/tmp/"+self.uuid1+"/"
+        with patch('analytics_automated.tasks.os.link',
+                   side_effect=OSError("Invalid cross-device link")):
+            tasks.stage_input_files(path, {'in.txt': res.result_data})
+        staged = os.path.join(path, 'in.txt')
+        self.assertFalse(os.path.samefile(staged, res.result_data.path))
+        with open(staged) as fh:
+            self.assertEqual(fh.read(), "Here is some previous results!\n")
+        shutil.rmtree(path)
+
+    @override_settings(DEBUG=False, INPUT_HANDOFF='copy')
+    def test_inputs_are_streamed_when_handoff_is_copy(self):
+        input_files, previous_step = tasks.get_input_files(self.sub,
+                                                           self.uuid1, 1,
+                                                           [".txt"])
+        data_dict, local_files = tasks.split_input_files(input_files)
+        self.assertEqual(data_dict, {})
+        path = "/tmp/"+self.uuid1+"/"
+        tasks.stage_input_files(path, local_files)
+        staged = os.path.join(path, self.uuid1+".txt")
+        self.assertFalse(os.path.samefile(staged, self.sub.input_data.path))
+        with open(staged, 'rb') as fh:
+            self.assertEqual(fh.read(), b"these are the file contents!\n")
+        shutil.rmtree(path)
+
+    @override_settings(DEBUG=False)
+    def test_inputs_are_only_decoded_for_text_runners(self):
+        input_files, previous_step = tasks.get_input_files(self.sub,
+                                                           self.uuid1, 1,
+                                                           [".txt"])
+        data_dict, local_files = tasks.split_input_files(input_files, True)
+        self.assertEqual(local_files, {})
+        self.assertEqual(data_dict, {self.uuid1+".txt": "these are the file "
+                                                        "contents!\n"})
+
+    def test_undecodable_input_is_passed_on_as_bytes(self):
+        self.sub.input_data.save("bad.txt", ContentFile(b"\xff\xfe"))
+        data, previous_step = tasks.get_data(self.sub, self.uuid1, 1,
+                                             [".txt"], text=True)
+        self.assertEqual(data, {self.uuid1+".txt": b"\xff\xfe"})
+        self.sub.input_data.delete()
+
     # def test_throws_error_if_it_cant_find_all_prior_resutls(self):
     #     res = ResultFactory.create(submission=self.sub,
     #                                task=self.t,
@@ -154,6 +386,262 @@ class TaskPrivateFunctionUnitTests(TestCase):
     #                       res.submission.UUID, 3,
     #                       [".txt", ".gif"])
 
+    def test_batch_notification_is_claimed_once_per_terminal_state(self):
+        b = BatchFactory.create(status=Batch.RUNNING)
+        self.assertFalse(Batch.claim_notification(b.pk))
+        Batch.objects.filter(pk=b.pk).update(status=Batch.COMPLETE)
+        self.assertTrue(Batch.claim_notification(b.pk))
+        self.assertFalse(Batch.claim_notification(b.pk))
+        Batch.objects.filter(pk=b.pk).update(status=Batch.ERROR)
+        self.assertTrue(Batch.claim_notification(b.pk))
+
+    @patch('analytics_automated.tasks.send_batch_notification.apply_async')
+    def test_finishing_a_batch_queues_one_notification(self, m):
+        self.batch.status = Batch.COMPLETE
+        self.batch.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.__dict__['__handle_batch_email'](self.sub)
+            tasks.__dict__['__handle_batch_email'](self.sub)
+        m.assert_called_once_with((self.batch.pk,),
+                                  queue=settings.NOTIFICATION_QUEUE)
+
+    def test_batch_notification_mails_each_address_once(self):
+        self.batch.status = Batch.COMPLETE
+        self.batch.notified_status = Batch.COMPLETE
+        self.batch.save()
+        self.sub.email = "a@b.com"
+        self.sub.save()
+        SubmissionFactory.create(job=self.j, batch=self.batch,
+                                 email="a@b.com")
+        SubmissionFactory.create(job=self.j, batch=self.batch,
+                                 email="c@d.com")
+        send_batch_notification(self.batch.pk)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         ["a@b.com", "c@d.com"])
+        self.assertIn(self.batch.UUID, mail.outbox[0].body)
+
+    def test_finished_leader_fans_out_results_to_followers(self):
+        self.sub.fingerprint = "abc"
+        self.sub.save()
+        res = ResultFactory.create(submission=self.sub, task=self.t, step=1,
+                                   previous_step=None,)
+        follower_batch = BatchFactory.create(status=Batch.SUBMITTED)
+        follower = SubmissionFactory.create(job=self.j, fingerprint="abc",
+                                            leader=self.sub,
+                                            batch=follower_batch)
+        Submission.update_submission_state(self.sub, True,
+                                           Submission.COMPLETE, 1, "worker",
+                                           "Completed job at step #1",
+                                           "host")
+        follower.refresh_from_db()
+        follower_batch.refresh_from_db()
+        self.assertEqual(follower.status, Submission.COMPLETE)
+        self.assertEqual(follower_batch.status, Batch.COMPLETE)
+        self.assertEqual([r.result_data.name for r in follower.results.all()],
+                         [res.result_data.name])
+
+    @patch('analytics_automated.plans.dispatch_chains')
+    @patch('analytics_automated.tasks.revoke_submission.delay')
+    def test_cancelling_stops_the_submission_not_its_followers(self, m, d):
+        self.batch.status = Batch.RUNNING
+        self.batch.save()
+        self.sub.fingerprint = "abc"
+        self.sub.save()
+        PendingStep.start(self.sub, [(1, 0, {}), (2, 1, {})])
+        follower = SubmissionFactory.create(job=self.j, fingerprint="abc",
+                                            leader=self.sub,
+                                            request_contents={'a': 1})
+        second = SubmissionFactory.create(job=self.j, fingerprint="abc",
+                                          leader=self.sub)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(cancel_submission(self.sub))
+        self.sub.refresh_from_db()
+        self.batch.refresh_from_db()
+        follower.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(self.sub.status, Submission.CANCELLED)
+        self.assertEqual(self.batch.status, Batch.CANCELLED)
+        self.assertEqual(PendingStep.objects.count(), 0)
+        m.assert_called_once_with(self.uuid1, None)
+        # the oldest follower runs in its place and leads the others
+        self.assertEqual(follower.status, Submission.SUBMITTED)
+        self.assertIsNone(follower.leader)
+        self.assertEqual(second.status, Submission.SUBMITTED)
+        self.assertEqual(second.leader, follower)
+        chains = d.call_args[0][0]
+        self.assertEqual(len(chains), 1)
+        self.assertEqual(chains[0].tasks[0].args[0], follower.UUID)
+        # a worker failing on it afterwards leaves it cancelled
+        Submission.update_submission_state(self.sub, True, Submission.ERROR,
+                                           1, "worker", "Failed", "host")
+        self.assertEqual(Submission.objects.get(pk=self.sub.pk).status,
+                         Submission.CANCELLED)
+        self.assertFalse(cancel_submission(self.sub))
+
+    @patch('analytics_automated.plans.dispatch_chains')
+    @patch('analytics_automated.tasks.revoke_submission.delay')
+    def test_deleting_a_leader_promotes_a_follower(self, m, d):
+        self.sub.fingerprint = "abc"
+        self.sub.save()
+        follower = SubmissionFactory.create(job=self.j, fingerprint="abc",
+                                            leader=self.sub)
+        second = SubmissionFactory.create(job=self.j, fingerprint="abc",
+                                          leader=self.sub)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sub.delete()
+        follower.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(follower.leader)
+        self.assertEqual(second.leader, follower)
+        self.assertEqual(d.call_args[0][0][0].tasks[0].args[0],
+                         follower.UUID)
+
+    @patch('analytics_automated.tasks.revoke_submission.delay')
+    def test_deleting_submissions_revokes_them_in_one_task(self, m):
+        self.sub.status = Submission.RUNNING
+        self.sub.worker_id = "w1"
+        self.sub.save()
+        other = SubmissionFactory.create(job=self.j,
+                                         status=Submission.SUBMITTED)
+        SubmissionFactory.create(job=self.j, status=Submission.COMPLETE)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Submission.objects.all().delete()
+            m.assert_not_called()
+        for callback in callbacks:
+            callback()
+        m.assert_called_once()
+        uuids, worker_ids = m.call_args[0]
+        self.assertEqual(dict(zip(uuids, worker_ids)),
+                         {self.uuid1: "w1", other.UUID: None})
+
+    @patch('analytics_automated.tasks.dispatch_batch.delay')
+    def test_pending_batches_are_each_sent_as_their_own_task(self, m):
+        first = BatchFactory.create(pending_request={})
+        second = BatchFactory.create(pending_request={})
+        m.side_effect = [Exception("broker down"), None]
+        self.assertEqual(dispatch_pending_batches(), 1)
+        self.assertEqual(sorted(c[0][0] for c in m.call_args_list),
+                         sorted([first.UUID, second.UUID]))
+
+    @patch('analytics_automated.tasks.current_app')
+    def test_revoke_terminates_running_and_drops_reserved_tasks(self, m):
+        inspect = m.control.inspect.return_value
+        inspect.active.return_value = {
+            'w1': [{'id': 'run1', 'args': [self.uuid1, 1]},
+                   {'id': 'other', 'args': [str(uuid.uuid1()), 1]}]}
+        inspect.reserved.return_value = {
+            'w2': [{'id': 'next1', 'args': "('"+self.uuid1+"', 2)"}]}
+        revoke_submission(self.uuid1)
+        m.control.revoke.assert_any_call(['run1'], terminate=True,
+                                         signal='SIGUSR1')
+        m.control.revoke.assert_any_call(['next1'])
+
+    def test_cancelled_submissions_do_not_run_their_steps(self):
+        self.sub.status = Submission.CANCELLED
+        self.sub.save()
+        task_runner.apply(args=(self.uuid1, self.s.pk, 1, 1, 1, "test_task",
+                                [], [], [], self.t.executable, {}))
+        self.assertEqual(self.sub.results.count(), 0)
+        self.assertEqual(Submission.objects.get(pk=self.sub.pk).status,
+                         Submission.CANCELLED)
+
+    def test_each_running_task_has_its_own_heartbeat(self):
+        Submission.update_submission_state(self.sub, True, Submission.RUNNING,
+                                           1, "w1", "Running", "h1")
+        heartbeat.hold(self.sub, "w1", "h1", 1, add.s(1, 2))
+        heartbeat.hold(self.sub, "w2", "h2", 1, add.s(3, 4))
+        self.assertEqual(json.loads(RunningTask.objects.get(
+                         task_id="w1").resume_signature)['args'], [1, 2])
+        self.assertEqual(heartbeat.beat(["w1", "w2"]), 2)
+        # the first of a group to finish leaves the other beating
+        heartbeat.drop("w1")
+        self.assertEqual(list(self.sub.running_tasks.values_list(
+                         'task_id', flat=True)), ["w2"])
+        self.assertEqual(heartbeat.beat(["w1", "w2"]), 1)
+        heartbeat.drop("w2")
+        self.assertEqual(RunningTask.objects.count(), 0)
+
+    def quiet_task(self, task_id, step=1):
+        quiet = timezone.now() - datetime.timedelta(
+            seconds=settings.HEARTBEAT_TIMEOUT+1)
+        return RunningTask.objects.create(
+            submission=self.sub, task_id=task_id, hostname="h1", step=step,
+            heartbeat=quiet, resume_signature=json.dumps(add.s(1, 2)))
+
+    @patch('analytics_automated.tasks.signature')
+    @patch('analytics_automated.tasks.current_app')
+    def test_reaper_requeues_then_crashes_silent_tasks(self, m_app, m_sig):
+        self.batch.status = Batch.RUNNING
+        self.batch.save()
+        Submission.update_submission_state(self.sub, True, Submission.RUNNING,
+                                           1, "w1", "Running", "h1")
+        self.quiet_task("w1")
+        # a task still beating is left alone
+        beating = SubmissionFactory.create(job=self.j, batch=self.batch,
+                                           status=Submission.RUNNING)
+        RunningTask.objects.create(submission=beating, task_id="w3",
+                                   hostname="h1", step=1,
+                                   heartbeat=timezone.now())
+        self.assertEqual(reap_stuck_submissions(), 1)
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.status, Submission.SUBMITTED)
+        self.assertEqual(self.sub.requeues, 1)
+        m_sig.return_value.apply_async.assert_called_once_with()
+        m_app.control.revoke.assert_called_once_with("w1", terminate=True,
+                                                     signal='SIGUSR1')
+        # the requeued step's worker goes too
+        Submission.update_submission_state(self.sub, True, Submission.RUNNING,
+                                           1, "w2", "Running", "h1")
+        self.quiet_task("w2")
+        self.assertEqual(reap_stuck_submissions(), 1)
+        self.sub.refresh_from_db()
+        self.batch.refresh_from_db()
+        self.assertEqual(self.sub.status, Submission.CRASH)
+        self.assertEqual(self.batch.status, Batch.CRASH)
+        self.assertEqual(Submission.objects.get(pk=beating.pk).status,
+                         Submission.RUNNING)
+        self.assertEqual(list(RunningTask.objects.values_list(
+                         'task_id', flat=True)), ["w3"])
+
+    @patch('analytics_automated.tasks.signature')
+    @patch('analytics_automated.tasks.current_app')
+    def test_reaping_one_of_a_group_leaves_the_submission_running(self, m_app,
+                                                                  m_sig):
+        Submission.update_submission_state(self.sub, True, Submission.RUNNING,
+                                           1, "w1", "Running", "h1")
+        self.quiet_task("w1")
+        RunningTask.objects.create(submission=self.sub, task_id="w2",
+                                   hostname="h2", step=1,
+                                   heartbeat=timezone.now())
+        self.assertEqual(reap_stuck_submissions(), 1)
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.status, Submission.RUNNING)
+        m_sig.return_value.apply_async.assert_called_once_with()
+
+    @override_settings(STUCK_SUBMISSION_TIMEOUT=60)
+    def test_reaper_times_out_running_submissions_with_no_task(self):
+        self.batch.status = Batch.RUNNING
+        self.batch.save()
+        Submission.update_submission_state(self.sub, True, Submission.RUNNING,
+                                           1, "w1", "Running", "h1")
+        stale = timezone.now() - datetime.timedelta(seconds=61)
+        Submission.objects.filter(pk=self.sub.pk).update(modified=stale)
+        # a long step which is still beating is not timed out
+        running = SubmissionFactory.create(job=self.j, batch=self.batch,
+                                           status=Submission.RUNNING)
+        RunningTask.objects.create(submission=running, task_id="w2",
+                                   hostname="h1", step=1,
+                                   heartbeat=timezone.now())
+        Submission.objects.filter(pk=running.pk).update(modified=stale)
+        self.assertEqual(reap_stuck_submissions(), 1)
+        self.sub.refresh_from_db()
+        self.batch.refresh_from_db()
+        self.assertEqual(self.sub.status, Submission.ERROR)
+        self.assertEqual(self.sub.last_message, "JOB TIMED OUT")
+        self.assertEqual(self.batch.status, Batch.ERROR)
+        self.assertEqual(Submission.objects.get(pk=running.pk).status,
+                         Submission.RUNNING)
+
     def test_only_gets_previous_data_when_there_is_an_inglobs_match(self):
         res = ResultFactory.create(submission=self.sub,
                                    task=self.t,
@@ -72,3 +72,13 @@ class TaskValidators(TestCase):
     def testRejectMSAWithBadChar(self):
         f = open("submissions/files/5ptpA_badcharmsa.fasta", "rb").read()
         self.assertFalse(seq(f))
+
+    def testAcceptMSAMemoryView(self):
+        f = open("submissions/files/5ptpA_msa.fasta", "rb").read()
+        self.assertTrue(seq(memoryview(f)))
+
+    def testRegistryHoldsOnlyValidators(self):
+        self.assertIn('seq', REGISTRY)
+        self.assertIs(REGISTRY['png'], png)
+        self.assertNotIn('Counter', REGISTRY)
+        self.assertFalse([name for name in REGISTRY if name.startswith("_")])
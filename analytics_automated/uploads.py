@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+'''
+    Enforces MAX_UPLOAD_SIZE while the request body is read rather than
+    once it has all been spooled to disk. List LimitedUploadHandler first in
+    FILE_UPLOAD_HANDLERS. A request whose Content-Length could not hold a
+    file within the limit is not read at all, and an upload which passes the
+    limit is abandoned at that chunk, though the rest of the body is still
+    read off the connection so that the client gets the response rather
+    than a reset. Either way the request is left marked with upload_rejected
+    so that the view can answer 413.
+'''
+
+
+def upload_rejected(request):
+    """
+        The reason the request's upload was abandoned, or None
+    """
+    return getattr(request, 'upload_rejected', None)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+
+    def reject(self):
+        self.request.upload_rejected = "Input data is larger than the " + \
+                                       str(settings.MAX_UPLOAD_SIZE) + \
+                                       " byte limit"
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        self.received = 0
+        if not settings.MAX_UPLOAD_SIZE:
+            return None
+        # the form fields around the file are capped by
+        # DATA_UPLOAD_MAX_MEMORY_SIZE so anything beyond both is too large
+        allowance = settings.MAX_UPLOAD_SIZE + \
+            (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+        if content_length > allowance:
+            self.reject()
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super(LimitedUploadHandler, self).new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if settings.MAX_UPLOAD_SIZE and \
+           self.received > settings.MAX_UPLOAD_SIZE:
+            self.reject()
+            raise StopUpload()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -1,24 +1,32 @@
+import sys
 import imghdr
+import inspect
 import re
 from collections import Counter
 
+'''
+    Validators are passed a read only bytes-like view of the upload (bytes,
+    a memoryview or an mmap) so they must not assume they have a bytes
+    object. imghdr only needs the first 32 bytes of the file
+'''
+
 
 def gif(file_data):
-    if 'gif' in imghdr.what('', file_data):
+    if 'gif' in imghdr.what('', bytes(file_data[:32])):
         return True
     else:
         return False
 
 
 def png(file_data):
-    if 'png' in imghdr.what('', file_data):
+    if 'png' in imghdr.what('', bytes(file_data[:32])):
         return True
     else:
         return False
 
 
 def jpeg(file_data):
-    if 'jpeg' in imghdr.what('', file_data):
+    if 'jpeg' in imghdr.what('', bytes(file_data[:32])):
         return True
     else:
         return False
@@ -29,9 +37,8 @@ def none(data):
 
 
 def pdb_file(file_data):
-    string_data = file_data.decode("utf-8")
-    pdb_pattern = re.compile("ATOM\s+\d+", re.IGNORECASE)
-    if re.search(pdb_pattern, string_data):
+    pdb_pattern = re.compile(rb"ATOM\s+\d+", re.IGNORECASE)
+    if re.search(pdb_pattern, file_data):
         # print("yay")
         return True
     else:
@@ -62,10 +69,15 @@ def __test_seq(seq):
     return True
 
 
+def __lines(file_data):
+    # walk the lines of the view without decoding the whole file at once
+    for line in re.finditer(rb"[^\r\n]+", file_data):
+        yield line.group().decode("utf-8")
+
+
 def seq(file_data):
-    string_data = file_data.decode("utf-8")
-    header_count = string_data.count(">")
-    lines = string_data.splitlines()
+    header_count = sum(line.count(">") for line in __lines(file_data))
+    lines = __lines(file_data)
 
     if header_count <= 1:
         lines = [x for x in lines if not x.startswith(('>', ';'))]
@@ -93,3 +105,10 @@ def seq(file_data):
                 return False
 
         return True
+
+
+# Every public validator, resolved once by name. ValidatorTypes rows are
+# named after these entries
+REGISTRY = {name: func for name, func in
+            inspect.getmembers(sys.modules[__name__], inspect.isfunction)
+            if not name.startswith("_") and func.__module__ == __name__}
@@ -50,6 +50,22 @@ DEFAULT_JOB_PRIORITY = 1
 LOGGED_IN_JOB_PRIORITY = 2
 QUEUE_HOG_SIZE = 10
 QUEUE_HARD_LIMIT = 15
+MAX_UPLOAD_SIZE = 52428800  # bytes, None for no limit
+COALESCE_SUBMISSIONS = True
+ASYNC_SUBMISSIONS = False
+MAX_FASTA_RECORDS = 10000
+INPUT_HANDOFF = 'hardlink'  # 'hardlink', 'symlink' or 'copy'
+FAIR_SHARE = False
+FAIR_SHARE_SLOTS = 50
+FAIR_SHARE_LOGGED_IN_WEIGHT = 2
+FAIR_SHARE_WINDOW = 3600  # seconds
+BACKEND_MIN_FREE_DISK = 1073741824  # bytes, None to ignore free disk
+CANCEL_INSPECT_TIMEOUT = 1.0  # seconds
+HEARTBEAT_INTERVAL = 30  # seconds, None to turn heartbeats off
+HEARTBEAT_TIMEOUT = 180  # seconds
+REAPER_MAX_REQUEUES = 1
+STUCK_SUBMISSION_TIMEOUT = 172800  # seconds, None to never time out
+TOKEN_INDEX_REFRESH = 300  # seconds, None to build once per process
 # EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 # EMAIL_HOST = 'smtp.xx.xx.xx'
 EMAIL_PORT = 25
@@ -61,6 +77,8 @@ EMAIL_MESSAGE_STRING = 'Your analysis is complete.\nYou can retrieve the ' \
                        'results from http://127.0.0.1:4000/interface/' \
                        '&uuid='
 EMAIL_DELETE_AFTER_USE = True
+NOTIFICATION_QUEUE = 'notifications'
+WORKER_METRICS_PORT = None  # e.g. 9100 to export worker metrics
 
 # Celery Settings
 CELERY_BROKER_URL = "redis://localhost:6379/0"
@@ -165,6 +183,13 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
 
+# LimitedUploadHandler stops reading an upload once it passes MAX_UPLOAD_SIZE
+FILE_UPLOAD_HANDLERS = [
+    'analytics_automated.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
 MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
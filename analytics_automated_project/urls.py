@@ -22,6 +22,7 @@ from django.conf.urls.static import static
 from rest_framework.urlpatterns import format_suffix_patterns
 
 from analytics_automated import api
+from analytics_automated import metrics
 
 urlpatterns = [
      url(r'^admin/', include('smuggler.urls')),
@@ -34,6 +35,10 @@ urlpatterns = [
          '(?P<UUID>.{8}-.{4}-.{4}-.{4}-.{12})$',
          api.SubmissionDetails.as_view(),
          name="submissionDetail"),
+     url(r'^analytics_automated/submission/cancel/'
+         '(?P<UUID>.{8}-.{4}-.{4}-.{4}-.{12})$',
+         api.CancelSubmission.as_view(),
+         name="cancel"),
      url(r'^analytics_automated/submission/'
          '(?P<UUID>.{8}-.{4}-.{4}-.{4}-.{12})$',
          api.BatchDetails.as_view(),
@@ -45,11 +50,14 @@ urlpatterns = [
          api.Endpoints.as_view(), name="endpoints"),
      url(r'^analytics_automated/jobtimes/$',
          api.JobTimes.as_view(), name="jobtimes"),
+     url(r'^analytics_automated/steptimes/$',
+         api.StepTimes.as_view(), name="steptimes"),
      url(r'^login/$', auth_views.LoginView),
      url(r'^logout/$', auth_views.LogoutView),
 
 ]
 urlpatterns = format_suffix_patterns(urlpatterns, allowed=['json', 'html'])
+urlpatterns += [url(r'^metrics$', metrics.metrics, name="metrics")]
 
 # UNDERNEATH your urlpatterns definition, add the following two lines:
 if settings.DEBUG:
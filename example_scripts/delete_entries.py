@@ -15,17 +15,16 @@ django.setup()
 from analytics_automated.models import Backend, Job, Task, Step
 from analytics_automated.models import Parameter, Submission, Result
 from analytics_automated.models import Validator, BackendUser, Message
+from analytics_automated.tasks import reap_stuck_submissions
 
 
 def delete_old_entries():
     submission_objects = Submission.objects.filter(
                          modified__lte=timezone.now() -
                          timedelta(days=10)).update(email="ERASED")
-    submission_objects = Submission.objects.filter(
-                         modified__lte=timezone.now() -
-                         timedelta(days=2), status=Submission.RUNNING
-                         ).update(status=Submission.ERROR,
-                                  last_message="JOB TIMED OUT")
+    # RUNNING submissions which have gone quiet are requeued, crashed or
+    # timed out after STUCK_SUBMISSION_TIMEOUT
+    reap_stuck_submissions()
     old_objects = Message.objects.filter(
                           modified__lte=timezone.now() -
                           timedelta(days=10)).delete()
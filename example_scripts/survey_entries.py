@@ -15,16 +15,16 @@ django.setup()
 from analytics_automated.models import Backend, Job, Task, Step
 from analytics_automated.models import Parameter, Submission, Result
 from analytics_automated.models import Validator, BackendUser, Message
+from analytics_automated.tasks import reap_stuck_submissions
 
 
 def survey_old_entries():
-    submission_objects = Submission.objects.filter(
-                         modified__lte=timezone.now() -
-                         timedelta(days=2), status=Submission.RUNNING
-                         ).update(status=Submission.ERROR,
-                                  last_message="JOB TIMED OUT")
-    # for submission in submission_objects:
-    #     print(submission.pk, submission.status, submission.last_message)
+    # submissions whose worker has stopped sending heartbeats are requeued
+    # or marked as crashed and those which have not changed in
+    # STUCK_SUBMISSION_TIMEOUT are timed out; better still schedule this
+    # with celery beat
+    reaped = reap_stuck_submissions()
+    print("Reaped", reaped, "submissions")
 
 
 # Start execution here!